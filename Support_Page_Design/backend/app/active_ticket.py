@@ -0,0 +1,78 @@
+"""Denormalized pointer from a support session to its current ticket.
+
+``support_sessions.active_ticket_id`` names the ticket the visitor currently
+sees: the newest one, or one that was reopened since. A Session ``after_flush``
+hook moves the pointer in the same transaction as the ticket insert or reopen,
+so every code path creating tickets keeps it current, and a session is loaded
+together with its ticket by one primary-key join (``load_session``) instead of
+sorting the session's tickets. Closing a ticket leaves the pointer in place:
+the visitor keeps seeing that ticket, as closed, until a new one is opened.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from .database import SessionLocal
+from .models import SupportSession, SupportTicket
+
+ACTIVE_STATUSES = ("open", "claimed")
+
+
+def load_session(
+    db: Session, session_id: str, active_only: bool = False
+) -> Tuple[Optional[SupportSession], Optional[SupportTicket]]:
+    """The support session and its current ticket; with ``active_only`` a closed ticket is returned as None"""
+    row = db.execute(
+        select(SupportSession, SupportTicket)
+        .outerjoin(SupportTicket, SupportTicket.id == SupportSession.active_ticket_id)
+        .where(SupportSession.id == session_id)
+    ).first()
+    if row is None:
+        return None, None
+    session, ticket = row
+    if active_only and ticket is not None and ticket.status not in ACTIVE_STATUSES:
+        ticket = None
+    return session, ticket
+
+
+def _is_reopen(ticket: SupportTicket) -> bool:
+    history = inspect(ticket).attrs.status.history
+    return "closed" in (history.deleted or ()) and ticket.status in ACTIVE_STATUSES
+
+
+def _move_pointers(session: Session, flush_context) -> None:
+    current: Dict[str, SupportTicket] = {}
+    for obj in session.new:
+        if isinstance(obj, SupportTicket):
+            newest = current.get(obj.session_id)
+            if newest is None or (obj.created_at or datetime.min, obj.id) > (newest.created_at or datetime.min, newest.id):
+                current[obj.session_id] = obj
+    for obj in session.dirty:
+        if isinstance(obj, SupportTicket) and obj.session_id not in current and _is_reopen(obj):
+            current[obj.session_id] = obj
+    if not current:
+        return
+
+    conn = session.connection()
+    for session_id, ticket in current.items():
+        conn.execute(
+            update(SupportSession.__table__)
+            .where(SupportSession.__table__.c.id == session_id)
+            .values(active_ticket_id=ticket.id)
+        )
+        # Keep an already loaded SupportSession in step with the row
+        loaded = session.identity_map.get(identity_key(SupportSession, session_id))
+        if loaded is not None:
+            set_committed_value(loaded, "active_ticket_id", ticket.id)
+
+
+def install_active_ticket_hooks(session_factory=SessionLocal) -> None:
+    if not event.contains(session_factory, "after_flush", _move_pointers):
+        event.listen(session_factory, "after_flush", _move_pointers)
@@ -0,0 +1,231 @@
+"""Admission control: rate limits, concurrency cap, body size limit and overload shedding.
+
+Implemented as a pure ASGI middleware so rejected requests never reach
+routing, body parsing or the database. Only ``/api/`` paths are controlled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from sqlalchemy.pool import QueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .attachments import ATTACHMENT_MAX_BYTES, UPLOAD_OVERHEAD_BYTES
+from .database import DB_MAX_OVERFLOW, engine
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+ADMISSION_ENABLED = _env_flag("ADMISSION_ENABLED", "true")
+RATE_LIMIT_SESSION_RPS = float(os.getenv("RATE_LIMIT_SESSION_RPS", "5"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "20"))
+RATE_LIMIT_IP_RPS = float(os.getenv("RATE_LIMIT_IP_RPS", "20"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "60"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "100"))
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(64 * 1024)))
+SHED_LOOP_LAG_MS = float(os.getenv("SHED_LOOP_LAG_MS", "250"))
+SHED_POOL_UTILIZATION = float(os.getenv("SHED_POOL_UTILIZATION", "0.9"))
+
+# Never rate limited or shed: Telegram retries on its own and health checks must stay green
+EXEMPT_PATHS = ("/api/telegram/webhook", "/api/health")
+
+_SESSION_PATH_RE = re.compile(r"^/api/session/([^/]+)")
+# Attachment uploads are streamed and capped by the endpoint itself
+_UPLOAD_PATH_RE = re.compile(r"^/api/session/[^/]+/attachments$")
+_MAX_TRACKED_KEYS = 50_000
+_LAG_SAMPLE_SECONDS = 0.1
+
+
+class TokenBucketMap:
+    """Token buckets keyed by string, evicting the least recently used keys beyond ``max_keys``"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = _MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """Consume a token; returns 0 when allowed, otherwise seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            retry_after = 0.0
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class LoadMonitor:
+    """Tracks event-loop lag (EWMA of scheduling delay) and DB pool utilisation"""
+
+    def __init__(self):
+        self.loop_lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._sample())
+
+    async def _sample(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(_LAG_SAMPLE_SECONDS)
+            lag_ms = max((time.perf_counter() - started - _LAG_SAMPLE_SECONDS) * 1000, 0.0)
+            self.loop_lag_ms = 0.8 * self.loop_lag_ms + 0.2 * lag_ms
+
+    @staticmethod
+    def pool_utilization() -> float:
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            # StaticPool / NullPool / SingletonThreadPool have no fixed capacity
+            return 0.0
+        capacity = pool.size() + max(DB_MAX_OVERFLOW, 0)
+        return pool.checkedout() / capacity if capacity > 0 else 0.0
+
+    def overloaded(self) -> Optional[str]:
+        if self.loop_lag_ms > SHED_LOOP_LAG_MS:
+            return "event loop lag"
+        if self.pool_utilization() >= SHED_POOL_UTILIZATION:
+            return "database pool saturated"
+        return None
+
+    def pressure(self) -> float:
+        """0 when idle, 1 at the shedding thresholds"""
+        lag = self.loop_lag_ms / max(SHED_LOOP_LAG_MS, 1.0)
+        return min(1.0, max(lag, self.pool_utilization() / max(SHED_POOL_UTILIZATION, 0.01)))
+
+
+# Singleton instance
+load_monitor = LoadMonitor()
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.session_buckets = TokenBucketMap(RATE_LIMIT_SESSION_RPS, RATE_LIMIT_SESSION_BURST)
+        self.ip_buckets = TokenBucketMap(RATE_LIMIT_IP_RPS, RATE_LIMIT_IP_BURST)
+        self.monitor = load_monitor
+        self.in_flight = 0
+        self.rejected = {"rate_limited": 0, "overloaded": 0, "too_large": 0}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not ADMISSION_ENABLED or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        self.monitor.ensure_started()
+        path = scope["path"]
+        exempt = path.startswith(EXEMPT_PATHS)
+
+        is_upload = _UPLOAD_PATH_RE.match(path) is not None
+        body_limit = ATTACHMENT_MAX_BYTES + UPLOAD_OVERHEAD_BYTES if is_upload else MAX_REQUEST_BODY_BYTES
+        content_length = self._content_length(scope)
+        if content_length is not None and content_length > body_limit:
+            self.rejected["too_large"] += 1
+            await self._reject(send, 413, "Request body too large")
+            return
+
+        if not exempt:
+            retry_after = self._rate_limit(scope)
+            if retry_after:
+                self.rejected["rate_limited"] += 1
+                await self._reject(send, 429, "Too many requests", retry_after)
+                return
+
+            reason = "too many concurrent requests" if self.in_flight >= MAX_CONCURRENT_REQUESTS else self.monitor.overloaded()
+            if reason:
+                self.rejected["overloaded"] += 1
+                await self._reject(send, 503, f"Service overloaded ({reason})", 1)
+                return
+
+        if content_length is None and not is_upload and scope["method"] in ("POST", "PUT", "PATCH"):
+            # Chunked body: read it up front (bounded by the limit) so oversized bodies are refused before parsing
+            buffered = await self._read_limited(receive)
+            if buffered is None:
+                self.rejected["too_large"] += 1
+                await self._reject(send, 413, "Request body too large")
+                return
+            receive = self._replay(buffered, receive)
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    async def _read_limited(receive: Receive) -> Optional[List[Message]]:
+        messages: List[Message] = []
+        received = 0
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                return messages
+            received += len(message.get("body", b""))
+            if received > MAX_REQUEST_BODY_BYTES:
+                return None
+            if not message.get("more_body", False):
+                return messages
+
+    @staticmethod
+    def _replay(messages: List[Message], receive: Receive) -> Receive:
+        pending = list(messages)
+
+        async def replay_receive() -> Message:
+            if pending:
+                return pending.pop(0)
+            return await receive()
+
+        return replay_receive
+
+    def _rate_limit(self, scope: Scope) -> float:
+        retry_after = self.ip_buckets.take(self._client_ip(scope))
+        match = _SESSION_PATH_RE.match(scope["path"])
+        if match and not retry_after:
+            retry_after = self.session_buckets.take(match.group(1))
+        return retry_after
+
+    @staticmethod
+    def _content_length(scope: Scope) -> Optional[int]:
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    @staticmethod
+    def _client_ip(scope: Scope) -> str:
+        # uvicorn's proxy_headers has already replaced this with the X-Forwarded-For address added by the nearest
+        # proxy in FORWARDED_ALLOW_IPS; the header itself is client-controlled and never read here
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    async def _reject(send: Send, status: int, detail: str, retry_after: Optional[float] = None) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if retry_after:
+            headers.append((b"retry-after", str(max(1, math.ceil(retry_after))).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
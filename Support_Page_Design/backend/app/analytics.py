@@ -0,0 +1,315 @@
+"""Incrementally maintained support analytics rollups.
+
+Ticket lifecycle transitions (created, claimed, closed, reopened) are detected
+in a Session ``after_flush`` hook and applied to ``ticket_stats_hourly`` and
+``agent_load`` with upserts in the same transaction, so the rollups never drift
+from the tickets they describe. ``/api/stats`` reads only from these tables.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, engine as default_engine
+from .models import AgentLoad, SupportAgent, SupportTicket, TicketStatsHourly
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = "General"
+
+_HOURLY_COUNTERS = (
+    "created_count",
+    "claimed_count",
+    "closed_count",
+    "reopened_count",
+    "claim_seconds_total",
+    "close_seconds_total",
+)
+_AGENT_COUNTERS = ("open_tickets", "claimed_total", "closed_total")
+
+
+def _bucket(moment: Optional[datetime]) -> datetime:
+    return (moment or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+def _seconds_between(start: Optional[datetime], end: Optional[datetime]) -> float:
+    if start is None or end is None:
+        return 0.0
+    return max((end - start).total_seconds(), 0.0)
+
+
+def _upsert(conn: Connection, model, keys: Dict[str, Any], increments: Dict[str, Any], assign: Optional[Dict[str, Any]] = None) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE adding ``increments`` to the existing row"""
+    dialect_insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    table = model.__table__
+    assign = assign or {}
+
+    stmt = dialect_insert(table).values(**keys, **increments, **assign)
+    updates = {name: table.c[name] + stmt.excluded[name] for name in increments}
+    updates.update({name: stmt.excluded[name] for name in assign})
+    conn.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=updates))
+
+
+def _record_hourly(conn: Connection, moment: Optional[datetime], category: Optional[str], priority: Optional[int], **increments) -> None:
+    keys = {"bucket": _bucket(moment), "category": category or DEFAULT_CATEGORY, "priority": priority or 0}
+    counters = {name: 0 for name in _HOURLY_COUNTERS}
+    counters.update(increments)
+    _upsert(conn, TicketStatsHourly, keys, counters)
+
+
+def _record_agent(conn: Connection, agent_id: Optional[int], last_claimed_at: Optional[datetime] = None, **increments) -> None:
+    if agent_id is None:
+        return
+    counters = {name: 0 for name in _AGENT_COUNTERS}
+    counters.update(increments)
+    assign = {"last_claimed_at": last_claimed_at} if last_claimed_at is not None else None
+    _upsert(conn, AgentLoad, {"agent_id": agent_id}, counters, assign)
+
+
+def _previous(ticket: SupportTicket, attribute: str):
+    history = inspect(ticket).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(ticket, attribute)
+
+
+def _apply_ticket_transitions(session: Session, flush_context) -> None:
+    conn = session.connection()
+
+    for ticket in session.new:
+        if not isinstance(ticket, SupportTicket):
+            continue
+        _record_hourly(conn, ticket.created_at, ticket.category, ticket.priority, created_count=1)
+
+    for ticket in session.dirty:
+        if not isinstance(ticket, SupportTicket):
+            continue
+        history = inspect(ticket).attrs.status.history
+        if not history.has_changes() or not history.deleted:
+            continue
+        old_status, new_status = history.deleted[0], ticket.status
+        if old_status == new_status:
+            continue
+        record_transition(
+            conn,
+            old_status,
+            new_status,
+            category=ticket.category,
+            priority=ticket.priority,
+            created_at=ticket.created_at,
+            claimed_at=ticket.claimed_at,
+            closed_at=ticket.closed_at,
+            previous_agent_id=_previous(ticket, "assigned_agent_id"),
+            agent_id=ticket.assigned_agent_id,
+        )
+
+
+def _transition_deltas(
+    old_status: str,
+    new_status: str,
+    *,
+    category: Optional[str],
+    priority: Optional[int],
+    created_at: Optional[datetime],
+    claimed_at: Optional[datetime],
+    closed_at: Optional[datetime],
+    previous_agent_id: Optional[int],
+    agent_id: Optional[int],
+) -> Tuple[List[Tuple[Tuple[datetime, str, int], Dict[str, float]]], List[Tuple[int, Dict[str, int], Optional[datetime]]]]:
+    """Rollup increments for one ticket change: (hourly key, counters) and (agent_id, counters, last_claimed_at) lists"""
+    def hourly(moment: Optional[datetime], **increments) -> Tuple[Tuple[datetime, str, int], Dict[str, float]]:
+        return (_bucket(moment), category or DEFAULT_CATEGORY, priority or 0), increments
+
+    if old_status == new_status == "claimed":
+        # Reassigned from one agent to another
+        if previous_agent_id == agent_id:
+            return [], []
+        agents = [(agent_id, {"open_tickets": 1, "claimed_total": 1}, claimed_at)]
+        if previous_agent_id is not None:
+            agents.append((previous_agent_id, {"open_tickets": -1}, None))
+        return [], agents
+    if new_status == "claimed":
+        return (
+            [hourly(claimed_at, claimed_count=1, claim_seconds_total=_seconds_between(created_at, claimed_at))],
+            [(agent_id, {"open_tickets": 1, "claimed_total": 1}, claimed_at)],
+        )
+    if new_status == "closed":
+        agents = [(previous_agent_id, {"open_tickets": -1, "closed_total": 1}, None)] if old_status == "claimed" else []
+        return [hourly(closed_at, closed_count=1, close_seconds_total=_seconds_between(created_at, closed_at))], agents
+    if new_status == "open" and old_status == "closed":
+        return [hourly(datetime.utcnow(), reopened_count=1)], []
+    if new_status == "open" and old_status == "claimed":
+        # Unassigned without closing
+        return [], [(previous_agent_id, {"open_tickets": -1}, None)]
+    return [], []
+
+
+def record_transition(conn: Connection, old_status: str, new_status: str, **ticket) -> None:
+    """Apply one ticket status change to the rollups (keyword arguments as for ``_transition_deltas``)"""
+    hourly, agents = _transition_deltas(old_status, new_status, **ticket)
+    for (moment, category, priority), increments in hourly:
+        _record_hourly(conn, moment, category, priority, **increments)
+    for agent_id, increments, last_claimed_at in agents:
+        _record_agent(conn, agent_id, last_claimed_at=last_claimed_at, **increments)
+
+
+def record_transitions(conn: Connection, old_status: str, new_status: str, tickets: Iterable[Dict[str, Any]]) -> None:
+    """Apply the same status change for many tickets with one upsert per rollup row.
+
+    Used by set-based updates (app.bulk) that bypass the ORM flush hooks.
+    """
+    hourly: Dict[Tuple[datetime, str, int], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    agents: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    last_claimed: Dict[int, datetime] = {}
+
+    for ticket in tickets:
+        hourly_deltas, agent_deltas = _transition_deltas(old_status, new_status, **ticket)
+        for key, increments in hourly_deltas:
+            for name, value in increments.items():
+                hourly[key][name] += value
+        for agent_id, increments, last_claimed_at in agent_deltas:
+            if agent_id is None:
+                continue
+            for name, value in increments.items():
+                agents[agent_id][name] += value
+            if last_claimed_at is not None:
+                last_claimed[agent_id] = max(last_claimed_at, last_claimed.get(agent_id, last_claimed_at))
+
+    for (moment, category, priority), increments in hourly.items():
+        _record_hourly(conn, moment, category, priority, **increments)
+    for agent_id, increments in agents.items():
+        _record_agent(conn, agent_id, last_claimed_at=last_claimed.get(agent_id), **increments)
+
+
+def install_rollup_hooks(session_factory=SessionLocal) -> None:
+    if not event.contains(session_factory, "after_flush", _apply_ticket_transitions):
+        event.listen(session_factory, "after_flush", _apply_ticket_transitions)
+
+
+def rebuild_rollups(engine: Engine) -> None:
+    """Recompute all rollups from the tickets table in one streaming pass"""
+    hourly: Dict[Tuple[datetime, str, int], Dict[str, float]] = defaultdict(lambda: {name: 0 for name in _HOURLY_COUNTERS})
+    agents: Dict[int, Dict[str, Any]] = defaultdict(lambda: {"open_tickets": 0, "claimed_total": 0, "closed_total": 0, "last_claimed_at": None})
+
+    with Session(engine) as db:
+        rows = db.execute(
+            select(
+                SupportTicket.status,
+                SupportTicket.category,
+                SupportTicket.priority,
+                SupportTicket.assigned_agent_id,
+                SupportTicket.created_at,
+                SupportTicket.claimed_at,
+                SupportTicket.closed_at,
+            ).execution_options(yield_per=5000)
+        )
+        for status, category, priority, agent_id, created_at, claimed_at, closed_at in rows:
+            category = category or DEFAULT_CATEGORY
+            priority = priority or 0
+            hourly[(_bucket(created_at), category, priority)]["created_count"] += 1
+            if claimed_at is not None:
+                counters = hourly[(_bucket(claimed_at), category, priority)]
+                counters["claimed_count"] += 1
+                counters["claim_seconds_total"] += _seconds_between(created_at, claimed_at)
+            if status == "closed":
+                counters = hourly[(_bucket(closed_at), category, priority)]
+                counters["closed_count"] += 1
+                counters["close_seconds_total"] += _seconds_between(created_at, closed_at)
+            if agent_id is not None and claimed_at is not None:
+                agent = agents[agent_id]
+                agent["claimed_total"] += 1
+                agent["last_claimed_at"] = max(filter(None, (agent["last_claimed_at"], claimed_at)))
+                if status == "claimed":
+                    agent["open_tickets"] += 1
+                elif status == "closed":
+                    agent["closed_total"] += 1
+
+    with engine.begin() as conn:
+        conn.execute(TicketStatsHourly.__table__.delete())
+        conn.execute(AgentLoad.__table__.delete())
+        if hourly:
+            conn.execute(
+                TicketStatsHourly.__table__.insert(),
+                [
+                    {"bucket": bucket, "category": category, "priority": priority, **counters}
+                    for (bucket, category, priority), counters in hourly.items()
+                ],
+            )
+        if agents:
+            conn.execute(AgentLoad.__table__.insert(), [{"agent_id": agent_id, **values} for agent_id, values in agents.items()])
+    logger.info("Rebuilt analytics rollups: %d hourly rows, %d agents", len(hourly), len(agents))
+
+
+def ensure_rollups(engine: Engine) -> None:
+    """Backfill the rollups once when they are empty but tickets already exist"""
+    with Session(engine) as db:
+        has_rollups = db.execute(select(TicketStatsHourly.bucket).limit(1)).first() is not None
+        has_tickets = db.execute(select(SupportTicket.id).limit(1)).first() is not None
+    if has_tickets and not has_rollups:
+        rebuild_rollups(engine)
+
+
+def read_stats(db: Session, hours: int) -> Dict[str, Any]:
+    """Aggregate the rollups for the last ``hours`` hours; cost depends only on the window size"""
+    since = _bucket(datetime.utcnow()) - timedelta(hours=hours - 1)
+    sums = [func.coalesce(func.sum(getattr(TicketStatsHourly, name)), 0).label(name) for name in _HOURLY_COUNTERS]
+
+    def averages(row) -> Dict[str, Any]:
+        return {
+            "created": int(row.created_count),
+            "claimed": int(row.claimed_count),
+            "closed": int(row.closed_count),
+            "reopened": int(row.reopened_count),
+            "avgTimeToClaimSeconds": row.claim_seconds_total / row.claimed_count if row.claimed_count else None,
+            "avgTimeToCloseSeconds": row.close_seconds_total / row.closed_count if row.closed_count else None,
+        }
+
+    totals = db.execute(select(*sums).where(TicketStatsHourly.bucket >= since)).one()
+    by_category = db.execute(
+        select(TicketStatsHourly.category, TicketStatsHourly.priority, *sums)
+        .where(TicketStatsHourly.bucket >= since)
+        .group_by(TicketStatsHourly.category, TicketStatsHourly.priority)
+        .order_by(TicketStatsHourly.category, TicketStatsHourly.priority)
+    ).all()
+    agents = db.execute(
+        select(AgentLoad, SupportAgent.name)
+        .join(SupportAgent, SupportAgent.id == AgentLoad.agent_id)
+        .order_by(AgentLoad.open_tickets.desc())
+    ).all()
+
+    return {
+        "windowHours": hours,
+        "since": since,
+        "totals": averages(totals),
+        "byCategory": [
+            {"category": row.category, "priority": row.priority, **averages(row)} for row in by_category
+        ],
+        "agents": [
+            {
+                "agentId": load.agent_id,
+                "name": name,
+                "openTickets": load.open_tickets,
+                "claimedTotal": load.claimed_total,
+                "closedTotal": load.closed_total,
+                "lastClaimedAt": load.last_claimed_at,
+            }
+            for load, name in agents
+        ],
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild"]:
+        logging.basicConfig(level=logging.INFO)
+        rebuild_rollups(default_engine)
+    else:
+        print("Usage: python -m app.analytics rebuild")
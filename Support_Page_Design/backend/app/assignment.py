@@ -0,0 +1,233 @@
+"""Opt-in automatic assignment of new tickets to the least-loaded active agent.
+
+``AgentPool`` keeps a heap of active agents ordered by (open claimed tickets,
+last assignment time), so the least busy, longest idle agent is found in
+O(log n). The heap is rebuilt from the database on startup and then kept in
+sync by Session hooks: load deltas from ticket and agent changes are collected
+at flush time and applied only after the transaction commits.
+
+Each worker process has its own pool; the database remains the source of
+truth and ``claim_ticket`` refuses tickets that already have an agent.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import SupportAgent, SupportTicket
+
+logger = logging.getLogger(__name__)
+
+AUTO_ASSIGN_ENABLED = os.getenv("AUTO_ASSIGN_ENABLED", "false").lower() in ("1", "true", "yes")
+# Cap for agents without their own max_open_tickets
+AUTO_ASSIGN_MAX_OPEN = int(os.getenv("AUTO_ASSIGN_MAX_OPEN", "5"))
+
+_PENDING_KEY = "agent_pool_pending"
+
+
+@dataclass
+class _AgentSlot:
+    agent_id: int
+    open_tickets: int
+    last_assigned_at: float
+    max_open: int
+    is_active: bool
+    version: int = 0
+
+
+class AgentPool:
+    def __init__(self, default_max_open: int):
+        self.default_max_open = default_max_open
+        self._slots: Dict[int, _AgentSlot] = {}
+        self._heap: List[Tuple[int, float, int, int]] = []
+        # Hooks may fire from threadpool workers as well as the event loop thread
+        self._lock = threading.Lock()
+
+    def rebuild(self, db: Session) -> None:
+        """Reload agents and their open claimed-ticket counts from the database"""
+        loads = {
+            agent_id: (count, last_claimed_at)
+            for agent_id, count, last_claimed_at in db.execute(
+                select(SupportTicket.assigned_agent_id, func.count(), func.max(SupportTicket.claimed_at))
+                .where(SupportTicket.status == "claimed")
+                .where(SupportTicket.assigned_agent_id.is_not(None))
+                .group_by(SupportTicket.assigned_agent_id)
+            )
+        }
+        # Away agents keep a slot so their load stays current for when they come back
+        agents = db.execute(select(SupportAgent)).scalars().all()
+
+        with self._lock:
+            self._slots.clear()
+            self._heap.clear()
+            for agent in agents:
+                count, last_claimed_at = loads.get(agent.id, (0, None))
+                self._slots[agent.id] = _AgentSlot(
+                    agent_id=agent.id,
+                    open_tickets=count,
+                    last_assigned_at=last_claimed_at.timestamp() if last_claimed_at else 0.0,
+                    max_open=agent.max_open_tickets or self.default_max_open,
+                    is_active=bool(agent.is_active),
+                )
+                if agent.is_active:
+                    self._push(self._slots[agent.id])
+        logger.info("Agent pool rebuilt with %d agents", len(self._slots))
+
+    def _push(self, slot: _AgentSlot) -> None:
+        slot.version += 1
+        heapq.heappush(self._heap, (slot.open_tickets, slot.last_assigned_at, slot.agent_id, slot.version))
+        # Stale entries are dropped lazily; compact when they dominate the heap
+        if len(self._heap) > 4 * len(self._slots) + 64:
+            self._heap = [
+                (s.open_tickets, s.last_assigned_at, s.agent_id, s.version) for s in self._slots.values() if s.is_active
+            ]
+            heapq.heapify(self._heap)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._slots)
+
+    def pick(self) -> Optional[int]:
+        """Return the least-loaded active agent with spare capacity, without reserving it"""
+        with self._lock:
+            while self._heap:
+                _, _, agent_id, version = self._heap[0]
+                slot = self._slots.get(agent_id)
+                if slot is None or slot.version != version or not slot.is_active:
+                    heapq.heappop(self._heap)
+                    continue
+                if slot.open_tickets >= slot.max_open:
+                    # Re-pushed by adjust() once the agent frees up
+                    heapq.heappop(self._heap)
+                    continue
+                return agent_id
+            return None
+
+    def adjust(self, agent_id: int, delta: int, assigned_at: Optional[datetime] = None) -> None:
+        with self._lock:
+            slot = self._slots.get(agent_id)
+            if slot is None:
+                return
+            slot.open_tickets = max(slot.open_tickets + delta, 0)
+            if assigned_at is not None:
+                slot.last_assigned_at = assigned_at.timestamp()
+            if slot.is_active:
+                self._push(slot)
+
+    def upsert_agent(self, agent_id: int, is_active: bool, max_open: Optional[int]) -> None:
+        """Apply an agent's availability or cap change; inactive agents keep their slot (and load) but leave the heap"""
+        with self._lock:
+            slot = self._slots.get(agent_id)
+            if slot is None:
+                # Every agent known at rebuild has a slot, so this is a new agent without claimed tickets
+                slot = _AgentSlot(agent_id, 0, datetime.utcnow().timestamp(), max_open or self.default_max_open, is_active)
+                self._slots[agent_id] = slot
+            slot.is_active = is_active
+            slot.max_open = max_open or self.default_max_open
+            if is_active:
+                self._push(slot)
+
+
+def claim_ticket(ticket: Optional[SupportTicket], agent: SupportAgent, claimed_at: Optional[datetime] = None) -> bool:
+    """Assign an unclaimed ticket to an agent; shared by manual claims and auto-assignment"""
+    if ticket is None or ticket.assigned_agent_id:
+        return False
+    ticket.assigned_agent_id = agent.id
+    ticket.status = "claimed"
+    ticket.claimed_at = claimed_at or datetime.utcnow()
+    return True
+
+
+def auto_assign(db: Session, ticket: SupportTicket) -> Optional[SupportAgent]:
+    """Claim ``ticket`` for the least-loaded agent; returns the agent or None when nobody has capacity"""
+    if not AUTO_ASSIGN_ENABLED:
+        return None
+    agent_id = agent_pool.pick()
+    if agent_id is None:
+        return None
+    agent = db.get(SupportAgent, agent_id)
+    if agent is None or not agent.is_active:
+        agent_pool.upsert_agent(agent_id, False, agent.max_open_tickets if agent is not None else None)
+        return None
+    return agent if claim_ticket(ticket, agent) else None
+
+
+def _value_before(obj, attribute: str):
+    history = inspect(obj).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        return None
+    return getattr(obj, attribute)
+
+
+def _collect_changes(session: Session, flush_context) -> None:
+    pending = session.info.setdefault(_PENDING_KEY, [])
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, SupportAgent):
+            state = inspect(obj)
+            if obj in session.new or state.attrs.is_active.history.has_changes() or state.attrs.max_open_tickets.history.has_changes():
+                pending.append(("agent", obj.id, obj.is_active, obj.max_open_tickets))
+        elif isinstance(obj, SupportTicket):
+            was_new = obj in session.new
+            old_status = None if was_new else _value_before(obj, "status")
+            old_agent = None if was_new else _value_before(obj, "assigned_agent_id")
+            before = old_agent if old_status == "claimed" else None
+            after = obj.assigned_agent_id if obj.status == "claimed" else None
+            if before == after:
+                continue
+            if before is not None:
+                pending.append(("load", before, -1, None))
+            if after is not None:
+                pending.append(("load", after, 1, obj.claimed_at))
+
+
+def queue_load_change(session: Session, agent_id: Optional[int], delta: int, assigned_at: Optional[datetime] = None) -> None:
+    """Record a load change made by a set-based UPDATE (invisible to the flush hook); applied after commit"""
+    if agent_id is not None:
+        session.info.setdefault(_PENDING_KEY, []).append(("load", agent_id, delta, assigned_at))
+
+
+def _apply_changes(session: Session) -> None:
+    for change in session.info.pop(_PENDING_KEY, []):
+        if change[0] == "agent":
+            _, agent_id, is_active, max_open = change
+            agent_pool.upsert_agent(agent_id, is_active, max_open)
+        else:
+            _, agent_id, delta, assigned_at = change
+            agent_pool.adjust(agent_id, delta, assigned_at)
+
+
+def _discard_changes(session: Session, *args) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def install_pool_hooks(session_factory=SessionLocal) -> None:
+    if event.contains(session_factory, "after_flush", _collect_changes):
+        return
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_soft_rollback", _discard_changes)
+
+
+def start_auto_assignment() -> None:
+    if not AUTO_ASSIGN_ENABLED:
+        return
+    install_pool_hooks()
+    with SessionLocal() as db:
+        agent_pool.rebuild(db)
+
+
+# Singleton instance
+agent_pool = AgentPool(AUTO_ASSIGN_MAX_OPEN)
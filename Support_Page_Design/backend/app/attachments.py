@@ -0,0 +1,197 @@
+"""Visitor file attachments: streaming multipart parsing and a content-addressed store.
+
+Uploads are parsed straight from the request stream and written chunk by
+chunk to a temporary file while their SHA-256 is computed, so memory use does
+not depend on the file size. The finished file is renamed to
+``<ATTACHMENT_DIR>/<sha[:2]>/<sha>``; identical uploads map to the same path
+and are stored once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, AsyncIterator, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+ATTACHMENT_DIR = Path(os.getenv("ATTACHMENT_DIR", str(Path(__file__).resolve().parent.parent / "attachments")))
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Room for multipart headers, boundaries and the optional caption field
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+_MAX_PART_HEADER_BYTES = 16 * 1024
+_MAX_FIELD_BYTES = 4096
+_PARAM_RE = re.compile(r';\s*([\w*-]+)="?([^";]*)"?')
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?')
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class MalformedUpload(Exception):
+    pass
+
+
+@dataclass
+class StoredFile:
+    sha256: str
+    size: int
+    filename: str
+    content_type: str
+
+    @property
+    def path(self) -> Path:
+        return path_for(self.sha256)
+
+
+def path_for(sha256: str) -> Path:
+    return ATTACHMENT_DIR / sha256[:2] / sha256
+
+
+def _clean_filename(name: Optional[str]) -> str:
+    name = os.path.basename((name or "").replace("\\", "/"))
+    name = "".join(ch for ch in name if ch.isprintable()).strip()
+    return name[:255] or "attachment"
+
+
+def _parse_part_headers(raw: bytes) -> Dict[str, str]:
+    headers: Dict[str, str] = {}
+    for line in raw.decode("utf-8", "replace").split("\r\n"):
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    disposition = headers.get("content-disposition", "")
+    for key, value in _PARAM_RE.findall(disposition):
+        headers[f"disposition.{key.lower()}"] = value
+    return headers
+
+
+async def iter_multipart(stream: AsyncIterator[bytes], boundary: bytes) -> AsyncIterator[Tuple[str, object]]:
+    """Incrementally parse a multipart body into ("part", headers), ("data", bytes) and ("end", None) events.
+
+    Only a delimiter-sized tail is kept between chunks, so a part's payload is
+    never held in memory as a whole.
+    """
+    delimiter = b"\r\n--" + boundary
+    keep = len(delimiter) - 1
+    # Treat the first boundary like the ones that follow a part
+    buffer = b"\r\n"
+    state = "preamble"
+
+    async for chunk in stream:
+        buffer += chunk
+        while True:
+            if state in ("preamble", "data"):
+                index = buffer.find(delimiter)
+                if index == -1:
+                    if state == "data" and len(buffer) > keep:
+                        yield "data", buffer[:-keep]
+                    buffer = buffer[-keep:]
+                    break
+                if state == "data":
+                    if index:
+                        yield "data", buffer[:index]
+                    yield "end", None
+                buffer = buffer[index + len(delimiter):]
+                state = "boundary"
+            if state == "boundary":
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b"--"):
+                    return
+                if not buffer.startswith(b"\r\n"):
+                    raise MalformedUpload("Invalid multipart boundary")
+                buffer = buffer[2:]
+                state = "headers"
+            if state == "headers":
+                index = buffer.find(b"\r\n\r\n")
+                if index == -1:
+                    if len(buffer) > _MAX_PART_HEADER_BYTES:
+                        raise MalformedUpload("Multipart part headers too large")
+                    break
+                yield "part", _parse_part_headers(buffer[:index])
+                buffer = buffer[index + 4:]
+                state = "data"
+
+    raise MalformedUpload("Truncated multipart body")
+
+
+def _write_chunk(handle: IO[bytes], digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    handle.write(chunk)
+
+
+def _commit_file(temp_path: Path, sha256: str) -> None:
+    final_path = path_for(sha256)
+    if final_path.exists():
+        # Same content already stored: keep the existing copy
+        temp_path.unlink()
+        return
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, final_path)
+
+
+async def receive_upload(request: Request, field_name: str = "file") -> Tuple[StoredFile, Dict[str, str]]:
+    """Stream the ``field_name`` file of a multipart request into the store; returns it with the text fields"""
+    match = _BOUNDARY_RE.search(request.headers.get("content-type", ""))
+    if match is None or not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise MalformedUpload("Expected multipart/form-data")
+
+    temp_dir = ATTACHMENT_DIR / "tmp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = temp_dir / uuid.uuid4().hex
+
+    fields: Dict[str, str] = {}
+    stored: Optional[StoredFile] = None
+    handle: Optional[IO[bytes]] = None
+    digest = None
+    size = 0
+    current: Optional[Dict[str, str]] = None
+    text = bytearray()
+
+    try:
+        async for kind, value in iter_multipart(request.stream(), match.group(1).encode("latin-1")):
+            if kind == "part":
+                current = value
+                if current.get("disposition.name") == field_name and "disposition.filename" in current and stored is None:
+                    handle = await run_in_threadpool(open, temp_path, "wb")
+                    digest = hashlib.sha256()
+                text.clear()
+            elif kind == "data":
+                if handle is not None:
+                    size += len(value)
+                    if size > ATTACHMENT_MAX_BYTES:
+                        raise AttachmentTooLarge(f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes")
+                    await run_in_threadpool(_write_chunk, handle, digest, value)
+                elif "disposition.filename" not in current:
+                    text.extend(value)
+                    if len(text) > _MAX_FIELD_BYTES:
+                        raise MalformedUpload(f"Form field {current.get('disposition.name')!r} too large")
+            elif handle is not None:
+                await run_in_threadpool(handle.close)
+                handle = None
+                sha256 = digest.hexdigest()
+                await run_in_threadpool(_commit_file, temp_path, sha256)
+                stored = StoredFile(
+                    sha256=sha256,
+                    size=size,
+                    filename=_clean_filename(current.get("disposition.filename")),
+                    content_type=current.get("content-type") or "application/octet-stream",
+                )
+            elif "disposition.filename" not in current:
+                fields[current.get("disposition.name", "")] = text.decode("utf-8", "replace")
+    finally:
+        if handle is not None:
+            handle.close()
+        if temp_path.exists():
+            temp_path.unlink()
+
+    if stored is None:
+        raise MalformedUpload(f"Missing file field {field_name!r}")
+    return stored, fields
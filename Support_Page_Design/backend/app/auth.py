@@ -0,0 +1,19 @@
+"""Guard for operator-only endpoints"""
+
+from __future__ import annotations
+
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# Shared secret for ops/admin endpoints; when unset those endpoints are disabled
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API token not configured")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
@@ -0,0 +1,307 @@
+"""Set-based ticket lifecycle operations: close by filter, reassign by agent, auto-close idle tickets.
+
+Each operation is one ``UPDATE ... WHERE ... RETURNING`` per previous status,
+so thousands of tickets change in a single round trip instead of being loaded
+and modified one by one. These statements bypass the ORM flush, so the
+analytics rollups, the agent pool, escalation deadlines and the change feed are
+updated from the returned rows. Telegram is told with one summary per agent and one per
+support group, plus a bounded number of card edits, instead of one call per ticket.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .analytics import record_transitions
+from .assignment import queue_load_change
+from .changes import record_ticket_updates
+from .database import session_scope
+from .escalation import queue_status_change
+from .models import SupportAgent, SupportMessage, SupportTicket
+from .telegram import TelegramPool, telegram_pool
+from .tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+# Claimed tickets without messages for this many hours are closed by the sweeper (0 disables it)
+AUTO_CLOSE_IDLE_HOURS = float(os.getenv("AUTO_CLOSE_IDLE_HOURS", "0"))
+AUTO_CLOSE_INTERVAL_SECONDS = float(os.getenv("AUTO_CLOSE_INTERVAL_SECONDS", "900"))
+# Group cards edited per bulk operation; the group summary covers the rest
+BULK_CARD_EDIT_LIMIT = int(os.getenv("BULK_CARD_EDIT_LIMIT", "50"))
+BULK_NOTIFY_CONCURRENCY = 4
+
+_LISTED_TICKETS = 40
+
+_RETURNING = (
+    SupportTicket.id,
+    SupportTicket.session_id,
+    SupportTicket.status,
+    SupportTicket.category,
+    SupportTicket.priority,
+    SupportTicket.created_at,
+    SupportTicket.claimed_at,
+    SupportTicket.closed_at,
+    SupportTicket.assigned_agent_id,
+    SupportTicket.group_message_id,
+    SupportTicket.bot_name,
+)
+
+
+@dataclass
+class BulkResult:
+    action: str
+    reason: str
+    tickets: List[Dict[str, Any]] = field(default_factory=list)
+    # Agent the tickets were taken from (reassignments only)
+    previous_agent_id: Optional[int] = None
+
+    @property
+    def ticket_ids(self) -> List[int]:
+        return [ticket["id"] for ticket in self.tickets]
+
+
+def ticket_filter(
+    *,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    agent_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    created_before: Optional[datetime] = None,
+    idle_since: Optional[datetime] = None,
+    ticket_ids: Optional[List[int]] = None,
+) -> List[Any]:
+    """WHERE clauses for the bulk operations; ``idle_since`` matches tickets with no message after that time"""
+    criteria: List[Any] = []
+    if status is not None:
+        criteria.append(SupportTicket.status == status)
+    if category is not None:
+        criteria.append(SupportTicket.category == category)
+    if agent_id is not None:
+        criteria.append(SupportTicket.assigned_agent_id == agent_id)
+    if session_id is not None:
+        criteria.append(SupportTicket.session_id == session_id)
+    if created_before is not None:
+        criteria.append(SupportTicket.created_at < created_before)
+    if ticket_ids is not None:
+        criteria.append(SupportTicket.id.in_(ticket_ids))
+    if idle_since is not None:
+        last_message_at = (
+            select(func.max(SupportMessage.created_at))
+            .where(SupportMessage.ticket_id == SupportTicket.id)
+            .scalar_subquery()
+        )
+        criteria.append(func.coalesce(last_message_at, SupportTicket.claimed_at, SupportTicket.created_at) < idle_since)
+    return criteria
+
+
+def _ticket_changes(rows: List[Dict[str, Any]], previous_agent_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    return [
+        {
+            "category": row["category"],
+            "priority": row["priority"],
+            "created_at": row["created_at"],
+            "claimed_at": row["claimed_at"],
+            "closed_at": row["closed_at"],
+            "previous_agent_id": row["assigned_agent_id"] if previous_agent_id is None else previous_agent_id,
+            "agent_id": row["assigned_agent_id"],
+        }
+        for row in rows
+    ]
+
+
+def _apply_side_effects(db: Session, old_status: str, rows: List[Dict[str, Any]], previous_agent_id: Optional[int] = None) -> None:
+    """Do for RETURNING rows what the flush hooks do for ORM changes"""
+    if not rows:
+        return
+    new_status = rows[0]["status"]
+    record_transitions(db.connection(), old_status, new_status, _ticket_changes(rows, previous_agent_id))
+    record_ticket_updates(db, rows, ("status", "assigned_agent_id", "claimed_at", "closed_at"))
+    for row in rows:
+        if old_status == "claimed":
+            queue_load_change(db, previous_agent_id or row["assigned_agent_id"], -1)
+        if new_status == "claimed":
+            queue_load_change(db, row["assigned_agent_id"], 1, row["claimed_at"])
+        if new_status != old_status:
+            queue_status_change(db, row["id"], new_status, row["priority"])
+
+
+def close_tickets(db: Session, criteria: List[Any], reason: str, closed_at: Optional[datetime] = None) -> BulkResult:
+    """Close every open or claimed ticket matching ``criteria``"""
+    closed_at = closed_at or datetime.utcnow()
+    result = BulkResult("closed", reason)
+    for old_status in ("open", "claimed"):
+        rows = db.execute(
+            update(SupportTicket)
+            .where(SupportTicket.status == old_status, *criteria)
+            .values(status="closed", closed_at=closed_at)
+            .returning(*_RETURNING),
+            execution_options={"synchronize_session": False},
+        ).mappings().all()
+        rows = [dict(row) for row in rows]
+        _apply_side_effects(db, old_status, rows)
+        result.tickets.extend(rows)
+    return result
+
+
+def reassign_tickets(db: Session, from_agent_id: int, to_agent_id: Optional[int], reason: str) -> BulkResult:
+    """Move an agent's claimed tickets to another agent, or back to the queue when ``to_agent_id`` is None"""
+    now = datetime.utcnow()
+    if to_agent_id is None:
+        action, values = "released", {"status": "open", "assigned_agent_id": None, "claimed_at": None}
+    else:
+        action, values = "reassigned", {"assigned_agent_id": to_agent_id, "claimed_at": now}
+
+    rows = db.execute(
+        update(SupportTicket)
+        .where(SupportTicket.status == "claimed", SupportTicket.assigned_agent_id == from_agent_id)
+        .values(**values)
+        .returning(*_RETURNING),
+        execution_options={"synchronize_session": False},
+    ).mappings().all()
+    rows = [dict(row) for row in rows]
+    _apply_side_effects(db, "claimed", rows, previous_agent_id=from_agent_id)
+    return BulkResult(action, reason, rows, previous_agent_id=from_agent_id)
+
+
+def close_idle_tickets(db: Session, idle_hours: float) -> BulkResult:
+    """Close claimed tickets that have had no message for ``idle_hours``"""
+    idle_since = datetime.utcnow() - timedelta(hours=idle_hours)
+    return close_tickets(db, ticket_filter(status="claimed", idle_since=idle_since), f"idle for {idle_hours:g}h")
+
+
+def _ticket_list(ticket_ids: List[int]) -> str:
+    listed = ", ".join(f"#{ticket_id}" for ticket_id in ticket_ids[:_LISTED_TICKETS])
+    more = len(ticket_ids) - _LISTED_TICKETS
+    return listed + (f" and {more} more" if more > 0 else "")
+
+
+async def notify_bulk(result: BulkResult, pool: TelegramPool = telegram_pool) -> None:
+    """Tell agents and the support groups about a bulk change with a handful of API calls"""
+    if not result.tickets:
+        return
+
+    # Grouped by the bot each ticket is pinned to, since agents and groups only hear from that bot
+    by_bot: Dict[str, List[Dict[str, Any]]] = {}
+    for ticket in result.tickets:
+        by_bot.setdefault(pool.get(ticket["bot_name"]).name, []).append(ticket)
+    agent_ids = {result.previous_agent_id} | {ticket["assigned_agent_id"] for ticket in result.tickets}
+    with session_scope() as db:
+        agents = {
+            agent.id: (str(agent.tg_chat_id), agent.name)
+            for agent in db.execute(select(SupportAgent).where(SupportAgent.id.in_(agent_ids - {None}))).scalars()
+        }
+
+    semaphore = asyncio.Semaphore(BULK_NOTIFY_CONCURRENCY)
+
+    async def send(coroutine) -> None:
+        async with semaphore:
+            try:
+                await coroutine
+            except Exception:
+                logger.exception("Bulk %s notification failed", result.action)
+
+    calls = []
+    card_budget = BULK_CARD_EDIT_LIMIT
+    for bot_name, tickets in by_bot.items():
+        service = pool.get(bot_name)
+        ticket_ids = [ticket["id"] for ticket in tickets]
+        count = len(tickets)
+        if service.support_group_id:
+            calls.append(service.send_message(
+                service.support_group_id,
+                f"🧹 <b>{count} ticket{'s' if count != 1 else ''} {result.action}</b> ({result.reason})\n"
+                f"{_ticket_list(ticket_ids)}",
+            ))
+
+        by_agent: Dict[int, List[int]] = {}
+        for ticket in tickets:
+            owner = result.previous_agent_id or ticket["assigned_agent_id"]
+            if owner is not None:
+                by_agent.setdefault(owner, []).append(ticket["id"])
+        for agent_id, owned in by_agent.items():
+            if agent_id not in agents:
+                continue
+            calls.append(service.send_message(
+                agents[agent_id][0],
+                f"📁 <b>{len(owned)} of your tickets were {result.action}</b> ({result.reason})\n{_ticket_list(owned)}",
+            ))
+        if result.action == "reassigned":
+            new_owner = tickets[0]["assigned_agent_id"]
+            if new_owner in agents:
+                calls.append(service.send_message(
+                    agents[new_owner][0],
+                    f"📥 <b>You now own {count} more ticket{'s' if count != 1 else ''}</b> ({result.reason})\n"
+                    f"{_ticket_list(ticket_ids)}",
+                ))
+
+        carded = [ticket for ticket in tickets if ticket["group_message_id"] is not None][:max(card_budget, 0)]
+        card_budget -= len(carded)
+        for ticket in carded:
+            owner = agents.get(ticket["assigned_agent_id"])
+            calls.append(service.update_ticket_card(
+                ticket["group_message_id"],
+                ticket["id"],
+                ticket["category"],
+                ticket["status"],
+                agent_name=owner[1] if owner else None,
+                reopened=result.action == "released",
+            ))
+
+    await asyncio.gather(*(send(call) for call in calls))
+
+
+class AutoCloseSweeper:
+    """Periodically closes claimed tickets idle for longer than ``idle_hours``"""
+
+    def __init__(self, idle_hours: float, interval: float):
+        self.idle_hours = idle_hours
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> BulkResult:
+        def run() -> BulkResult:
+            with session_scope() as db:
+                return close_idle_tickets(db, self.idle_hours)
+
+        with start_span("bulk.auto_close", attributes={"idle_hours": self.idle_hours}, parent=None) as span:
+            result = await run_in_threadpool(run)
+            span.set_attribute("tickets", len(result.tickets))
+            if result.tickets:
+                logger.info("Auto-closed %d idle tickets", len(result.tickets))
+                await notify_bulk(result)
+        return result
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Idle ticket sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.idle_hours > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+# Singleton instance
+auto_close_sweeper = AutoCloseSweeper(AUTO_CLOSE_IDLE_HOURS, AUTO_CLOSE_INTERVAL_SECONDS)
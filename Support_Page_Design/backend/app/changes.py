@@ -0,0 +1,319 @@
+"""Append-only change feed of ticket and message mutations for downstream consumers (CRM, BI).
+
+Every ticket insert, ticket update (status, assignment, category, priority,
+contact details) and message insert adds a row to ``change_events`` in the same
+transaction. ORM changes are picked up by a Session ``after_flush`` hook.
+The set-based UPDATEs of app.bulk call ``record_ticket_updates`` with their
+RETURNING rows. ``GET /api/changes`` serves the log in id order with an opaque
+cursor, so consumers resume exactly where they stopped. The read is an
+index range scan and may be served by a replica.
+
+Ids are allocated at insert but become visible at commit, so a lower id can
+appear after a higher one. A batch therefore stops before any gap in the ids
+younger than ``CHANGE_FEED_SETTLE_SECONDS``. Older gaps are rolled-back
+transactions and are skipped. Events older than ``CHANGE_FEED_RETENTION_HOURS``
+are pruned in the background; a cursor pointing into pruned history is
+rejected with 410 so the consumer knows to resync.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .database import READ, SessionLocal, session_scope
+from .models import ChangeEvent, SupportMessage, SupportTicket
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "1") == "1"
+# Events older than this are deleted (0 keeps them forever)
+CHANGE_FEED_RETENTION_HOURS = float(os.getenv("CHANGE_FEED_RETENTION_HOURS", "168"))
+CHANGE_FEED_PRUNE_INTERVAL_SECONDS = float(os.getenv("CHANGE_FEED_PRUNE_INTERVAL_SECONDS", "3600"))
+# How long a gap in event ids is treated as a transaction that may still commit
+CHANGE_FEED_SETTLE_SECONDS = float(os.getenv("CHANGE_FEED_SETTLE_SECONDS", "5"))
+CHANGE_FEED_MAX_WAIT_SECONDS = 30
+# Long polls re-read the log this often to see events committed by other workers
+CHANGE_FEED_POLL_SECONDS = 1.0
+CHANGE_FEED_PRUNE_BATCH = 5000
+
+# Columns whose changes are published; Telegram bookkeeping (card ids, bot pinning) is left out
+TICKET_FIELDS = (
+    "status",
+    "category",
+    "priority",
+    "contact_name",
+    "contact_email",
+    "assigned_agent_id",
+    "created_at",
+    "claimed_at",
+    "closed_at",
+)
+MESSAGE_FIELDS = (
+    "sender",
+    "body",
+    "created_at",
+    "attachment_sha256",
+    "attachment_name",
+    "attachment_type",
+    "attachment_size",
+)
+
+_WRITTEN_KEY = "change_events_written"
+_CURSOR_PREFIX = "v1:"
+
+
+class CursorExpired(Exception):
+    """The cursor points at events that retention has already deleted"""
+
+
+class MalformedCursor(ValueError):
+    pass
+
+
+def encode_cursor(event_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{_CURSOR_PREFIX}{event_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """The id of the last event the consumer has seen; 0 for the start of the retained log"""
+    if not cursor:
+        return 0
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise MalformedCursor("cursor is not valid") from None
+    if not text.startswith(_CURSOR_PREFIX) or not text[len(_CURSOR_PREFIX):].isdigit():
+        raise MalformedCursor("cursor is not valid")
+    return int(text[len(_CURSOR_PREFIX):])
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _event(entity: str, op: str, entity_id: int, ticket_id: int, session_id: Optional[str], data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "created_at": datetime.utcnow(),
+        "entity": entity,
+        "op": op,
+        "entity_id": entity_id,
+        "ticket_id": ticket_id,
+        "session_id": session_id,
+        "data": {name: _jsonable(value) for name, value in data.items()},
+    }
+
+
+def _ticket_update(ticket: SupportTicket) -> Optional[Dict[str, Any]]:
+    state = inspect(ticket)
+    changed = {name: getattr(ticket, name) for name in TICKET_FIELDS if state.attrs[name].history.has_changes()}
+    if not changed:
+        return None
+    # Consumers key their state machines on status, so every update carries it
+    changed.setdefault("status", ticket.status)
+    return _event("ticket", "update", ticket.id, ticket.id, ticket.session_id, changed)
+
+
+def _collect_events(session: Session, flush_context) -> None:
+    events: List[Dict[str, Any]] = []
+    new = [obj for obj in session.new if isinstance(obj, (SupportTicket, SupportMessage))]
+    # Tickets before their first message, each in id order
+    for obj in sorted(new, key=lambda obj: (isinstance(obj, SupportMessage), obj.id)):
+        if isinstance(obj, SupportTicket):
+            data = {name: getattr(obj, name) for name in TICKET_FIELDS}
+            events.append(_event("ticket", "insert", obj.id, obj.id, obj.session_id, data))
+        else:
+            data = {name: getattr(obj, name) for name in MESSAGE_FIELDS}
+            events.append(_event("message", "insert", obj.id, obj.ticket_id, obj.session_id, data))
+    for obj in session.dirty:
+        if isinstance(obj, SupportTicket) and obj not in session.new:
+            change = _ticket_update(obj)
+            if change is not None:
+                events.append(change)
+    _write(session, events)
+
+
+def record_ticket_updates(session: Session, rows: Iterable[Dict[str, Any]], fields: Tuple[str, ...]) -> None:
+    """Log tickets changed by a set-based UPDATE (invisible to the flush hook) from its RETURNING rows"""
+    if not CHANGE_FEED_ENABLED:
+        return
+    events = [
+        _event("ticket", "update", row["id"], row["id"], row["session_id"], {name: row[name] for name in fields})
+        for row in rows
+    ]
+    _write(session, events)
+
+
+def _write(session: Session, events: List[Dict[str, Any]]) -> None:
+    if not events:
+        return
+    session.connection().execute(insert(ChangeEvent.__table__), events)
+    session.info[_WRITTEN_KEY] = True
+
+
+def _notify_waiters(session: Session) -> None:
+    if session.info.pop(_WRITTEN_KEY, False):
+        change_notifier.notify()
+
+
+def _discard(session: Session, previous_transaction=None) -> None:
+    session.info.pop(_WRITTEN_KEY, None)
+
+
+def install_change_feed_hooks(session_factory=SessionLocal) -> None:
+    if not CHANGE_FEED_ENABLED or event.contains(session_factory, "after_flush", _collect_events):
+        return
+    event.listen(session_factory, "after_flush", _collect_events)
+    event.listen(session_factory, "after_commit", _notify_waiters)
+    event.listen(session_factory, "after_soft_rollback", _discard)
+
+
+def read_changes(db: Session, after_id: int, limit: int, now: Optional[datetime] = None) -> Tuple[List[ChangeEvent], int, bool]:
+    """Up to ``limit`` settled events after ``after_id``: (events, id to resume after, more are ready)"""
+    now = now or datetime.utcnow()
+    rows = db.execute(
+        select(ChangeEvent).where(ChangeEvent.id > after_id).order_by(ChangeEvent.id).limit(limit + 1)
+    ).scalars().all()
+    # Pruning always keeps the newest event, so a caught-up consumer's cursor stays valid however quiet the log is
+    if after_id and (not rows or rows[0].id != after_id + 1) and db.get(ChangeEvent, after_id) is None:
+        oldest_kept = db.execute(select(func.min(ChangeEvent.id))).scalar()
+        if oldest_kept is not None and oldest_kept > after_id + 1:
+            raise CursorExpired()
+
+    settled_before = now - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)
+    events: List[ChangeEvent] = []
+    last_id = after_id
+    for row in rows[:limit]:
+        # A fresh gap may be a transaction that has not committed yet; wait for it rather than skip it
+        if row.id != last_id + 1 and row.created_at > settled_before:
+            return events, last_id, False
+        events.append(row)
+        last_id = row.id
+    return events, last_id, len(rows) > limit
+
+
+def prune_changes(db: Session, retention_hours: float) -> int:
+    """Delete events older than the retention window in bounded batches"""
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    newest = db.execute(select(func.max(ChangeEvent.id))).scalar()
+    deleted = 0
+    while newest is not None:
+        batch = (
+            select(ChangeEvent.id)
+            .where(ChangeEvent.created_at < cutoff, ChangeEvent.id < newest)
+            .order_by(ChangeEvent.id)
+            .limit(CHANGE_FEED_PRUNE_BATCH)
+        )
+        result = db.execute(delete(ChangeEvent).where(ChangeEvent.id.in_(batch.scalar_subquery())))
+        db.commit()
+        deleted += result.rowcount
+        if result.rowcount < CHANGE_FEED_PRUNE_BATCH:
+            break
+    return deleted
+
+
+class ChangeNotifier:
+    """Wakes long polls in this process when a transaction that wrote events commits"""
+
+    def __init__(self):
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._lock = threading.Lock()
+
+    def notify(self) -> None:
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, wakeup in waiters:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+    async def wait(self, timeout: float) -> None:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+async def wait_for_changes(after_id: int, limit: int, wait: float) -> Tuple[List[ChangeEvent], int, bool]:
+    """``read_changes``, long-polling up to ``wait`` seconds while nothing is ready"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+
+    def read() -> Tuple[List[ChangeEvent], int, bool]:
+        with session_scope(READ) as db:
+            result = read_changes(db, after_id, limit)
+            db.expunge_all()
+            return result
+
+    while True:
+        result = await run_in_threadpool(read)
+        remaining = deadline - loop.time()
+        if result[0] or remaining <= 0:
+            return result
+        await change_notifier.wait(min(remaining, CHANGE_FEED_POLL_SECONDS))
+
+
+class ChangeLogPruner:
+    """Periodically deletes change events older than ``retention_hours``"""
+
+    def __init__(self, retention_hours: float, interval: float):
+        self.retention_hours = retention_hours
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def prune(self) -> int:
+        def run() -> int:
+            with session_scope() as db:
+                return prune_changes(db, self.retention_hours)
+
+        deleted = await run_in_threadpool(run)
+        if deleted:
+            logger.info("Pruned %d change events older than %gh", deleted, self.retention_hours)
+        return deleted
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.prune()
+            except Exception:
+                logger.exception("Change feed pruning failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if CHANGE_FEED_ENABLED and self.retention_hours > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+# Singleton instances
+change_notifier = ChangeNotifier()
+change_pruner = ChangeLogPruner(CHANGE_FEED_RETENTION_HOURS, CHANGE_FEED_PRUNE_INTERVAL_SECONDS)
@@ -1,42 +1,441 @@
 from __future__ import annotations
 
+import itertools
+import logging
 import os
+import threading
+import time
+from collections import Counter
 from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .tracing import KIND_CLIENT, begin_span, start_span
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged with their parameters
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Requests issuing more statements than this are flagged
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "12"))
+# The same statement repeated this many times in one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# Test mode: responses are held until the handler returns and over-budget requests are answered with 500
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() in ("1", "true", "yes")
 
 # Use Railway's DATABASE_URL or fallback to local SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{Path(__file__).resolve().parent.parent / 'support.db'}")
+# Primary connection pool (SQLAlchemy's defaults); admission control sheds load as it fills
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Comma-separated read replica URLs; reads opened with session_scope(READ) are spread over them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a write touching a support session, its reads stay on the primary this long
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+# Replicas lagging further behind than this are skipped until they catch up
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "2"))
+# Polls refresh support_sessions.last_seen_at at most this often, so they can be served by replicas
+LAST_SEEN_RESOLUTION_SECONDS = float(os.getenv("LAST_SEEN_RESOLUTION_SECONDS", "60"))
+
+READ = "read"
+WRITE = "write"
+
 
-# Handle PostgreSQL URL format for Railway
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-# Configure engine based on database type
-if DATABASE_URL.startswith("postgresql://"):
-    engine = create_engine(DATABASE_URL, future=True)
-else:
-    # SQLite configuration
-    engine = create_engine(
-        DATABASE_URL,
+def _make_engine(url: str, **options) -> Engine:
+    # Handle PostgreSQL URL format for Railway
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+
+    # Configure engine based on database type
+    if url.startswith("postgresql://"):
+        return create_engine(url, future=True, **options)
+    # SQLite configuration; an in-memory database lives on a single connection and takes no pool sizes
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        options = {name: value for name, value in options.items() if name not in ("pool_size", "max_overflow")}
+    return create_engine(
+        url,
         connect_args={"check_same_thread": False},
         future=True,
+        **options,
     )
+
+
+engine = _make_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+
+def compiled_cache_size(bind: Engine = engine) -> Optional[int]:
+    """Statements in the engine's compiled SQL cache; None when caching is disabled"""
+    # SQLAlchemy has no public accessor for the cache it creates from query_cache_size
+    cache = bind._compiled_cache
+    return len(cache) if cache is not None else None
+
 Base = declarative_base()
 
 
+@dataclass
+class Replica:
+    url: str
+    engine: Engine
+    session_factory: sessionmaker
+    healthy: bool = True
+    lag_seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def usable(self) -> bool:
+        return self.healthy and self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+
+
+# Seconds of replay lag on a Postgres standby; 0 when it has replayed everything it received
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """Chooses the engine for read sessions and keeps recently written support sessions on the primary.
+
+    A daemon thread measures each replica's lag every ``check_interval``
+    seconds; replicas that fail the check or lag too far are skipped, and a
+    replica that cannot be reached when a session opens is marked unhealthy
+    until its next successful check. Every decision is counted in ``decisions``.
+    """
+
+    def __init__(self, urls: List[str], pin_seconds: float, check_interval: float):
+        self.replicas = [self._replica(url) for url in urls]
+        self.pin_seconds = pin_seconds
+        self.check_interval = check_interval
+        self.decisions: Counter = Counter()
+        self._pins: Dict[str, float] = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _replica(url: str) -> Replica:
+        replica_engine = _make_engine(url, pool_pre_ping=True)
+        factory = sessionmaker(bind=replica_engine, autoflush=False, autocommit=False, future=True)
+        return Replica(url, replica_engine, factory)
+
+    def pin(self, key: str) -> None:
+        expires = time.monotonic() + self.pin_seconds
+        with self._lock:
+            self._pins[key] = expires
+            if len(self._pins) > 10000:
+                now = time.monotonic()
+                self._pins = {pinned: until for pinned, until in self._pins.items() if until > now}
+
+    def is_pinned(self, key: Optional[str]) -> bool:
+        if key is None:
+            return False
+        with self._lock:
+            until = self._pins.get(key)
+        return until is not None and until > time.monotonic()
+
+    def size(self) -> int:
+        """Sessions with a pin entry, including expired ones not yet compacted"""
+        with self._lock:
+            return len(self._pins)
+
+    def choose(self, key: Optional[str] = None) -> Optional[Replica]:
+        """The replica to read from, or None for the primary"""
+        if not self.replicas:
+            return None
+        self._ensure_checker()
+        if self.is_pinned(key):
+            self._count("primary_pinned")
+            return None
+        usable = [replica for replica in self.replicas if replica.usable]
+        if not usable:
+            self._count("primary_no_replica")
+            return None
+        self._count("replica")
+        return usable[next(self._next) % len(usable)]
+
+    def mark_failed(self, replica: Replica, error: Exception) -> None:
+        replica.healthy = False
+        replica.error = f"{type(error).__name__}: {error}"
+        self._count("primary_fallback")
+        logger.warning("Replica %s failed, reading from the primary: %s", _redact(replica.url), error)
+
+    def _count(self, decision: str) -> None:
+        with self._lock:
+            self.decisions[decision] += 1
+
+    def _ensure_checker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="replica-checker", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.check()
+            time.sleep(self.check_interval)
+
+    def check(self) -> None:
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    if conn.dialect.name == "postgresql":
+                        lag = float(conn.execute(_PG_LAG_SQL).scalar() or 0)
+                    else:
+                        conn.execute(text("SELECT 1"))
+                        lag = 0.0
+            except Exception as exc:
+                if replica.healthy:
+                    logger.warning("Replica %s is unhealthy: %s", _redact(replica.url), exc)
+                replica.healthy, replica.error = False, f"{type(exc).__name__}: {exc}"
+                continue
+            if lag > REPLICA_MAX_LAG_SECONDS and replica.lag_seconds <= REPLICA_MAX_LAG_SECONDS:
+                logger.warning("Replica %s is %.1fs behind, reading from the others", _redact(replica.url), lag)
+            replica.healthy, replica.lag_seconds, replica.error = True, lag, None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = dict(self.decisions)
+            pinned = sum(1 for until in self._pins.values() if until > time.monotonic())
+        return {
+            "decisions": decisions,
+            "pinnedSessions": pinned,
+            "replicas": [
+                {"url": _redact(r.url), "healthy": r.healthy, "lagSeconds": r.lag_seconds, "usable": r.usable, "error": r.error}
+                for r in self.replicas
+            ],
+        }
+
+
+def _redact(url: str) -> str:
+    """Hide the password of a database URL"""
+    scheme, sep, rest = url.partition("://")
+    credentials, at, host = rest.rpartition("@")
+    if not at:
+        return url
+    return f"{scheme}{sep}{credentials.split(':', 1)[0]}:***@{host}"
+
+
+def open_session(intent: str = WRITE, key: Optional[str] = None) -> Session:
+    """A new session on the primary, or on a replica for ``READ`` intent (see ``session_scope``)"""
+    replica = replica_router.choose(key) if intent == READ else None
+    if replica is not None:
+        session = replica.session_factory()
+        try:
+            # Connect now so an unreachable replica can still fall back to the primary
+            session.connection()
+            session.info["replica"] = replica.url
+            return session
+        except DBAPIError as exc:
+            session.close()
+            replica_router.mark_failed(replica, exc)
+    return SessionLocal()
+
+
 @contextmanager
-def session_scope() -> Session:
-    session = SessionLocal()
+def session_scope(intent: str = WRITE, key: Optional[str] = None) -> Session:
+    """A transaction that commits on success; ``READ`` sessions may be served by a replica.
+
+    ``key`` is the support session id being read: it keeps the read on the
+    primary for REPLICA_PIN_SECONDS after a write to that support session, so
+    visitors and agents always see their own messages.
+    """
+    with start_span("db.transaction", require_parent=True) as span:
+        session = open_session(intent, key)
+        span.set_attribute("db.route", "replica" if "replica" in session.info else "primary")
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+_PIN_KEYS = "replica_pins"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_pins(session: Session, flush_context) -> None:
+    if not replica_router.replicas:
+        return
+    keys = session.info.setdefault(_PIN_KEYS, set())
+    for obj in list(session.new) + list(session.dirty):
+        # Rows belong to a support session through session_id; the session row itself is keyed by id
+        key = obj.id if getattr(obj, "__tablename__", None) == "support_sessions" else getattr(obj, "session_id", None)
+        if key is not None:
+            keys.add(str(key))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_pins(session: Session) -> None:
+    for key in session.info.pop(_PIN_KEYS, ()):
+        replica_router.pin(key)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_pins(session: Session, previous_transaction) -> None:
+    session.info.pop(_PIN_KEYS, None)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_ms: float = 0.0
+    statements: List[str] = field(default_factory=list)
+    repeats: Counter = field(default_factory=Counter)
+
+    def record(self, statement: str, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements.append(statement)
+        self.repeats[statement] += 1
+
+
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+# Process-wide captures used by assert_query_count; they see queries from any thread
+_captures: List[QueryStats] = []
+
+
+def _short(value, limit: int = 500) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+    span = begin_span(
+        "db.query", KIND_CLIENT, {"db.system": conn.dialect.name, "db.statement": statement[:1000]}, require_parent=True
+    )
+    conn.info.setdefault("query_spans", []).append(span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+    conn.info["query_spans"].pop().end()
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed_ms)
+    for capture in _captures:
+        capture.record(statement, elapsed_ms)
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s | params=%s", elapsed_ms, " ".join(statement.split()), _short(parameters))
+
+
+def _handle_error(context):
+    conn = context.connection
+    if conn is None or not conn.info.get("query_started"):
+        return
+    conn.info["query_started"].pop()
+    span = conn.info["query_spans"].pop()
+    span.set_error(f"{type(context.original_exception).__name__}: {context.original_exception}")
+    span.end()
+
+
+# Singleton instance
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS, REPLICA_PIN_SECONDS, REPLICA_CHECK_INTERVAL_SECONDS)
+
+for _engine in [engine] + [replica.engine for replica in replica_router.replicas]:
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(_engine, "handle_error", _handle_error)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Collect statements issued in the current context (request, job or test)"""
+    stats = QueryStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+@contextmanager
+def assert_query_count(expected: int, exact: bool = False) -> Iterator[QueryStats]:
+    """Test helper pinning the number of statements issued inside the block, e.g. around a TestClient call"""
+    stats = QueryStats()
+    _captures.append(stats)
     try:
-        yield session
-        session.commit()
-    except Exception:
-        session.rollback()
-        raise
+        yield stats
     finally:
-        session.close()
+        _captures.remove(stats)
+    if stats.count > expected or (exact and stats.count != expected):
+        listing = "\n".join(f"  {index + 1}. {' '.join(sql.split())}" for index, sql in enumerate(stats.statements))
+        raise QueryBudgetExceeded(f"Expected {'' if exact else 'at most '}{expected} queries, got {stats.count}:\n{listing}")
+
+
+class QueryStatsMiddleware:
+    """Per-request query count and DB time, reported in Server-Timing and checked against QUERY_BUDGET"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            async def send_with_timing(message: Message) -> None:
+                if message["type"] == "http.response.start" and stats.count:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", f'db;dur={stats.total_ms:.1f};desc="{stats.count} queries"'.encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            if not QUERY_BUDGET_STRICT:
+                await self.app(scope, receive, send_with_timing)
+            else:
+                # Hold the whole response until the handler returns, so an over-budget request can still fail
+                held: List[Message] = []
+
+                async def hold(message: Message) -> None:
+                    held.append(message)
+
+                await self.app(scope, receive, hold)
+
+        over_budget = self._report(scope, stats)
+        if not QUERY_BUDGET_STRICT:
+            return
+        if over_budget:
+            logger.error(over_budget)
+            await JSONResponse({"detail": over_budget}, status_code=500)(scope, receive, send)
+            return
+        for message in held:
+            await send_with_timing(message)
+
+    @staticmethod
+    def _report(scope: Scope, stats: QueryStats) -> Optional[str]:
+        """Log likely N+1s; returns the budget violation, which strict mode turns into a 500"""
+        route = f"{scope['method']} {scope['path']}"
+        repeated = [(sql, n) for sql, n in stats.repeats.items() if n >= N_PLUS_ONE_THRESHOLD]
+        for sql, n in repeated:
+            logger.warning("Possible N+1 in %s: statement ran %d times: %s", route, n, " ".join(sql.split())[:300])
+        if stats.count <= QUERY_BUDGET:
+            return None
+        message = f"{route} issued {stats.count} queries ({stats.total_ms:.1f} ms), budget is {QUERY_BUDGET}"
+        if not QUERY_BUDGET_STRICT:
+            logger.warning(message)
+        return message
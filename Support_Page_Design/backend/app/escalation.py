@@ -0,0 +1,334 @@
+"""In-process escalation of unclaimed and stale tickets.
+
+Deadlines live in a heap with lazy cancellation: registering is O(log n) and
+cancelling is O(1) (the entry is dropped from the index and skipped when it
+reaches the top). Two kinds of deadline exist per ticket:
+
+- ``claim``: the ticket is open and nobody has claimed it yet;
+- ``reply``: a visitor message on a claimed ticket has not been answered.
+
+Deadlines are registered and cancelled by Session hooks after each commit, so
+every code path that creates, claims, closes or replies to a ticket is
+covered. When a deadline fires the ticket is re-checked in the database before
+anything is sent, and the deadline is re-armed for the next escalation level.
+Pending deadlines are recovered from open/claimed tickets on startup.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.util import identity_key
+
+from .database import SessionLocal, session_scope
+from .models import PRIORITY_MAP, SupportAgent, SupportMessage, SupportTicket
+from .telegram import TelegramPool, telegram_pool
+from .tracing import SpanContext, current_context, start_span
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_ENABLED = os.getenv("ESCALATION_ENABLED", "true").lower() in ("1", "true", "yes")
+ESCALATION_MAX_LEVEL = int(os.getenv("ESCALATION_MAX_LEVEL", "3"))
+
+KIND_CLAIM = "claim"
+KIND_REPLY = "reply"
+
+_PENDING_KEY = "escalation_pending"
+
+
+def _sla_by_priority(name: str, default: str) -> Dict[int, float]:
+    """Parse "low,medium,high" seconds into a map keyed by PRIORITY_MAP values"""
+    values = [float(value) for value in os.getenv(name, default).split(",")]
+    levels = sorted(PRIORITY_MAP.values())
+    return {level: values[min(index, len(values) - 1)] for index, level in enumerate(levels)}
+
+
+CLAIM_SLA_SECONDS = _sla_by_priority("ESCALATION_CLAIM_SLA_SECONDS", "900,300,120")
+REPLY_SLA_SECONDS = _sla_by_priority("ESCALATION_REPLY_SLA_SECONDS", "900,600,300")
+
+
+@dataclass
+class _Deadline:
+    due: datetime
+    kind: str
+    ticket_id: int
+    level: int
+    cancelled: bool = False
+    # Trace that armed the deadline; the escalation span links back to it
+    origin: Optional[SpanContext] = None
+
+
+class EscalationScheduler:
+    def __init__(self, pool: TelegramPool):
+        self.pool = pool
+        self._heap: List[Tuple[datetime, int, _Deadline]] = []
+        self._index: Dict[Tuple[str, int], _Deadline] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Off in all but one worker of a multi-process server, so recovered deadlines fire once
+        self.recover_on_start = True
+
+    def schedule(self, kind: str, ticket_id: int, due: datetime, level: int = 1, replace: bool = True) -> None:
+        with self._lock:
+            key = (kind, ticket_id)
+            existing = self._index.get(key)
+            if existing is not None:
+                if not replace:
+                    return
+                existing.cancelled = True
+            deadline = _Deadline(due, kind, ticket_id, level, origin=current_context())
+            self._index[key] = deadline
+            heapq.heappush(self._heap, (due, next(self._counter), deadline))
+            is_next = self._heap[0][2] is deadline
+        if is_next:
+            self._wake()
+
+    def cancel(self, kind: str, ticket_id: int) -> None:
+        with self._lock:
+            deadline = self._index.pop((kind, ticket_id), None)
+            if deadline is not None:
+                deadline.cancelled = True
+
+    def cancel_ticket(self, ticket_id: int) -> None:
+        self.cancel(KIND_CLAIM, ticket_id)
+        self.cancel(KIND_REPLY, ticket_id)
+
+    def pending(self) -> int:
+        return len(self._index)
+
+    def _wake(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now: datetime) -> Tuple[List[_Deadline], Optional[float]]:
+        due: List[_Deadline] = []
+        with self._lock:
+            while self._heap:
+                when, _, deadline = self._heap[0]
+                if deadline.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                if when > now:
+                    return due, (when - now).total_seconds()
+                heapq.heappop(self._heap)
+                self._index.pop((deadline.kind, deadline.ticket_id), None)
+                due.append(deadline)
+        return due, None
+
+    async def _run(self) -> None:
+        while True:
+            # Clear before scanning so a deadline registered meanwhile still wakes us
+            self._wakeup.clear()
+            due, wait = self._pop_due(datetime.utcnow())
+            for deadline in due:
+                attributes = {"ticket.id": deadline.ticket_id, "escalation.kind": deadline.kind, "escalation.level": deadline.level}
+                try:
+                    with start_span("escalation.fire", attributes=attributes, parent=None, links=[deadline.origin]):
+                        await self._fire(deadline)
+                except Exception:
+                    logger.exception("Escalation for ticket %s failed", deadline.ticket_id)
+            if due:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, deadline: _Deadline) -> None:
+        now = datetime.utcnow()
+        with session_scope() as db:
+            ticket = db.get(SupportTicket, deadline.ticket_id)
+            if ticket is None:
+                return
+            service = self.pool.get(ticket.bot_name)
+            category = ticket.category or "General"
+            priority = ticket.priority or 0
+            priority_name = next((name for name, value in PRIORITY_MAP.items() if value == priority), str(priority))
+
+            if deadline.kind == KIND_CLAIM:
+                if ticket.status != "open" or ticket.assigned_agent_id:
+                    return
+                waiting_since = ticket.created_at
+                agent_chat_id = agent_name = None
+            else:
+                if ticket.status != "claimed":
+                    return
+                last_message = db.execute(
+                    select(SupportMessage)
+                    .where(SupportMessage.ticket_id == ticket.id)
+                    .order_by(SupportMessage.id.desc())
+                    .limit(1)
+                ).scalars().first()
+                if last_message is None or last_message.sender != "visitor":
+                    return
+                waiting_since = last_message.created_at
+                agent = db.get(SupportAgent, ticket.assigned_agent_id) if ticket.assigned_agent_id else None
+                agent_chat_id = str(agent.tg_chat_id) if agent else None
+                agent_name = agent.name if agent else None
+
+        minutes = max(int((now - waiting_since).total_seconds() // 60), 1)
+        if deadline.kind == KIND_CLAIM:
+            await service.send_message(
+                service.support_group_id,
+                f"⏰ <b>Ticket #{deadline.ticket_id} unclaimed for {minutes} min</b> • {category} • {priority_name} priority",
+                {"inline_keyboard": [[{"text": "✅ Claim", "callback_data": f"CLAIM#{deadline.ticket_id}"}]]},
+            )
+            sla = CLAIM_SLA_SECONDS.get(priority, CLAIM_SLA_SECONDS[0])
+        else:
+            if deadline.level == 1 and agent_chat_id:
+                await service.send_message(
+                    agent_chat_id,
+                    f"⏰ <b>Ticket #{deadline.ticket_id}</b>: the visitor has been waiting {minutes} min for a reply."
+                )
+            else:
+                await service.send_message(
+                    service.support_group_id,
+                    f"⚠️ <b>Ticket #{deadline.ticket_id}</b> • visitor waiting {minutes} min for "
+                    f"{agent_name or 'the assigned agent'} • {category}"
+                )
+            sla = REPLY_SLA_SECONDS.get(priority, REPLY_SLA_SECONDS[0])
+
+        if deadline.level < ESCALATION_MAX_LEVEL:
+            self.schedule(deadline.kind, deadline.ticket_id, now + timedelta(seconds=sla), deadline.level + 1, replace=False)
+
+    def _resume(self, kind: str, ticket_id: int, waiting_since: datetime, sla: float, now: datetime) -> None:
+        """Re-arm only the next reminder that has not come due yet.
+
+        Level N fires about N SLA periods after ``waiting_since``; levels whose
+        time has passed were sent before the restart (or are too stale to be
+        worth sending now), and tickets past ESCALATION_MAX_LEVEL are done.
+        """
+        elapsed = max((now - waiting_since).total_seconds(), 0.0)
+        level = int(elapsed // sla) + 1 if sla > 0 else 1
+        if level > ESCALATION_MAX_LEVEL:
+            return
+        self.schedule(kind, ticket_id, waiting_since + timedelta(seconds=sla * level), level)
+
+    def recover(self, db: Session, now: Optional[datetime] = None) -> None:
+        """Resume pending deadlines for open and claimed tickets after a restart"""
+        now = now or datetime.utcnow()
+        for ticket in db.execute(select(SupportTicket).where(SupportTicket.status == "open")).scalars():
+            sla = CLAIM_SLA_SECONDS.get(ticket.priority or 0, CLAIM_SLA_SECONDS[0])
+            self._resume(KIND_CLAIM, ticket.id, ticket.created_at, sla, now)
+
+        latest = aliased(SupportMessage)
+        last_message_id = (
+            select(latest.id)
+            .where(latest.ticket_id == SupportTicket.id)
+            .order_by(latest.id.desc())
+            .limit(1)
+            .correlate(SupportTicket)
+            .scalar_subquery()
+        )
+        rows = db.execute(
+            select(SupportTicket.id, SupportTicket.priority, SupportMessage.sender, SupportMessage.created_at)
+            .join(SupportMessage, SupportMessage.id == last_message_id)
+            .where(SupportTicket.status == "claimed")
+        )
+        for ticket_id, priority, sender, created_at in rows:
+            if sender == "visitor":
+                sla = REPLY_SLA_SECONDS.get(priority or 0, REPLY_SLA_SECONDS[0])
+                self._resume(KIND_REPLY, ticket_id, created_at, sla, now)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.recover_on_start:
+            with SessionLocal() as db:
+                self.recover(db)
+        logger.info("Escalation scheduler started with %d pending deadlines", self.pending())
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def _status_action(ticket_id: int, status: str, priority: Optional[int]) -> Tuple[str, Optional[str], int, Optional[datetime]]:
+    if status == "open":
+        sla = CLAIM_SLA_SECONDS.get(priority or 0, CLAIM_SLA_SECONDS[0])
+        return "schedule", KIND_CLAIM, ticket_id, datetime.utcnow() + timedelta(seconds=sla)
+    if status == "claimed":
+        return "cancel", KIND_CLAIM, ticket_id, None
+    return "cancel", None, ticket_id, None
+
+
+def queue_status_change(session: Session, ticket_id: int, status: str, priority: Optional[int]) -> None:
+    """Record a status change made by a set-based UPDATE (invisible to the flush hook); applied after commit"""
+    session.info.setdefault(_PENDING_KEY, []).append(_status_action(ticket_id, status, priority))
+
+
+def _collect_changes(session: Session, flush_context) -> None:
+    pending = session.info.setdefault(_PENDING_KEY, [])
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, SupportTicket):
+            history = inspect(obj).attrs.status.history
+            if obj not in session.new and not history.has_changes():
+                continue
+            pending.append(_status_action(obj.id, obj.status, obj.priority))
+        elif isinstance(obj, SupportMessage) and obj in session.new:
+            if obj.sender == "visitor":
+                # Keep the earliest unanswered message as the reference; checked against the ticket when it fires
+                ticket = session.identity_map.get(identity_key(SupportTicket, obj.ticket_id))
+                priority = ticket.priority or 0 if ticket is not None else 0
+                sla = REPLY_SLA_SECONDS.get(priority, REPLY_SLA_SECONDS[0])
+                pending.append(("schedule_if_absent", KIND_REPLY, obj.ticket_id, datetime.utcnow() + timedelta(seconds=sla)))
+            elif obj.sender == "agent":
+                pending.append(("cancel", KIND_REPLY, obj.ticket_id, None))
+
+
+def _apply_changes(session: Session) -> None:
+    for action, kind, ticket_id, due in session.info.pop(_PENDING_KEY, []):
+        if action == "schedule":
+            escalation_scheduler.schedule(kind, ticket_id, due)
+        elif action == "schedule_if_absent":
+            escalation_scheduler.schedule(kind, ticket_id, due, replace=False)
+        elif kind is None:
+            escalation_scheduler.cancel_ticket(ticket_id)
+        else:
+            escalation_scheduler.cancel(kind, ticket_id)
+
+
+def _discard_changes(session: Session, *args) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def install_escalation_hooks(session_factory=SessionLocal) -> None:
+    if event.contains(session_factory, "after_flush", _collect_changes):
+        return
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_soft_rollback", _discard_changes)
+
+
+async def start_escalations() -> None:
+    if not ESCALATION_ENABLED:
+        return
+    install_escalation_hooks()
+    await escalation_scheduler.start()
+
+
+# Singleton instance
+escalation_scheduler = EscalationScheduler(telegram_pool)
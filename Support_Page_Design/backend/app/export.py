@@ -0,0 +1,169 @@
+"""Streaming export of conversations (tickets with their messages) as NDJSON or CSV.
+
+Rows come from one ticket/message join read through a streaming cursor
+(``yield_per``), are encoded incrementally and leave in ~64 KB chunks,
+optionally gzip-compressed on the fly. Memory use depends on the chunk size
+and the largest single ticket, not on the number of rows exported.
+
+    python -m app.export --format csv --since 2026-01-01 --until 2026-02-01 --gzip -o january.csv.gz
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+
+from .database import READ, open_session
+from .models import TICKET_STATUSES, SupportMessage, SupportTicket
+
+EXPORT_FORMATS = ("ndjson", "csv")
+CHUNK_BYTES = 64 * 1024
+YIELD_PER = 2000
+
+TICKET_FIELDS = (
+    "ticket_id", "session_id", "status", "category", "priority", "contact_name", "contact_email",
+    "assigned_agent_id", "created_at", "claimed_at", "closed_at",
+)
+MESSAGE_FIELDS = ("message_id", "sender", "body", "message_created_at", "attachment_name", "attachment_size")
+
+
+def _iso(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_rows(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Flat ticket+message rows ordered by ticket, streamed from the database (tickets without messages appear once)"""
+    statement = (
+        select(
+            SupportTicket.id.label("ticket_id"),
+            SupportTicket.session_id,
+            SupportTicket.status,
+            SupportTicket.category,
+            SupportTicket.priority,
+            SupportTicket.contact_name,
+            SupportTicket.contact_email,
+            SupportTicket.assigned_agent_id,
+            SupportTicket.created_at,
+            SupportTicket.claimed_at,
+            SupportTicket.closed_at,
+            SupportMessage.id.label("message_id"),
+            SupportMessage.sender,
+            SupportMessage.body,
+            SupportMessage.created_at.label("message_created_at"),
+            SupportMessage.attachment_name,
+            SupportMessage.attachment_size,
+        )
+        .outerjoin(SupportMessage, SupportMessage.ticket_id == SupportTicket.id)
+        .order_by(SupportTicket.id, SupportMessage.id)
+    )
+    if since is not None:
+        statement = statement.where(SupportTicket.created_at >= since)
+    if until is not None:
+        statement = statement.where(SupportTicket.created_at < until)
+    if status is not None:
+        statement = statement.where(SupportTicket.status == status)
+    if category is not None:
+        statement = statement.where(SupportTicket.category == category)
+
+    with open_session(READ) as db:
+        # yield_per implies stream_results: a server-side cursor on Postgres, incremental fetches on SQLite
+        for row in db.execute(statement.execution_options(yield_per=YIELD_PER)):
+            yield {key: _iso(value) for key, value in row._mapping.items()}
+
+
+def _ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON object per ticket with its messages nested"""
+    ticket: Optional[Dict[str, Any]] = None
+    messages: List[Dict[str, Any]] = []
+    for row in rows:
+        if ticket is None or row["ticket_id"] != ticket["ticket_id"]:
+            if ticket is not None:
+                yield json.dumps({**ticket, "messages": messages}, ensure_ascii=False) + "\n"
+            ticket = {field: row[field] for field in TICKET_FIELDS}
+            messages = []
+        if row["message_id"] is not None:
+            messages.append({field: row[field] for field in MESSAGE_FIELDS})
+    if ticket is not None:
+        yield json.dumps({**ticket, "messages": messages}, ensure_ascii=False) + "\n"
+
+
+def _csv_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """One CSV row per message, with the ticket columns repeated"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TICKET_FIELDS + MESSAGE_FIELDS)
+    for row in rows:
+        writer.writerow([row[field] for field in TICKET_FIELDS + MESSAGE_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export(format: str, rows: Iterable[Dict[str, Any]], compress: bool = False) -> Iterator[bytes]:
+    """Encode rows into ~CHUNK_BYTES chunks, gzip-compressed when ``compress`` is set"""
+    lines = _ndjson_lines(rows) if format == "ndjson" else _csv_lines(rows)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending: List[bytes] = []
+    size = 0
+
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            chunk = b"".join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b"".join(pending)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_filename(format: str, compress: bool) -> str:
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return f"conversations-{stamp}.{format}{'.gz' if compress else ''}"
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export conversations as NDJSON or CSV")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--since", type=_parse_date, help="tickets created at or after (ISO date/time, UTC)")
+    parser.add_argument("--until", type=_parse_date, help="tickets created before (ISO date/time, UTC)")
+    parser.add_argument("--status", choices=TICKET_STATUSES)
+    parser.add_argument("--category")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    rows = iter_rows(args.since, args.until, args.status, args.category)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_export(args.format, rows, args.gzip):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
@@ -0,0 +1,160 @@
+"""Group commit for message inserts.
+
+With ``GROUP_COMMIT_ENABLED`` concurrent requests hand their ``SupportMessage``
+rows to ``message_writer`` instead of committing them one by one. Rows queue
+up for ``GROUP_COMMIT_WINDOW_MS`` (or until ``GROUP_COMMIT_MAX_ROWS`` are
+waiting) and are written in one transaction, so a burst of N messages costs
+one commit (one fsync) instead of N. Each caller awaits a future that resolves
+to its message id. Only one batch is written at a time: rows arriving during a
+write form the next batch, which is flushed as soon as the current one commits.
+
+The rows go through the ORM, so the flush hooks (rollups, escalations, replica
+pinning) see them exactly as they would see a per-request commit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
+
+from .database import session_scope, track_queries
+from .models import SupportMessage, SupportSession
+from .tracing import SpanContext, current_context, start_span
+
+logger = logging.getLogger(__name__)
+
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+# How long the first queued row waits for others before the batch is written
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "200"))
+
+
+@dataclass
+class _QueuedRow:
+    values: Dict[str, Any]
+    future: asyncio.Future
+    trace_context: Optional[SpanContext] = None
+
+
+@dataclass
+class WriterStats:
+    batches: int = 0
+    rows: int = 0
+    largest_batch: int = 0
+    # Batches that failed as a whole and were retried row by row
+    retried_batches: int = 0
+
+
+def write_messages(rows: List[Dict[str, Any]]) -> List[int]:
+    """Insert message rows in one transaction and return their ids in order"""
+    now = datetime.utcnow()
+    with session_scope() as db:
+        messages = [SupportMessage(**values) for values in rows]
+        db.add_all(messages)
+        visitor_sessions = {values["session_id"] for values in rows if values.get("sender") == "visitor"}
+        if visitor_sessions:
+            db.execute(
+                update(SupportSession)
+                .where(SupportSession.id.in_(visitor_sessions))
+                .values(last_seen_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        db.flush()
+        return [message.id for message in messages]
+
+
+class GroupCommitWriter:
+    def __init__(self, window_ms: float, max_rows: int, enabled: bool = True):
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self.enabled = enabled
+        self.stats = WriterStats()
+        self._queue: List[_QueuedRow] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writing: Optional[asyncio.Task] = None
+
+    async def submit(self, **values: Any) -> int:
+        """Queue one ``SupportMessage`` row; returns its id once the batch holding it has committed"""
+        loop = asyncio.get_running_loop()
+        row = _QueuedRow(values, loop.create_future(), current_context())
+        self._queue.append(row)
+        if len(self._queue) >= self.max_rows:
+            self._start_batch()
+        elif self._timer is None and self._writing is None:
+            self._timer = loop.call_later(self.window, self._start_batch)
+        return await row.future
+
+    def _start_batch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._writing is not None or not self._queue:
+            # The running batch starts the next one when it finishes
+            return
+        batch, self._queue = self._queue[:self.max_rows], self._queue[self.max_rows:]
+        self._writing = asyncio.get_running_loop().create_task(self._write(batch))
+
+    async def _write(self, batch: List[_QueuedRow]) -> None:
+        attributes = {"group_commit.rows": len(batch)}
+        links = [row.trace_context for row in batch[1:]]
+        try:
+            # The task inherited the context of the request that opened the batch; don't bill its query budget
+            with track_queries(), start_span(
+                "group_commit.flush", attributes=attributes, parent=batch[0].trace_context, links=links
+            ):
+                await self._write_batch(batch)
+        finally:
+            self._writing = None
+            if self._queue:
+                # Rows that queued up during the write have waited long enough
+                self._start_batch()
+
+    async def _write_batch(self, batch: List[_QueuedRow]) -> None:
+        try:
+            ids = await run_in_threadpool(write_messages, [row.values for row in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                if not batch[0].future.done():
+                    batch[0].future.set_exception(exc)
+                return
+            # One bad row must not fail its neighbours: retry each row in its own transaction
+            logger.exception("Group commit of %d rows failed, retrying one by one", len(batch))
+            self.stats.retried_batches += 1
+            for row in batch:
+                try:
+                    (row_id,) = await run_in_threadpool(write_messages, [row.values])
+                except Exception as exc:
+                    if not row.future.done():
+                        row.future.set_exception(exc)
+                else:
+                    if not row.future.done():
+                        row.future.set_result(row_id)
+            return
+
+        self.stats.batches += 1
+        self.stats.rows += len(batch)
+        self.stats.largest_batch = max(self.stats.largest_batch, len(batch))
+        for row, row_id in zip(batch, ids):
+            if not row.future.done():
+                row.future.set_result(row_id)
+
+    async def drain(self) -> None:
+        """Write everything still queued; used on shutdown"""
+        while self._queue or self._writing is not None:
+            if self._writing is None:
+                self._start_batch()
+            await asyncio.shield(self._writing)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats.__dict__, "pending": len(self._queue)}
+
+
+# Singleton instance
+message_writer = GroupCommitWriter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_ROWS, GROUP_COMMIT_ENABLED)
@@ -1,51 +1,122 @@
 from __future__ import annotations
 
+import asyncio
+import html
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
 from uuid import uuid4
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy import asc, desc, select
+from sqlalchemy import desc, or_, select, update
+from starlette.concurrency import run_in_threadpool
 
 # Load environment variables
 load_dotenv()
 
-from .database import Base, engine, session_scope
-from .models import PRIORITY_MAP, SupportMessage, SupportSession, SupportTicket
+# Deadline for draining background queues on shutdown, after in-flight requests have finished
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "10"))
+
+from .active_ticket import install_active_ticket_hooks, load_session
+from .admission import AdmissionControlMiddleware
+from .analytics import ensure_rollups, install_rollup_hooks, read_stats
+from .attachments import AttachmentTooLarge, MalformedUpload, StoredFile, path_for, receive_upload
+from .assignment import auto_assign, claim_ticket, start_auto_assignment
+from .auth import require_admin
+from .bulk import auto_close_sweeper, close_tickets, notify_bulk, reassign_tickets, ticket_filter
+from .changes import (
+    CHANGE_FEED_MAX_WAIT_SECONDS,
+    CursorExpired,
+    MalformedCursor,
+    change_pruner,
+    decode_cursor,
+    encode_cursor,
+    install_change_feed_hooks,
+    wait_for_changes,
+)
+from .database import LAST_SEEN_RESOLUTION_SECONDS, READ, Base, QueryStatsMiddleware, engine, replica_router, session_scope
+from .escalation import escalation_scheduler, start_escalations
+from .export import export_filename, iter_export, iter_rows
+from .group_commit import message_writer
+from .migrations import run_migrations
+from .models import PRIORITY_MAP, TICKET_STATUSES, SupportMessage, SupportSession, SupportTicket
+from .notifications import KIND_CUSTOMER_MESSAGE, KIND_NEW_TICKET, notification_coalescer
+from .polling import poll_advisor
+from .profiling import (
+    PROFILE_MAX_SECONDS,
+    PROFILE_MIN_INTERVAL_MS,
+    NotTracing,
+    ProfilerBusy,
+    collapsed,
+    cpu_profiler,
+    memory_profiler,
+    object_counts,
+)
+from .recording import TrafficRecorderMiddleware, traffic_recorder
 from .schemas import (
+    AttachmentSchema,
+    BulkCloseRequest,
+    BulkReassignRequest,
+    BulkResultResponse,
+    ChangeEventSchema,
+    ChangesResponse,
     ConversationResponse,
     MessageCreateRequest,
     MessageResponse,
+    PollSettingsRequest,
     SessionCreateRequest,
+    SearchHitSchema,
+    SearchResponse,
     SessionResponse,
+    StatsResponse,
     SupportMessageSchema,
     SupportTicketSchema,
 )
-from .telegram import telegram_service
+from .search import ensure_search_index, search_messages
+from .static import IndexDocument, PrecompressedStaticFiles
+from .telegram import TelegramService, telegram_pool, telegram_service
+from .tracing import TracingMiddleware, shutdown as shutdown_tracing
 
 app = FastAPI(title="Support Backend", version="0.1.0")
 
+# Added before CORS so that CORS wraps it and 429/503 responses stay readable by the widget
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(AdmissionControlMiddleware)
+# Outside admission control so rejected requests show up in traces too
+app.add_middleware(TracingMiddleware)
+# Records rejected requests as well, with latencies that include admission control
+app.add_middleware(TrafficRecorderMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Poll-Ms"],
 )
 
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
+ensure_search_index(engine)
+install_rollup_hooks()
+install_active_ticket_hooks()
+install_change_feed_hooks()
+ensure_rollups(engine)
+start_auto_assignment()
 
 # Serve frontend static files (mounted early), but register SPA catch-all AFTER API routes
 frontend_path = Path(__file__).parent.parent.parent / "build"
 if frontend_path.exists():
-    app.mount("/static", StaticFiles(directory=frontend_path), name="static")
+    app.mount("/static", PrecompressedStaticFiles(directory=frontend_path), name="static")
+    # Vite references hashed bundles under /assets; serve them directly instead of via the SPA catch-all
+    if (frontend_path / "assets").is_dir():
+        app.mount("/assets", PrecompressedStaticFiles(directory=frontend_path / "assets"), name="assets")
+    index_document = IndexDocument(frontend_path / "index.html")
 
 
 def _serialize_ticket(ticket: Optional[SupportTicket]) -> Optional[SupportTicketSchema]:
@@ -66,6 +137,25 @@ def _serialize_ticket(ticket: Optional[SupportTicket]) -> Optional[SupportTicket
     )
 
 
+def _format_search_results(terms: str, page: int, page_size: int = 5) -> str:
+    """Render one page of search hits as an HTML Telegram message"""
+    with session_scope() as db:
+        hits, has_more = search_messages(db, terms, limit=page_size, offset=(page - 1) * page_size)
+
+    if not hits:
+        return f"🔍 No messages found for <b>{html.escape(terms)}</b>"
+
+    lines = [f"🔍 <b>Results for \"{html.escape(terms)}\"</b> (page {page})\n"]
+    for hit in hits:
+        lines.append(
+            f"• Ticket #{hit.ticket_id} • {hit.sender} • {hit.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+            f"  {html.escape(hit.snippet)}"
+        )
+    if has_more:
+        lines.append(f"\nMore: <code>/search {html.escape(terms)} --page {page + 1}</code>")
+    return "\n".join(lines)
+
+
 def _serialize_messages(messages: List[SupportMessage]) -> List[SupportMessageSchema]:
     return [
         SupportMessageSchema(
@@ -75,11 +165,60 @@ def _serialize_messages(messages: List[SupportMessage]) -> List[SupportMessageSc
             sender=msg.sender,
             body=msg.body,
             createdAt=msg.created_at,
+            attachment=AttachmentSchema(
+                name=msg.attachment_name,
+                contentType=msg.attachment_type,
+                size=msg.attachment_size,
+                url=f"/api/session/{msg.session_id}/attachments/{msg.id}",
+            ) if msg.attachment_sha256 else None,
         )
         for msg in messages
     ]
 
 
+def _ticket_bot(ticket: SupportTicket) -> TelegramService:
+    """The bot whose group holds the ticket's card and which talks to its agent"""
+    return telegram_pool.get(ticket.bot_name)
+
+
+def _bot_tickets(bot: TelegramService):
+    """WHERE clause matching the tickets pinned to ``bot``"""
+    if bot is not telegram_pool.default:
+        return SupportTicket.bot_name == bot.name
+    others = [name for name in telegram_pool.services if name != bot.name]
+    return or_(SupportTicket.bot_name.is_(None), SupportTicket.bot_name.notin_(others))
+
+
+@app.on_event("startup")
+async def start_background_jobs() -> None:
+    await start_escalations()
+    auto_close_sweeper.start()
+    change_pruner.start()
+
+
+@app.on_event("shutdown")
+async def flush_pending_notifications() -> None:
+    await escalation_scheduler.stop()
+    await auto_close_sweeper.stop()
+    await change_pruner.stop()
+    try:
+        await asyncio.wait_for(_drain_queues(), SHUTDOWN_DRAIN_SECONDS)
+    except asyncio.TimeoutError:
+        print(
+            f"DEBUG: Shutdown drain deadline ({SHUTDOWN_DRAIN_SECONDS}s) passed, "
+            f"{message_writer.snapshot()['pending']} queued messages not written"
+        )
+    shutdown_tracing()
+    traffic_recorder.flush()
+
+
+async def _drain_queues() -> None:
+    # Commit messages still waiting for their batch before the process exits
+    await message_writer.drain()
+    # Don't drop visitor messages still waiting in a debounce window
+    await notification_coalescer.flush_all()
+
+
 @app.get("/api")
 async def api_root():
     return {
@@ -89,7 +228,9 @@ async def api_root():
             "GET /api/health",
             "POST /api/session",
             "GET /api/session/{session_id}",
-            "POST /api/session/{session_id}/messages"
+            "POST /api/session/{session_id}/messages",
+            "GET /api/search?q=...",
+            "GET /api/stats?hours=24"
         ]
     }
 
@@ -99,6 +240,77 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/api/db/routing", dependencies=[Depends(require_admin)])
+async def db_routing():
+    """Read routing decisions, replica health and group-commit batching"""
+    return {**replica_router.snapshot(), "groupCommit": message_writer.snapshot()}
+
+
+@app.get("/api/polling", dependencies=[Depends(require_admin)])
+async def polling_stats():
+    """Effective poll rate, mean hinted interval and the current floor"""
+    return poll_advisor.snapshot()
+
+
+@app.put("/api/polling", dependencies=[Depends(require_admin)])
+async def set_polling_floor(payload: PollSettingsRequest):
+    """Raise (or lower) the minimum poll interval handed to widgets served by this process"""
+    print(f"DEBUG: Poll floor changed from {poll_advisor.floor_ms} to {payload.floorMs} ms")
+    poll_advisor.floor_ms = payload.floorMs
+    return poll_advisor.snapshot()
+
+
+@app.get("/api/debug/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(10, ge=PROFILE_MIN_INTERVAL_MS, le=1000),
+    thread: Optional[str] = None,
+) -> PlainTextResponse:
+    """Sample this worker's stacks for ``seconds``; collapsed stacks ready for flamegraph.pl or speedscope"""
+    try:
+        stacks, rounds = await run_in_threadpool(cpu_profiler.run, seconds, interval_ms / 1000, thread)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A CPU profile is already running in this worker")
+    pid = os.getpid()
+    return PlainTextResponse(
+        collapsed(stacks),
+        headers={
+            "X-Profile-Pid": str(pid),
+            "X-Profile-Samples": str(rounds),
+            "Content-Disposition": f'attachment; filename="cpu-{pid}-{datetime.utcnow():%Y%m%dT%H%M%S}.folded"',
+        },
+    )
+
+
+@app.post("/api/debug/memory/start", dependencies=[Depends(require_admin)])
+async def start_memory_profile(frames: int = Query(10, ge=1, le=100)):
+    """Start tracemalloc in this worker; it stops by itself after PROFILE_TRACEMALLOC_MAX_SECONDS"""
+    return memory_profiler.start(frames)
+
+
+@app.post("/api/debug/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_snapshot(
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    limit: int = Query(25, ge=1, le=500),
+):
+    """Top allocation sites, diffed against the previous snapshot after the first one"""
+    try:
+        return await run_in_threadpool(memory_profiler.snapshot, group_by, limit)
+    except NotTracing:
+        raise HTTPException(status_code=409, detail="tracemalloc is not running; POST /api/debug/memory/start first")
+
+
+@app.post("/api/debug/memory/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_profile():
+    return memory_profiler.stop()
+
+
+@app.get("/api/debug/objects", dependencies=[Depends(require_admin)])
+async def debug_objects(top: int = Query(20, ge=0, le=200)):
+    """Live ORM instances, sessions, cache sizes and the most common object types in this worker"""
+    return await run_in_threadpool(object_counts, top)
+
+
 @app.post("/api/session", response_model=SessionResponse)
 async def create_session(payload: SessionCreateRequest) -> SessionResponse:
     session_id = str(uuid4())
@@ -119,35 +331,192 @@ async def create_session(payload: SessionCreateRequest) -> SessionResponse:
 
 
 @app.get("/api/session/{session_id}", response_model=ConversationResponse)
-async def get_conversation(session_id: str) -> ConversationResponse:
+async def get_conversation(
+    session_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = Query(None, ge=1),
+) -> ConversationResponse:
+    """The ticket and the latest ``limit`` messages; pass ``before_id`` (the oldest id held) to page back through history"""
     print(f"DEBUG: Fetching conversation for session {session_id}")
-    with session_scope() as db:
-        session = db.get(SupportSession, session_id)
+    now = datetime.utcnow()
+    # Polls are served by a replica unless this session was just written to
+    with session_scope(READ, key=session_id) as db:
+        session, ticket = load_session(db, session_id)
         if session is None:
             print(f"DEBUG: Session {session_id} not found when fetching conversation")
             raise HTTPException(status_code=404, detail="Session not found")
 
-        session.last_seen_at = datetime.utcnow()
-
-        ticket_stmt = (
-            select(SupportTicket)
-            .where(SupportTicket.session_id == session_id)
-            .order_by(desc(SupportTicket.created_at))
-        )
-        ticket = db.execute(ticket_stmt).scalars().first()
+        seen_is_stale = (now - session.last_seen_at).total_seconds() >= LAST_SEEN_RESOLUTION_SECONDS
 
+        # Newest first on ix_messages_session_id_id; one extra row tells whether older history exists
         messages_stmt = (
             select(SupportMessage)
             .where(SupportMessage.session_id == session_id)
-            .order_by(asc(SupportMessage.created_at))
+            .order_by(desc(SupportMessage.id))
+            .limit(limit + 1)
         )
+        if before_id is not None:
+            messages_stmt = messages_stmt.where(SupportMessage.id < before_id)
         messages = db.execute(messages_stmt).scalars().all()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
 
-        return ConversationResponse(
+        # Only polls get a hint; history pages are fetched on scroll
+        hint = poll_advisor.hint(ticket, messages, now) if before_id is None else None
+        conversation = ConversationResponse(
             ticket=_serialize_ticket(ticket),
             messages=_serialize_messages(messages),
+            hasMore=has_more,
+            nextPollMs=hint.next_poll_ms if hint else None,
         )
 
+    if seen_is_stale:
+        with session_scope() as db:
+            db.execute(update(SupportSession).where(SupportSession.id == session_id).values(last_seen_at=now))
+    if hint is not None:
+        response.headers["X-Next-Poll-Ms"] = str(hint.next_poll_ms)
+    return conversation
+
+
+@app.get("/api/search", response_model=SearchResponse, dependencies=[Depends(require_admin)])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0),
+) -> SearchResponse:
+    """Ranked full-text search over message bodies"""
+    with session_scope(READ) as db:
+        hits, has_more = search_messages(db, q, limit=limit, offset=offset)
+
+    return SearchResponse(
+        query=q,
+        results=[
+            SearchHitSchema(
+                id=hit.id,
+                ticketId=hit.ticket_id,
+                sessionId=hit.session_id,
+                sender=hit.sender,
+                snippet=hit.snippet,
+                createdAt=hit.created_at,
+                rank=hit.rank,
+            )
+            for hit in hits
+        ],
+        limit=limit,
+        offset=offset,
+        hasMore=has_more,
+    )
+
+
+@app.get("/api/stats", response_model=StatsResponse, dependencies=[Depends(require_admin)])
+async def stats(hours: int = Query(24, ge=1, le=24 * 90)) -> StatsResponse:
+    """Support analytics read from the incrementally maintained rollup tables"""
+    with session_scope(READ) as db:
+        return StatsResponse(**read_stats(db, hours))
+
+
+@app.get("/api/changes", response_model=ChangesResponse, dependencies=[Depends(require_admin)])
+async def list_changes(
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=CHANGE_FEED_MAX_WAIT_SECONDS),
+) -> ChangesResponse:
+    """Ticket and message changes after ``cursor``, in commit-safe order; ``wait`` long-polls while none are ready"""
+    try:
+        after_id = decode_cursor(cursor)
+        events, last_id, has_more = await wait_for_changes(after_id, limit, wait)
+    except MalformedCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except CursorExpired:
+        raise HTTPException(status_code=410, detail="Cursor is older than the change feed retention; resync and start without a cursor")
+
+    return ChangesResponse(
+        events=[
+            ChangeEventSchema(
+                id=change.id,
+                at=change.created_at,
+                entity=change.entity,
+                op=change.op,
+                entityId=change.entity_id,
+                ticketId=change.ticket_id,
+                sessionId=change.session_id,
+                data=change.data,
+            )
+            for change in events
+        ],
+        cursor=encode_cursor(last_id),
+        hasMore=has_more,
+    )
+
+
+@app.get("/api/export", dependencies=[Depends(require_admin)])
+async def export_conversations(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    gzip: bool = False,
+) -> StreamingResponse:
+    """Stream tickets created in [since, until) with their messages; memory use is independent of the export size"""
+    if status is not None and status not in TICKET_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(TICKET_STATUSES)}")
+
+    media_type = "application/gzip" if gzip else ("application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8")
+    # A sync generator: Starlette pulls it from the threadpool, so the blocking cursor never runs on the event loop
+    return StreamingResponse(
+        iter_export(format, iter_rows(since, until, status, category), compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format, gzip)}"'},
+    )
+
+
+@app.post("/api/tickets/bulk/close", response_model=BulkResultResponse, dependencies=[Depends(require_admin)])
+async def bulk_close(payload: BulkCloseRequest, background_tasks: BackgroundTasks) -> BulkResultResponse:
+    """Close every open/claimed ticket matching the filter in one statement"""
+    if payload.status is not None and payload.status not in ("open", "claimed"):
+        raise HTTPException(status_code=400, detail="status must be open or claimed")
+    idle_since = datetime.utcnow() - timedelta(hours=payload.idleHours) if payload.idleHours else None
+    criteria = ticket_filter(
+        status=payload.status,
+        category=payload.category,
+        agent_id=payload.agentId,
+        created_before=payload.createdBefore,
+        idle_since=idle_since,
+        ticket_ids=payload.ticketIds,
+    )
+    if not criteria:
+        raise HTTPException(status_code=400, detail="At least one filter is required")
+
+    with session_scope() as db:
+        result = close_tickets(db, criteria, payload.reason)
+    background_tasks.add_task(notify_bulk, result)
+    return BulkResultResponse(action=result.action, count=len(result.tickets), ticketIds=result.ticket_ids)
+
+
+@app.post("/api/tickets/bulk/reassign", response_model=BulkResultResponse, dependencies=[Depends(require_admin)])
+async def bulk_reassign(payload: BulkReassignRequest, background_tasks: BackgroundTasks) -> BulkResultResponse:
+    """Move all claimed tickets of one agent to another agent, or back to the queue"""
+    with session_scope() as db:
+        from .models import SupportAgent
+        if payload.toAgentId is not None:
+            target = db.get(SupportAgent, payload.toAgentId)
+            if target is None or not target.is_active:
+                raise HTTPException(status_code=404, detail="Target agent not found or inactive")
+        result = reassign_tickets(db, payload.fromAgentId, payload.toAgentId, payload.reason)
+    background_tasks.add_task(notify_bulk, result)
+    return BulkResultResponse(action=result.action, count=len(result.tickets), ticketIds=result.ticket_ids)
+
+
+@app.post("/api/tickets/bulk/auto-close", response_model=BulkResultResponse, dependencies=[Depends(require_admin)])
+async def bulk_auto_close() -> BulkResultResponse:
+    """Run the idle-ticket sweep now (AUTO_CLOSE_IDLE_HOURS must be set)"""
+    if auto_close_sweeper.idle_hours <= 0:
+        raise HTTPException(status_code=400, detail="AUTO_CLOSE_IDLE_HOURS is not configured")
+    result = await auto_close_sweeper.sweep()
+    return BulkResultResponse(action=result.action, count=len(result.tickets), ticketIds=result.ticket_ids)
+
 
 @app.post("/api/session/{session_id}/messages")
 async def create_message(session_id: str, payload: dict):
@@ -163,22 +532,16 @@ async def create_message(session_id: str, payload: dict):
         # Database operations
         with session_scope() as db:
             print(f"DEBUG: Checking session {session_id}")
-            session = db.get(SupportSession, session_id)
+            print(f"DEBUG: Looking for existing ticket")
+            session, ticket = load_session(db, session_id, active_only=True)
             if session is None:
                 raise HTTPException(status_code=404, detail="Session not found")
             
-            session.last_seen_at = datetime.utcnow()
-            
-            print(f"DEBUG: Looking for existing ticket")
-            ticket_stmt = (
-                select(SupportTicket)
-                .where(SupportTicket.session_id == session_id)
-                .where(SupportTicket.status.in_(["open", "claimed"]))
-                .order_by(desc(SupportTicket.created_at))
-            )
-            ticket = db.execute(ticket_stmt).scalars().first()
-            
             is_new_ticket = ticket is None
+            # Follow-ups on an existing ticket are batched with other requests' inserts (group commit)
+            batched = message_writer.enabled and not is_new_ticket
+            if not batched:
+                session.last_seen_at = datetime.utcnow()
             
             if is_new_ticket:
                 print(f"DEBUG: Creating new ticket")
@@ -193,43 +556,66 @@ async def create_message(session_id: str, payload: dict):
                 )
                 db.add(ticket)
                 db.flush()
-                print(f"DEBUG: New ticket created with ID {ticket.id}")
+                ticket.bot_name = telegram_pool.route(ticket.id, ticket.category, session.locale)
+                print(f"DEBUG: New ticket created with ID {ticket.id} on bot {ticket.bot_name}")
+
+                # Opt-in: hand the ticket straight to the least-loaded agent
+                auto_agent = auto_assign(db, ticket)
+                if auto_agent:
+                    print(f"DEBUG: Auto-assigned ticket {ticket.id} to agent {auto_agent.id}")
             else:
                 print(f"DEBUG: Using existing ticket {ticket.id}")
             
-            print(f"DEBUG: Creating message")
-            message = SupportMessage(
-                ticket_id=ticket.id,
-                session_id=session_id,
-                sender="visitor",
-                body=payload.get("body", "").strip(),
-                created_at=datetime.utcnow(),
-            )
-            db.add(message)
-            db.commit()
-            print(f"DEBUG: Message {message.id} created successfully")
+            message = None
+            if not batched:
+                print(f"DEBUG: Creating message")
+                message = SupportMessage(
+                    ticket_id=ticket.id,
+                    session_id=session_id,
+                    sender="visitor",
+                    body=payload.get("body", "").strip(),
+                    created_at=datetime.utcnow(),
+                )
+                db.add(message)
+                db.commit()
+                print(f"DEBUG: Message {message.id} created successfully")
         
             # Capture values before closing session
             ticket_id = ticket.id
             ticket_category = ticket.category
             ticket_assigned_agent_id = ticket.assigned_agent_id
-            message_id = message.id
+            ticket_card_message_id = ticket.group_message_id
+            ticket_bot_name = ticket.bot_name
+            message_id = message.id if message is not None else None
+            auto_assigned = is_new_ticket and ticket_assigned_agent_id is not None
+
+        if batched:
+            message_id = await message_writer.submit(
+                ticket_id=ticket_id,
+                session_id=session_id,
+                sender="visitor",
+                body=payload.get("body", "").strip(),
+                created_at=datetime.utcnow(),
+            )
+            print(f"DEBUG: Message {message_id} created by group commit")
         
         # Send Telegram notification (outside session)
         # Always notify for new tickets OR tickets without assigned agents
-        should_notify = is_new_ticket or ticket_assigned_agent_id is None
+        should_notify = (is_new_ticket and not auto_assigned) or ticket_assigned_agent_id is None
         
         print(f"DEBUG: Notification check - is_new_ticket: {is_new_ticket}, assigned_agent_id: {ticket_assigned_agent_id}, should_notify: {should_notify}")
         
         if should_notify:
-            print(f"DEBUG: Sending Telegram notification for ticket {ticket_id}")
+            print(f"DEBUG: Queueing Telegram notification for ticket {ticket_id}")
             try:
-                result = await telegram_service.notify_new_ticket(
-                    ticket_id=ticket_id,
+                await notification_coalescer.add(
+                    ticket_id,
+                    KIND_NEW_TICKET,
+                    payload.get("body", "").strip(),
                     category=ticket_category or payload.get("category") or "General",
-                    message_body=payload.get("body", "").strip()
+                    card_message_id=ticket_card_message_id,
+                    bot_name=ticket_bot_name,
                 )
-                print(f"DEBUG: Telegram notification result: {result}")
             except Exception as e:
                 print(f"DEBUG: Telegram notification failed: {e}")
                 import traceback
@@ -243,16 +629,23 @@ async def create_message(session_id: str, payload: dict):
                     from .models import SupportAgent
                     agent_stmt = select(SupportAgent).where(SupportAgent.id == ticket_assigned_agent_id)
                     agent = db.execute(agent_stmt).scalars().first()
-                    
-                    if agent:
-                        await telegram_service.notify_customer_message(
-                            str(agent.tg_chat_id),
-                            ticket_id,
-                            payload.get("body", "").strip()
-                        )
-                        print(f"DEBUG: Notified agent {agent.name} about new visitor message")
-                    else:
-                        print(f"DEBUG: Agent with ID {ticket_assigned_agent_id} not found")
+                    agent_chat_id = str(agent.tg_chat_id) if agent else None
+
+                if agent_chat_id and auto_assigned:
+                    await telegram_pool.get(ticket_bot_name).notify_agent_assigned(agent_chat_id, ticket_id)
+
+                if agent_chat_id:
+                    # Bursts of visitor messages are merged into one Telegram message
+                    await notification_coalescer.add(
+                        ticket_id,
+                        KIND_CUSTOMER_MESSAGE,
+                        payload.get("body", "").strip(),
+                        chat_id=agent_chat_id,
+                        bot_name=ticket_bot_name,
+                    )
+                    print(f"DEBUG: Queued notification for agent {ticket_assigned_agent_id} about new visitor message")
+                else:
+                    print(f"DEBUG: Agent with ID {ticket_assigned_agent_id} not found")
             except Exception as e:
                 print(f"DEBUG: Failed to notify assigned agent: {e}")
                 import traceback
@@ -269,11 +662,96 @@ async def create_message(session_id: str, payload: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _forward_attachment(ticket_id: int, bot: TelegramService, chat_id: str, stored: StoredFile, caption: str) -> None:
+    text = f"📎 <b>Attachment (Ticket #{ticket_id}):</b> {html.escape(stored.filename)}"
+    if caption:
+        text += f"\n\n{html.escape(caption)}"
+    try:
+        await bot.send_file(chat_id, stored.path, stored.filename, stored.content_type, text)
+    except Exception as e:
+        print(f"DEBUG: Failed to forward attachment for ticket {ticket_id}: {e}")
+
+
+@app.post("/api/session/{session_id}/attachments")
+async def upload_attachment(session_id: str, request: Request, background_tasks: BackgroundTasks) -> MessageResponse:
+    """Stream a visitor's file (multipart field ``file``, optional ``body`` caption) to the store and the agent"""
+    with session_scope() as db:
+        session, ticket = load_session(db, session_id, active_only=True)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if ticket is None:
+            raise HTTPException(status_code=409, detail="Send a message before attaching files")
+        ticket_id = ticket.id
+
+    try:
+        stored, fields = await receive_upload(request)
+    except AttachmentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    caption = fields.get("body", "").strip()
+    with session_scope() as db:
+        ticket = db.get(SupportTicket, ticket_id)
+        message = SupportMessage(
+            ticket_id=ticket_id,
+            session_id=session_id,
+            sender="visitor",
+            body=caption or None,
+            created_at=datetime.utcnow(),
+            attachment_sha256=stored.sha256,
+            attachment_name=stored.filename,
+            attachment_type=stored.content_type,
+            attachment_size=stored.size,
+        )
+        db.add(message)
+        db.get(SupportSession, session_id).last_seen_at = datetime.utcnow()
+        db.flush()
+        message_id = message.id
+
+        from .models import SupportAgent
+        agent = db.get(SupportAgent, ticket.assigned_agent_id) if ticket.assigned_agent_id else None
+        bot = _ticket_bot(ticket)
+        chat_id = str(agent.tg_chat_id) if agent else bot.support_group_id
+
+    # Uploaded to Telegram after the response so the visitor isn't kept waiting
+    if chat_id:
+        background_tasks.add_task(_forward_attachment, ticket_id, bot, chat_id, stored, caption)
+    return MessageResponse(ticket_id=ticket_id, message_id=message_id)
+
+
+@app.get("/api/session/{session_id}/attachments/{message_id}")
+async def download_attachment(session_id: str, message_id: int) -> FileResponse:
+    with session_scope() as db:
+        message = db.get(SupportMessage, message_id)
+        if message is None or message.session_id != session_id or not message.attachment_sha256:
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        path, name, content_type = path_for(message.attachment_sha256), message.attachment_name, message.attachment_type
+
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return FileResponse(path, media_type=content_type, filename=name)
+
+
 @app.post("/api/telegram/webhook")
 async def telegram_webhook(update: dict):
-    """Handle Telegram webhook updates (messages, button clicks, etc.)"""
+    """Handle Telegram webhook updates for the default bot"""
+    return await _handle_telegram_update(update, telegram_pool.default)
+
+
+@app.post("/api/telegram/webhook/{bot_name}")
+async def telegram_bot_webhook(bot_name: str, update: dict):
+    """Handle Telegram webhook updates received by one of the TELEGRAM_BOTS"""
+    bot = telegram_pool.services.get(bot_name)
+    if bot is None:
+        raise HTTPException(status_code=404, detail="Unknown bot")
+    return await _handle_telegram_update(update, bot)
+
+
+async def _handle_telegram_update(update: dict, bot: TelegramService):
+    """Handle an update (messages, button clicks, etc.) received by ``bot``; replies go through the same bot"""
     try:
-        print(f"DEBUG: Received webhook update: {json.dumps(update, indent=2)}")
+        print(f"DEBUG: Received webhook update via bot {bot.name}: {json.dumps(update, indent=2)}")
         # Handle callback queries (button clicks)
         if "callback_query" in update:
             callback = update["callback_query"]
@@ -287,6 +765,13 @@ async def telegram_webhook(update: dict):
                 agent_telegram_id = from_user["id"]
                 
                 with session_scope() as db:
+                    ticket = db.get(SupportTicket, ticket_id)
+                    if ticket is not None and _ticket_bot(ticket) is not bot:
+                        # Card buttons only resolve against the bot that posted them
+                        if callback_id:
+                            await bot.answer_callback(callback_id, "This ticket belongs to another support group", show_alert=True)
+                        return {"ok": True}
+
                     # Find or create agent
                     from .models import SupportAgent
                     agent_stmt = select(SupportAgent).where(SupportAgent.tg_chat_id == agent_telegram_id)
@@ -304,35 +789,43 @@ async def telegram_webhook(update: dict):
                         db.flush()
                     
                     # Assign ticket to agent
-                    ticket_stmt = select(SupportTicket).where(SupportTicket.id == ticket_id)
-                    ticket = db.execute(ticket_stmt).scalars().first()
-                    
-                    if ticket and not ticket.assigned_agent_id:
-                        ticket.assigned_agent_id = agent.id
-                        ticket.status = "claimed"
-                        ticket.claimed_at = datetime.utcnow()
+                    if claim_ticket(ticket, agent):
+                        if message and ticket.group_message_id is None:
+                            ticket.group_message_id = message["message_id"]
                         db.commit()
 
-                        # Remove claim buttons from group message
-                        if message:
-                            await telegram_service.remove_claim_buttons(message["message_id"])
+                        # Turn the group card into "claimed by X" (this also removes the claim buttons); the click
+                        # may come from an escalation reminder, which is not the card
+                        card_message_id = ticket.group_message_id or (message["message_id"] if message else None)
+                        if card_message_id:
+                            await bot.update_ticket_card(
+                                card_message_id,
+                                ticket_id,
+                                ticket.category,
+                                "claimed",
+                                agent_name=agent.name,
+                            )
+                        if message and message["message_id"] != card_message_id:
+                            await bot.remove_claim_buttons(message["message_id"])
 
                         # Notify agent they're assigned
-                        await telegram_service.notify_agent_assigned(
+                        await bot.notify_agent_assigned(
                             str(agent_telegram_id), 
                             ticket_id
                         )
                         if callback_id:
-                            await telegram_service.answer_callback(callback_id, "Ticket claimed")
+                            await bot.answer_callback(callback_id, "Ticket claimed")
                     else:
+                        if message and ticket is not None and message["message_id"] != ticket.group_message_id:
+                            await bot.remove_claim_buttons(message["message_id"])
                         if callback_id:
-                            await telegram_service.answer_callback(callback_id, "Already claimed", show_alert=True)
+                            await bot.answer_callback(callback_id, "Already claimed", show_alert=True)
 
             elif callback_data.startswith("PASS#"):
                 if message:
-                    await telegram_service.remove_claim_buttons(message["message_id"])
+                    await bot.remove_claim_buttons(message["message_id"])
                 if callback_id:
-                    await telegram_service.answer_callback(callback_id, "Passed")
+                    await bot.answer_callback(callback_id, "Passed")
 
             elif callback_data.startswith("CLOSE#"):
                 ticket_id = int(callback_data.split("#")[1])
@@ -346,25 +839,31 @@ async def telegram_webhook(update: dict):
 
                     ticket = db.get(SupportTicket, ticket_id)
 
-                    if not agent or not ticket or ticket.assigned_agent_id != agent.id:
+                    if ticket is not None and _ticket_bot(ticket) is not bot:
                         if callback_id:
-                            await telegram_service.answer_callback(callback_id, "You can't close this ticket", show_alert=True)
+                            await bot.answer_callback(callback_id, "This ticket belongs to another support group", show_alert=True)
+                    elif not agent or not ticket or ticket.assigned_agent_id != agent.id:
+                        if callback_id:
+                            await bot.answer_callback(callback_id, "You can't close this ticket", show_alert=True)
                     else:
                         ticket.status = "closed"
                         ticket.closed_at = datetime.utcnow()
                         db.commit()
 
                         if callback_id:
-                            await telegram_service.answer_callback(callback_id, "Ticket closed")
+                            await bot.answer_callback(callback_id, "Ticket closed")
 
-                        await telegram_service.send_message(
+                        await bot.send_message(
                             str(agent_telegram_id),
                             f"✅ <b>Ticket #{ticket_id} closed successfully!</b>"
                         )
 
-                        await telegram_service.send_message(
-                            telegram_service.support_group_id,
-                            f"✅ <b>Ticket #{ticket_id} closed</b> • {ticket.category or 'General'}"
+                        await bot.update_ticket_card(
+                            ticket.group_message_id,
+                            ticket_id,
+                            ticket.category,
+                            "closed",
+                            agent_name=agent.name,
                         )
 
         # Handle direct messages from agents
@@ -401,37 +900,71 @@ async def telegram_webhook(update: dict):
                             db.commit()
                             
                             # Notify agent
-                            await telegram_service.send_message(
+                            await bot.send_message(
                                 str(agent_telegram_id),
                                 f"✅ <b>Ticket #{ticket_id} closed successfully!</b>\n\n"
                                 f"Category: {ticket.category or 'General'}\n"
                                 f"Status: Resolved"
                             )
                             
-                            # Notify support group
-                            await telegram_service.send_message(
-                                telegram_service.support_group_id,
-                                f"✅ <b>Ticket #{ticket_id} closed</b> by {agent.name} • {ticket.category or 'General'}"
+                            # Update the ticket's card in the support group it was posted to
+                            await _ticket_bot(ticket).update_ticket_card(
+                                ticket.group_message_id,
+                                ticket_id,
+                                ticket.category,
+                                "closed",
+                                agent_name=agent.name,
                             )
                         else:
-                            await telegram_service.send_message(
+                            await bot.send_message(
                                 str(agent_telegram_id),
                                 f"❌ Cannot close ticket #{ticket_id}. Either it doesn't exist or it's not assigned to you."
                             )
                     except (ValueError, IndexError):
-                        await telegram_service.send_message(
+                        await bot.send_message(
                             str(agent_telegram_id),
                             "❌ Invalid command. Use: /close_123 or /close 123"
                         )
                 
+                # Toggle availability for auto-assignment
+                elif text.startswith("/away") or text.startswith("/available"):
+                    agent.is_active = text.startswith("/available")
+                    db.commit()
+                    await bot.send_message(
+                        str(agent_telegram_id),
+                        "🟢 You're available for new tickets." if agent.is_active else "⏸ You won't be auto-assigned new tickets."
+                    )
+
+                # Search message history: /search <terms> [--page N]
+                elif text.startswith("/search"):
+                    terms = text[len("/search"):].strip()
+                    page = 1
+                    if "--page" in terms:
+                        terms, _, page_arg = terms.rpartition("--page")
+                        terms = terms.strip()
+                        page = int(page_arg) if page_arg.strip().isdigit() else 1
+
+                    if not terms:
+                        await bot.send_message(
+                            str(agent_telegram_id),
+                            "❌ Usage: /search refund email"
+                        )
+                    else:
+                        await bot.send_message(
+                            str(agent_telegram_id),
+                            _format_search_results(terms, max(page, 1))
+                        )
+
                 # Handle help command
                 elif text.startswith("/help"):
-                    await telegram_service.send_message(
+                    await bot.send_message(
                         str(agent_telegram_id),
                         "🤖 <b>Agent Commands:</b>\n\n"
                         "• Send regular messages to reply to customers\n"
                         "• <code>/close_123</code> - Close ticket #123\n"
                         "• <code>/close 123</code> - Close ticket #123\n"
+                        "• <code>/search terms</code> - Search past conversations\n"
+                        "• <code>/away</code> / <code>/available</code> - Pause or resume auto-assignment\n"
                         "• <code>/help</code> - Show this help message"
                     )
                 
@@ -442,6 +975,7 @@ async def telegram_webhook(update: dict):
                         select(SupportTicket)
                         .where(SupportTicket.assigned_agent_id == agent.id)
                         .where(SupportTicket.status == "claimed")
+                        .where(_bot_tickets(bot))
                         .order_by(desc(SupportTicket.claimed_at))
                     )
                     ticket = db.execute(ticket_stmt).scalars().first()
@@ -460,12 +994,12 @@ async def telegram_webhook(update: dict):
                         db.commit()
                         
                         # Confirm message sent
-                        await telegram_service.send_message(
+                        await bot.send_message(
                             str(agent_telegram_id),
                             f"📨 Message sent to customer (Ticket #{ticket.id})"
                         )
                     else:
-                        await telegram_service.send_message(
+                        await bot.send_message(
                             str(agent_telegram_id),
                             "❌ No active ticket assigned to you. Claim a ticket first."
                         )
@@ -496,6 +1030,7 @@ async def close_ticket(ticket_id: int):
             
             # Send notification to Telegram
             try:
+                agent = None
                 if ticket.assigned_agent_id:
                     # Find the agent
                     from .models import SupportAgent
@@ -503,17 +1038,20 @@ async def close_ticket(ticket_id: int):
                     agent = db.execute(agent_stmt).scalars().first()
                     
                     if agent:
-                        await telegram_service.send_message(
+                        await _ticket_bot(ticket).send_message(
                             str(agent.tg_chat_id),
                             f"✅ <b>Ticket #{ticket_id} has been closed</b>\n\n"
                             f"Category: {ticket.category or 'General'}\n"
                             f"Thank you for your help!"
                         )
                 
-                # Also notify support group
-                await telegram_service.send_message(
-                    telegram_service.support_group_id,
-                    f"✅ <b>Ticket #{ticket_id} closed</b> • {ticket.category or 'General'}"
+                # Also update the ticket's card in the support group
+                await _ticket_bot(ticket).update_ticket_card(
+                    ticket.group_message_id,
+                    ticket_id,
+                    ticket.category,
+                    "closed",
+                    agent_name=agent.name if agent else None,
                 )
             except Exception as e:
                 print(f"Failed to send close notification: {e}")
@@ -531,21 +1069,18 @@ async def create_new_ticket(session_id: str):
     """Create a new ticket for a session (when previous ticket is closed)"""
     try:
         with session_scope() as db:
-            session = db.get(SupportSession, session_id)
+            # A WHERE lookup, unlike db.get, lets a malformed id fall through to the 404
+            session, _ = load_session(db, session_id)
             if not session:
                 raise HTTPException(status_code=404, detail="Session not found")
             
-            # Close all previous tickets for this session before creating a new one
-            prev_tickets_stmt = (
-                select(SupportTicket)
-                .where(SupportTicket.session_id == session_id)
-                .order_by(desc(SupportTicket.created_at))
-            )
-            prev_tickets = db.execute(prev_tickets_stmt).scalars().all()
-            for t in prev_tickets:
-                if t.status != "closed":
-                    t.status = "closed"
-                    t.closed_at = datetime.utcnow()
+            # Close all previous tickets for this session before creating a new one (single UPDATE)
+            closed = close_tickets(db, ticket_filter(session_id=session_id), "customer started a new conversation")
+            closed_cards = [
+                (t["id"], t["category"], t["group_message_id"], t["bot_name"])
+                for t in closed.tickets
+                if t["group_message_id"] is not None
+            ]
             
             # Create a new ticket
             new_ticket = SupportTicket(
@@ -556,16 +1091,25 @@ async def create_new_ticket(session_id: str):
                 created_at=datetime.utcnow(),
             )
             db.add(new_ticket)
+            db.flush()
+            new_ticket.bot_name = telegram_pool.route(new_ticket.id, locale=session.locale)
+            auto_agent = auto_assign(db, new_ticket)
             db.commit()
             
-            # Notify support group about new ticket
+            # Mark the previous cards closed and post the new ticket's card to the support group
             try:
-                await telegram_service.send_message(
-                    telegram_service.support_group_id,
-                    f"🆕 <b>New Ticket #{new_ticket.id}</b> • General\n"
-                    f"Customer started a new conversation\n"
-                    f"Available for claiming."
-                )
+                for closed_id, closed_category, closed_card_id, closed_bot in closed_cards:
+                    await telegram_pool.get(closed_bot).update_ticket_card(closed_card_id, closed_id, closed_category, "closed")
+
+                if auto_agent:
+                    await _ticket_bot(new_ticket).notify_agent_assigned(str(auto_agent.tg_chat_id), new_ticket.id)
+                else:
+                    new_ticket.group_message_id = await _ticket_bot(new_ticket).notify_new_ticket(
+                        ticket_id=new_ticket.id,
+                        category="General",
+                        message_body="Customer started a new conversation",
+                    )
+                    db.commit()
             except Exception as e:
                 print(f"Failed to send new ticket notification: {e}")
             
@@ -599,13 +1143,18 @@ async def reopen_ticket(ticket_id: int):
             ticket.assigned_agent_id = None  # Unassign agent
             db.commit()
             
-            # Send notification to support group
+            # Put the claim buttons back on the ticket's card in the support group
             try:
-                await telegram_service.send_message(
-                    telegram_service.support_group_id,
-                    f"🔄 <b>Ticket #{ticket_id} reopened</b> • {ticket.category or 'General'}\n"
-                    f"Available for claiming again."
+                card_message_id = await _ticket_bot(ticket).update_ticket_card(
+                    ticket.group_message_id,
+                    ticket_id,
+                    ticket.category,
+                    "open",
+                    reopened=True,
                 )
+                if card_message_id != ticket.group_message_id:
+                    ticket.group_message_id = card_message_id
+                    db.commit()
             except Exception as e:
                 print(f"Failed to send reopen notification: {e}")
         
@@ -619,25 +1168,31 @@ async def reopen_ticket(ticket_id: int):
 
 @app.post("/api/setup/telegram-webhook")
 async def setup_telegram_webhook(webhook_url: str, drop_pending: bool = False):
-    """Set the Telegram webhook URL"""
+    """Set the Telegram webhook URL of every bot; bots other than the default one get ``<webhook_url>/<name>``"""
     try:
-        # Optionally drop pending updates if backlog built up
-        if drop_pending:
-            try:
-                import httpx
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"https://api.telegram.org/bot{telegram_service.bot_token}/deleteWebhook",
-                        params={"drop_pending_updates": True}
-                    )
-            except Exception:
-                pass
+        results = {}
+        for bot in telegram_pool:
+            bot_url = webhook_url if bot is telegram_pool.default else f"{webhook_url.rstrip('/')}/{bot.name}"
+            # Optionally drop pending updates if backlog built up
+            if drop_pending:
+                try:
+                    import httpx
+                    async with httpx.AsyncClient() as client:
+                        await client.post(
+                            f"https://api.telegram.org/bot{bot.bot_token}/deleteWebhook",
+                            params={"drop_pending_updates": True}
+                        )
+                except Exception:
+                    pass
+
+            results[bot.name] = {"ok": await bot.set_webhook(bot_url), "webhook_url": bot_url}
 
-        success = await telegram_service.set_webhook(webhook_url)
+        success = all(result["ok"] for result in results.values())
         return {
             "ok": success,
             "message": "Webhook set successfully" if success else "Failed to set webhook",
-            "webhook_url": webhook_url
+            "webhook_url": webhook_url,
+            "bots": results,
         }
     except Exception as e:
         return {"ok": False, "message": f"Error setting webhook: {e}"}
@@ -669,22 +1224,13 @@ async def test_message_creation(session_id: str = "bd205337-c9e8-41de-b561-360c9
         with session_scope() as db:
             print(f"Step 2: Database session created")
             
-            # Check if session exists
-            session = db.get(SupportSession, session_id)
+            # Check if session exists, together with its active ticket
+            session, ticket = load_session(db, session_id, active_only=True)
             if session is None:
                 return {"error": "Session not found", "session_id": session_id}
             
             print(f"Step 3: Session found: {session.id}")
             
-            # Look for existing ticket
-            ticket_stmt = (
-                select(SupportTicket)
-                .where(SupportTicket.session_id == session_id)
-                .where(SupportTicket.status.in_(["open", "claimed"]))
-                .order_by(desc(SupportTicket.created_at))
-            )
-            ticket = db.execute(ticket_stmt).scalars().first()
-            
             print(f"Step 4: Existing ticket: {ticket.id if ticket else 'None'}")
             
             if ticket is None:
@@ -735,7 +1281,7 @@ async def test_db():
     try:
         with session_scope() as db:
             # Create a test session
-            session_id = "test-session-123"
+            session_id = str(uuid4())
             
             # Check if session exists
             session = db.get(SupportSession, session_id)
@@ -778,7 +1324,7 @@ async def test_message_with_debug():
     """Test message creation with debug info returned in response"""
     try:
         # Create session
-        session_id = f"debug-{datetime.utcnow().strftime('%H%M%S')}"
+        session_id = str(uuid4())
         with session_scope() as db:
             session = SupportSession(
                 id=session_id,
@@ -802,18 +1348,10 @@ async def test_message_with_debug():
         debug_info = []
         
         with session_scope() as db:
-            session = db.get(SupportSession, session_id)
+            # Session and existing ticket in one lookup
+            session, ticket = load_session(db, session_id, active_only=True)
             session.last_seen_at = datetime.utcnow()
             
-            # Look for existing ticket
-            ticket_stmt = (
-                select(SupportTicket)
-                .where(SupportTicket.session_id == session_id)
-                .where(SupportTicket.status.in_(["open", "claimed"]))
-                .order_by(desc(SupportTicket.created_at))
-            )
-            ticket = db.execute(ticket_stmt).scalars().first()
-            
             is_new_ticket = ticket is None
             debug_info.append(f"is_new_ticket: {is_new_ticket}")
             
@@ -929,6 +1467,10 @@ async def setup_info():
         "telegram_bot_configured": bot_token_configured,
         "support_group_configured": group_id_configured,
         "webhook_endpoint": "/api/telegram/webhook",
+        "bots": {
+            bot.name: {"group_configured": bool(bot.support_group_id), "categories": bot.categories, "locales": bot.locales}
+            for bot in telegram_pool
+        },
         "setup_instructions": {
             "1": "Set TELEGRAM_BOT_TOKEN environment variable",
             "2": "Set SUPPORT_GROUP_CHAT_ID environment variable", 
@@ -946,13 +1488,13 @@ async def root():
 # SPA catch-all must be registered last so API routes take precedence
 if frontend_path.exists():
     @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
+    async def serve_frontend(full_path: str, request: Request):
         # Don't serve API routes as static files
         if full_path.startswith("api/"):
             raise HTTPException(status_code=404, detail="Not found")
         
-        # Serve index.html for all non-API routes (SPA routing)
-        return FileResponse(frontend_path / "index.html")
+        # Serve index.html for all non-API routes (SPA routing), from memory with ETag revalidation
+        return index_document.response(request.scope)
 
 
 # --- Diagnostic endpoint to simulate Telegram "Claim" flow ---
@@ -985,15 +1527,13 @@ async def test_claim(ticket_id: int, agent_tg_id: int):
             if not ticket:
                 raise HTTPException(status_code=404, detail="Ticket not found")
 
-            already_claimed = ticket.assigned_agent_id is not None
+            already_claimed = not claim_ticket(ticket, agent)
             if not already_claimed:
-                ticket.assigned_agent_id = agent.id
-                ticket.status = "claimed"
-                ticket.claimed_at = datetime.utcnow()
                 db.commit()
+            bot = _ticket_bot(ticket)
 
         # Notify agent similarly to webhook flow
-        await telegram_service.notify_agent_assigned(str(agent_tg_id), ticket_id)
+        await bot.notify_agent_assigned(str(agent_tg_id), ticket_id)
 
         return {
             "ok": True,
@@ -0,0 +1,231 @@
+"""Lightweight schema migrations applied at startup after create_all"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import uuid
+from typing import Dict, List
+
+from sqlalchemy import case, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import sqltypes
+
+from .database import Base, engine as default_engine
+from .models import CodedString, CompactUUID, SupportSession, SupportTicket
+
+logger = logging.getLogger(__name__)
+
+COMPACT_BATCH_SIZE = int(os.getenv("COMPACT_BATCH_SIZE", "5000"))
+
+
+def add_missing_columns(engine: Engine) -> List[str]:
+    """Add columns declared on the models but missing from existing tables.
+
+    ``create_all`` only creates tables that don't exist yet, so new nullable
+    columns on existing tables are added here with ``ALTER TABLE``. Returns
+    the ``table.column`` names that were added.
+    """
+    added: List[str] = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.warning("Cannot add NOT NULL column %s.%s without a default", table.name, column.name)
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info("Added column %s.%s", table.name, column.name)
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(engine: Engine) -> None:
+    """Create indexes declared on the models but missing from existing tables"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn, checkfirst=True)
+                    logger.info("Created index %s", index.name)
+
+
+def _legacy_columns(engine: Engine) -> Dict[str, List[str]]:
+    """Compact-typed model columns that existing tables still store as strings, by table"""
+    inspector = inspect(engine)
+    legacy: Dict[str, List[str]] = {}
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        reflected = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if isinstance(column.type, (CompactUUID, CodedString)) and isinstance(reflected.get(column.name), sqltypes.String):
+                legacy.setdefault(table.name, []).append(column.name)
+    return legacy
+
+
+def _code_case(column: str, values) -> str:
+    cases = " ".join(f"WHEN '{value}' THEN {code}" for code, value in enumerate(values))
+    return f"CASE {column} {cases} END"
+
+
+def _uuid_blob(value):
+    try:
+        return uuid.UUID(value).bytes if isinstance(value, str) else value
+    except ValueError:
+        return None
+
+
+def _rebuild_sqlite_table(conn: Connection, table, batch_size: int) -> None:
+    """SQLite can't change column types: copy into a new table in rowid batches, then swap it in"""
+    new_name = f"{table.name}__compact"
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+    columns = [column for column in table.columns if column.name in existing]
+
+    selects = []
+    for column in columns:
+        if isinstance(column.type, CompactUUID):
+            selects.append(f"uuid_blob({column.name})")
+        elif isinstance(column.type, CodedString):
+            selects.append(_code_case(column.name, column.type.values))
+        else:
+            selects.append(column.name)
+    names = ", ".join(column.name for column in columns)
+
+    conn.connection.driver_connection.create_function("uuid_blob", 1, _uuid_blob, deterministic=True)
+    conn.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1)
+    conn.execute(text(ddl))
+
+    last_rowid, copied = 0, 0
+    while True:
+        rowids = conn.execute(
+            text(f"SELECT rowid FROM {table.name} WHERE rowid > :last ORDER BY rowid LIMIT :limit"),
+            {"last": last_rowid, "limit": batch_size},
+        ).scalars().all()
+        if not rowids:
+            break
+        conn.execute(
+            text(
+                f"INSERT INTO {new_name} ({names}) SELECT {', '.join(selects)} FROM {table.name} "
+                f"WHERE rowid BETWEEN :first AND :last"
+            ),
+            {"first": rowids[0], "last": rowids[-1]},
+        )
+        last_rowid, copied = rowids[-1], copied + len(rowids)
+        logger.info("Compacting %s: %d rows copied", table.name, copied)
+
+    # Indexes and triggers go with the old table; indexes are recreated here, search triggers by ensure_search_index
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(bind=conn)
+
+
+def _alter_postgres_columns(conn: Connection, legacy: Dict[str, List[str]]) -> None:
+    """Convert in place with ALTER ... USING; foreign keys are dropped and restored around the type change"""
+    inspector = inspect(conn)
+    foreign_keys = [
+        (table_name, fk)
+        for table_name in inspector.get_table_names()
+        for fk in inspector.get_foreign_keys(table_name)
+        if any(column in legacy.get(fk["referred_table"], []) for column in fk["referred_columns"])
+    ]
+    for table_name, fk in foreign_keys:
+        conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{fk["name"]}"'))
+
+    for table_name, column_names in legacy.items():
+        table = Base.metadata.tables[table_name]
+        for name in column_names:
+            column_type = table.c[name].type
+            if isinstance(column_type, CompactUUID):
+                conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {name} TYPE uuid USING {name}::uuid"))
+            else:
+                conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {name} DROP DEFAULT"))
+                conn.execute(
+                    text(f"ALTER TABLE {table_name} ALTER COLUMN {name} TYPE smallint USING {_code_case(name, column_type.values)}")
+                )
+            logger.info("Converted %s.%s", table_name, name)
+
+    for table_name, fk in foreign_keys:
+        on_delete = f" ON DELETE {fk['options']['ondelete']}" if fk.get("options", {}).get("ondelete") else ""
+        conn.execute(text(
+            f'ALTER TABLE {table_name} ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+            f'REFERENCES {fk["referred_table"]} ({", ".join(fk["referred_columns"])}){on_delete}'
+        ))
+
+
+def compact_columns(engine: Engine, batch_size: int = COMPACT_BATCH_SIZE) -> None:
+    """Convert string session ids to 16-byte UUIDs and status/sender to small-int codes in existing tables.
+
+    Values outside the known status/sender sets make the conversion fail
+    (NOT NULL violation) rather than being silently rewritten.
+    """
+    legacy = _legacy_columns(engine)
+    if not legacy:
+        return
+    logger.info("Compacting columns: %s", legacy)
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            _alter_postgres_columns(conn, legacy)
+        return
+
+    for table in Base.metadata.sorted_tables:
+        if table.name in legacy:
+            # One transaction per table: a failed copy leaves the original untouched
+            with engine.begin() as conn:
+                _rebuild_sqlite_table(conn, table, batch_size)
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+
+def backfill_active_tickets(engine: Engine) -> int:
+    """Point sessions without an active ticket at their newest open/claimed ticket, else their newest ticket"""
+    sessions, tickets = SupportSession.__table__, SupportTicket.__table__
+    current = (
+        select(tickets.c.id)
+        .where(tickets.c.session_id == sessions.c.id)
+        .order_by(case((tickets.c.status == "closed", 1), else_=0), tickets.c.created_at.desc(), tickets.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(sessions)
+            .where(sessions.c.active_ticket_id.is_(None))
+            .where(select(tickets.c.id).where(tickets.c.session_id == sessions.c.id).exists())
+            .values(active_ticket_id=current)
+        )
+    logger.info("Backfilled active_ticket_id for %d sessions", result.rowcount)
+    return result.rowcount
+
+
+def run_migrations(engine: Engine) -> None:
+    added = add_missing_columns(engine)
+    compact_columns(engine)
+    add_missing_indexes(engine)
+    if "support_sessions.active_ticket_id" in added:
+        backfill_active_tickets(engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["compact"]:
+        compact_columns(default_engine)
+    elif sys.argv[1:] == ["backfill-active-tickets"]:
+        backfill_active_tickets(default_engine)
+    else:
+        print("Usage: python -m app.migrations compact|backfill-active-tickets")
@@ -1,23 +1,100 @@
 from __future__ import annotations
 
+import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 
-from sqlalchemy import BigInteger, Boolean, Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import JSON, BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, SmallInteger, String, Text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 from .database import Base
 
+# Stored as small integers by position: only ever append new values
+TICKET_STATUSES = ("open", "claimed", "closed")
+MESSAGE_SENDERS = ("visitor", "agent")
+CHANGE_ENTITIES = ("ticket", "message")
+CHANGE_OPS = ("insert", "update")
+
+
+class CompactUUID(TypeDecorator):
+    """UUID kept as a string in Python; native ``uuid`` on Postgres, 16-byte BLOB elsewhere.
+
+    Writing a malformed id raises ``ValueError``. Only comparisons in WHERE
+    clauses (``lookup=True``, picked automatically) bind it as NULL, so a bad
+    id from a URL simply matches no row.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def __init__(self, lookup: bool = False):
+        super().__init__()
+        self.lookup = lookup
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def coerce_compared_value(self, op, value):
+        return CompactUUID(lookup=True)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            parsed = value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        except ValueError:
+            if self.lookup:
+                return None
+            raise ValueError(f"{value!r} is not a valid UUID") from None
+        return parsed if dialect.name == "postgresql" else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+class CodedString(TypeDecorator):
+    """A closed set of strings stored as SMALLINT codes (the value's position in ``values``)"""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, values: Tuple[str, ...]):
+        super().__init__()
+        self.values = values
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self.values.index(value)
+        except ValueError:
+            raise ValueError(f"{value!r} is not one of {self.values}") from None
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return self.values[value]
+
 
 class SupportSession(Base):
     __tablename__ = "support_sessions"
 
-    id = Column(String, primary_key=True, index=True)
+    id = Column(CompactUUID, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     last_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     locale = Column(String, nullable=True)
     user_agent = Column(Text, nullable=True)
     referer = Column(Text, nullable=True)
+    # Current ticket (newest or reopened), maintained by app.active_ticket; no FK to avoid a tickets<->sessions cycle
+    active_ticket_id = Column(Integer, nullable=True)
 
     tickets = relationship("SupportTicket", back_populates="session", cascade="all, delete-orphan")
 
@@ -29,6 +106,8 @@ class SupportAgent(Base):
     name = Column(String, nullable=False)
     tg_chat_id = Column(BigInteger, unique=True, nullable=False, index=True)
     is_active = Column(Boolean, default=True, nullable=False)
+    # Auto-assignment cap; AUTO_ASSIGN_MAX_OPEN applies when unset
+    max_open_tickets = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     tickets = relationship("SupportTicket", back_populates="agent")
@@ -38,8 +117,8 @@ class SupportTicket(Base):
     __tablename__ = "tickets"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey("support_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
-    status = Column(String, default="open", nullable=False)
+    session_id = Column(CompactUUID, ForeignKey("support_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(CodedString(TICKET_STATUSES), default="open", nullable=False, index=True)
     category = Column(String, nullable=True)
     priority = Column(Integer, default=0, nullable=False)
     contact_name = Column(String, nullable=True)
@@ -48,6 +127,10 @@ class SupportTicket(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     claimed_at = Column(DateTime, nullable=True)
     closed_at = Column(DateTime, nullable=True)
+    # Telegram message_id of the ticket card posted to the support group; edited in place on status changes
+    group_message_id = Column(BigInteger, nullable=True)
+    # Telegram bot/support group the ticket is pinned to (see TelegramPool); NULL means the default bot
+    bot_name = Column(String, nullable=True)
 
     session = relationship("SupportSession", back_populates="tickets")
     agent = relationship("SupportAgent", back_populates="tickets")
@@ -59,14 +142,72 @@ class SupportMessage(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     ticket_id = Column(Integer, ForeignKey("tickets.id", ondelete="CASCADE"), nullable=False, index=True)
-    session_id = Column(String, ForeignKey("support_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
-    sender = Column(String, nullable=False)
+    # Indexed by ix_messages_session_id_id
+    session_id = Column(CompactUUID, ForeignKey("support_sessions.id", ondelete="CASCADE"), nullable=False)
+    sender = Column(CodedString(MESSAGE_SENDERS), nullable=False)
     body = Column(Text, nullable=True)
     tg_message_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Visitor upload kept in the content-addressed store of app.attachments
+    attachment_sha256 = Column(String(64), nullable=True)
+    attachment_name = Column(String, nullable=True)
+    attachment_type = Column(String, nullable=True)
+    attachment_size = Column(Integer, nullable=True)
 
     ticket = relationship("SupportTicket", back_populates="messages")
 
+    __table_args__ = (
+        # Latest-N window and before_id pages of a conversation
+        Index("ix_messages_session_id_id", session_id, id.desc()),
+    )
+
+
+class ChangeEvent(Base):
+    """Append-only log of ticket and message changes, written by app.changes in the mutating transaction"""
+
+    __tablename__ = "change_events"
+
+    # INTEGER on SQLite so it aliases the rowid; AUTOINCREMENT keeps ids from being reused after pruning
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    entity = Column(CodedString(CHANGE_ENTITIES), nullable=False)
+    op = Column(CodedString(CHANGE_OPS), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    ticket_id = Column(Integer, nullable=False)
+    session_id = Column(CompactUUID, nullable=True)
+    # New values of the published columns (all of them for inserts, the changed ones for updates)
+    data = Column(JSON, nullable=False)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class TicketStatsHourly(Base):
+    """Hourly rollup of ticket lifecycle events, maintained incrementally by app.analytics"""
+
+    __tablename__ = "ticket_stats_hourly"
+
+    bucket = Column(DateTime, primary_key=True)
+    category = Column(String, primary_key=True)
+    priority = Column(Integer, primary_key=True)
+    created_count = Column(Integer, default=0, nullable=False)
+    claimed_count = Column(Integer, default=0, nullable=False)
+    closed_count = Column(Integer, default=0, nullable=False)
+    reopened_count = Column(Integer, default=0, nullable=False)
+    claim_seconds_total = Column(Float, default=0.0, nullable=False)
+    close_seconds_total = Column(Float, default=0.0, nullable=False)
+
+
+class AgentLoad(Base):
+    """Running per-agent counters, maintained incrementally by app.analytics"""
+
+    __tablename__ = "agent_load"
+
+    agent_id = Column(Integer, ForeignKey("agents.id", ondelete="CASCADE"), primary_key=True)
+    open_tickets = Column(Integer, default=0, nullable=False)
+    claimed_total = Column(Integer, default=0, nullable=False)
+    closed_total = Column(Integer, default=0, nullable=False)
+    last_claimed_at = Column(DateTime, nullable=True)
+
 
 PRIORITY_MAP = {
     "low": 0,
@@ -0,0 +1,149 @@
+"""Coalescing of visitor message notifications sent to Telegram"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import update
+
+from .database import session_scope
+from .models import SupportTicket
+from .telegram import TelegramPool, telegram_pool
+from .tracing import SpanContext, current_context, start_span
+
+logger = logging.getLogger(__name__)
+
+# Visitor messages for the same ticket arriving within this window are sent as one notification (0 disables)
+NOTIFY_DEBOUNCE_SECONDS = float(os.getenv("NOTIFY_DEBOUNCE_SECONDS", "1.5"))
+
+KIND_NEW_TICKET = "new_ticket"
+KIND_CUSTOMER_MESSAGE = "customer_message"
+
+
+@dataclass
+class _PendingNotification:
+    kind: str
+    chat_id: Optional[str]
+    category: Optional[str]
+    card_message_id: Optional[int] = None
+    # Bot the ticket is pinned to
+    bot_name: Optional[str] = None
+    bodies: List[str] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+    # Trace of the request that opened the window, and of those that joined it
+    trace_context: Optional[SpanContext] = None
+    trace_links: List[Optional[SpanContext]] = field(default_factory=list)
+
+
+class NotificationCoalescer:
+    """Buffers visitor messages per ticket and flushes them as a single Telegram message.
+
+    The window opens with the first buffered message and is never extended, so
+    a notification is delayed by at most ``window`` seconds. A message for the
+    same ticket but a different destination (e.g. the ticket was claimed in
+    between) flushes the current buffer first so ordering is preserved.
+    """
+
+    def __init__(self, pool: TelegramPool, window: float):
+        self.pool = pool
+        self.window = window
+        self._pending: Dict[int, _PendingNotification] = {}
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def add(
+        self,
+        ticket_id: int,
+        kind: str,
+        body: str,
+        chat_id: Optional[str] = None,
+        category: Optional[str] = None,
+        card_message_id: Optional[int] = None,
+        bot_name: Optional[str] = None,
+    ) -> None:
+        if self.window <= 0:
+            await self._send(
+                ticket_id,
+                _PendingNotification(kind, chat_id, category, card_message_id, bot_name, [body], trace_context=current_context()),
+            )
+            return
+
+        pending = self._pending.get(ticket_id)
+        if pending is not None and (pending.kind, pending.chat_id) != (kind, chat_id):
+            await self.flush(ticket_id)
+            pending = None
+
+        if pending is None:
+            pending = _PendingNotification(kind, chat_id, category, card_message_id, bot_name, trace_context=current_context())
+            pending.timer = asyncio.get_running_loop().call_later(self.window, self._on_window_closed, ticket_id)
+            self._pending[ticket_id] = pending
+        else:
+            pending.trace_links.append(current_context())
+        pending.bodies.append(body)
+
+    def size(self) -> int:
+        return len(self._pending)
+
+    def _on_window_closed(self, ticket_id: int) -> None:
+        task = asyncio.get_running_loop().create_task(self.flush(ticket_id))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def flush(self, ticket_id: int) -> None:
+        pending = self._pending.pop(ticket_id, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        await self._send(ticket_id, pending)
+
+    async def flush_all(self) -> None:
+        """Send everything still buffered; used on shutdown so no visitor message is dropped"""
+        for ticket_id in list(self._pending):
+            await self.flush(ticket_id)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _send(self, ticket_id: int, pending: _PendingNotification) -> None:
+        body = "\n\n".join(pending.bodies)
+        attributes = {"ticket.id": ticket_id, "notification.kind": pending.kind, "notification.messages": len(pending.bodies)}
+        with start_span("notifications.flush", attributes=attributes, parent=pending.trace_context, links=pending.trace_links):
+            await self._deliver(ticket_id, pending, body)
+
+    async def _deliver(self, ticket_id: int, pending: _PendingNotification, body: str) -> None:
+        service = self.pool.get(pending.bot_name)
+        try:
+            if pending.kind == KIND_NEW_TICKET and pending.card_message_id is not None:
+                # The ticket already has a card in the group: refresh it rather than posting another one
+                await service.update_ticket_card(
+                    pending.card_message_id, ticket_id, pending.category, "open", message_body=body
+                )
+            elif pending.kind == KIND_NEW_TICKET:
+                card_message_id = await service.notify_new_ticket(
+                    ticket_id=ticket_id,
+                    category=pending.category or "General",
+                    message_body=body,
+                )
+                if card_message_id is not None:
+                    remember_ticket_card(ticket_id, card_message_id)
+            else:
+                await service.notify_customer_message(pending.chat_id, ticket_id, body)
+        except Exception:
+            logger.exception("Failed to send %s notification for ticket %s", pending.kind, ticket_id)
+
+
+def remember_ticket_card(ticket_id: int, message_id: int) -> None:
+    """Store the group card's message_id on the ticket so later status changes can edit it"""
+    with session_scope() as db:
+        db.execute(
+            update(SupportTicket)
+            .where(SupportTicket.id == ticket_id)
+            .values(group_message_id=message_id)
+        )
+
+
+# Singleton instance
+notification_coalescer = NotificationCoalescer(telegram_pool, NOTIFY_DEBOUNCE_SECONDS)
@@ -0,0 +1,134 @@
+"""Server-driven poll intervals for the visitor widget.
+
+Every conversation poll is answered with ``nextPollMs`` (and the
+``X-Next-Poll-Ms`` header): how long the widget should wait before polling
+again. The hint follows the ticket's state: fast right after an agent reply,
+slower for claimed and unclaimed tickets, doubling every
+``POLL_BACKOFF_SECONDS`` without messages, and slow for closed tickets or
+sessions without a ticket. It is stretched up to ``1 + POLL_LOAD_FACTOR``
+times as event-loop lag or DB pool use climb from ``POLL_LOAD_THRESHOLD`` of
+the shedding thresholds to the thresholds themselves, and
+never goes below the ops floor (``POLL_FLOOR_MS``, adjustable at runtime via
+``PUT /api/polling``).
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from .admission import LoadMonitor, load_monitor
+from .models import SupportMessage, SupportTicket
+
+POLL_MIN_MS = int(os.getenv("POLL_MIN_MS", "1000"))
+# Cap for open and claimed tickets, however long they have been idle
+POLL_MAX_MS = int(os.getenv("POLL_MAX_MS", "30000"))
+POLL_AGENT_ACTIVE_MS = int(os.getenv("POLL_AGENT_ACTIVE_MS", "1000"))
+# An agent reply younger than this keeps the widget on POLL_AGENT_ACTIVE_MS
+POLL_AGENT_ACTIVE_SECONDS = float(os.getenv("POLL_AGENT_ACTIVE_SECONDS", "60"))
+POLL_CLAIMED_MS = int(os.getenv("POLL_CLAIMED_MS", "2500"))
+POLL_OPEN_MS = int(os.getenv("POLL_OPEN_MS", "4000"))
+# Closed tickets and sessions that have not opened a ticket yet
+POLL_IDLE_MS = int(os.getenv("POLL_IDLE_MS", "60000"))
+# Idle tickets poll half as often for every this many seconds without a message
+POLL_BACKOFF_SECONDS = float(os.getenv("POLL_BACKOFF_SECONDS", "120"))
+# Hints are multiplied by up to 1 + this factor as the server approaches its shedding thresholds
+POLL_LOAD_FACTOR = float(os.getenv("POLL_LOAD_FACTOR", "3"))
+# Load pressure (0..1, 1 = shedding) below which hints are not stretched
+POLL_LOAD_THRESHOLD = float(os.getenv("POLL_LOAD_THRESHOLD", "0.5"))
+# Global minimum interval; raise during incidents to take load off the API
+POLL_FLOOR_MS = int(os.getenv("POLL_FLOOR_MS", "0"))
+POLL_RATE_WINDOW_SECONDS = 60
+
+_MAX_DOUBLINGS = 16
+
+
+@dataclass
+class PollHint:
+    next_poll_ms: int
+    # no_ticket, closed, agent_active, claimed or open
+    reason: str
+
+
+class PollAdvisor:
+    """Computes poll hints and keeps a sliding-window count of the polls it answered"""
+
+    def __init__(self, floor_ms: int, monitor: LoadMonitor = load_monitor):
+        self.floor_ms = floor_ms
+        self.monitor = monitor
+        # One [second, polls, summed hint ms] bucket per second of the rate window
+        self._buckets: Deque[List[float]] = deque()
+        self._reasons: Counter = Counter()
+
+    def hint(
+        self, ticket: Optional[SupportTicket], messages: Iterable[SupportMessage], now: Optional[datetime] = None
+    ) -> PollHint:
+        now = now or datetime.utcnow()
+        if ticket is None:
+            interval, reason = float(POLL_IDLE_MS), "no_ticket"
+        elif ticket.status == "closed":
+            interval, reason = float(POLL_IDLE_MS), "closed"
+        else:
+            ticket_messages = [message for message in messages if message.ticket_id == ticket.id]
+            last_agent = max((m.created_at for m in ticket_messages if m.sender == "agent"), default=None)
+            if last_agent is not None and (now - last_agent).total_seconds() < POLL_AGENT_ACTIVE_SECONDS:
+                interval, reason = float(POLL_AGENT_ACTIVE_MS), "agent_active"
+            else:
+                reason = "claimed" if ticket.status == "claimed" else "open"
+                last_activity = max(
+                    [m.created_at for m in ticket_messages] + [t for t in (ticket.created_at, ticket.claimed_at) if t]
+                )
+                idle = max((now - last_activity).total_seconds(), 0.0)
+                doublings = min(idle / POLL_BACKOFF_SECONDS, _MAX_DOUBLINGS) if POLL_BACKOFF_SECONDS > 0 else 0.0
+                base = POLL_CLAIMED_MS if reason == "claimed" else POLL_OPEN_MS
+                interval = min(base * 2 ** doublings, POLL_MAX_MS)
+
+        interval *= 1 + POLL_LOAD_FACTOR * self.load_stretch()
+        next_poll_ms = int(max(interval, POLL_MIN_MS, self.floor_ms))
+        self._record(next_poll_ms, reason)
+        return PollHint(next_poll_ms, reason)
+
+    def load_stretch(self) -> float:
+        """0 below POLL_LOAD_THRESHOLD, rising to 1 at the shedding thresholds"""
+        excess = self.monitor.pressure() - POLL_LOAD_THRESHOLD
+        return min(max(excess / max(1 - POLL_LOAD_THRESHOLD, 0.01), 0.0), 1.0)
+
+    def _record(self, next_poll_ms: int, reason: str) -> None:
+        second = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += 1
+            self._buckets[-1][2] += next_poll_ms
+        else:
+            self._buckets.append([second, 1, next_poll_ms])
+        self._expire(second)
+        self._reasons[reason] += 1
+
+    def _expire(self, second: int) -> None:
+        while self._buckets and self._buckets[0][0] <= second - POLL_RATE_WINDOW_SECONDS:
+            self._buckets.popleft()
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._expire(int(time.monotonic()))
+        polls = sum(bucket[1] for bucket in self._buckets)
+        hinted = sum(bucket[2] for bucket in self._buckets)
+        return {
+            "floorMs": self.floor_ms,
+            "loadPressure": round(self.monitor.pressure(), 3),
+            "loadStretch": round(1 + POLL_LOAD_FACTOR * self.load_stretch(), 3),
+            "windowSeconds": POLL_RATE_WINDOW_SECONDS,
+            # Effective poll rate across all widgets served by this process
+            "pollsPerSecond": round(polls / POLL_RATE_WINDOW_SECONDS, 3),
+            "meanNextPollMs": round(hinted / polls) if polls else None,
+            "reasons": dict(self._reasons),
+        }
+
+
+# Singleton instance
+poll_advisor = PollAdvisor(POLL_FLOOR_MS)
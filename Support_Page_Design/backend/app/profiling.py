@@ -0,0 +1,264 @@
+"""On-demand CPU and memory profiling of a live worker, behind the admin endpoints under ``/api/debug``.
+
+Nothing here runs until an operator asks. A CPU profile samples every
+thread's Python stack with ``sys._current_frames()`` from one threadpool
+thread for the requested seconds and returns them as collapsed stacks (one
+``frame;frame;frame count`` line per distinct stack). flamegraph.pl,
+speedscope and inferno read that format directly. Memory profiling starts
+``tracemalloc`` on request and stops it again after
+``PROFILE_TRACEMALLOC_MAX_SECONDS`` at the latest. Each snapshot is diffed
+against the previous one. Object counts walk the garbage collector's objects
+once per call.
+
+Every endpoint reports the worker's pid: with several workers (app.serve) each
+request profiles whichever worker accepted it.
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .assignment import agent_pool
+from .changes import change_notifier
+from .database import Base, compiled_cache_size, engine, replica_router
+from .escalation import escalation_scheduler
+from .group_commit import message_writer
+from .notifications import notification_coalescer
+from .polling import poll_advisor
+from .recording import traffic_recorder
+from .tracing import span_exporter
+
+# Longest CPU profile one request may ask for
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# tracemalloc slows every allocation; it is switched off again after this long even if nobody calls stop
+PROFILE_TRACEMALLOC_MAX_SECONDS = float(os.getenv("PROFILE_TRACEMALLOC_MAX_SECONDS", "900"))
+PROFILE_MIN_INTERVAL_MS = 1
+
+_APP_ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+
+
+class ProfilerBusy(Exception):
+    """Another CPU profile is already running in this worker"""
+
+
+class NotTracing(Exception):
+    """A memory snapshot was requested while tracemalloc is off"""
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_APP_ROOT):
+        return filename[len(_APP_ROOT):]
+    marker = "site-packages" + os.sep
+    index = filename.rfind(marker)
+    if index >= 0:
+        return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+class SamplingProfiler:
+    """Statistical profiler: periodically records the stack of every other thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Frame labels by code object, so each distinct function is formatted once per run
+        self._labels: Dict[Any, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def run(self, seconds: float, interval: float, thread_filter: Optional[str] = None) -> Tuple[Counter, int]:
+        """Sample for ``seconds`` (blocking); returns the stack counts and the number of sampling rounds"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            return self._sample(seconds, interval, thread_filter)
+        finally:
+            self._labels.clear()
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, thread_filter: Optional[str]) -> Tuple[Counter, int]:
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        stacks: Counter = Counter()
+        rounds = 0
+        deadline = time.perf_counter() + seconds
+        while True:
+            started = time.perf_counter()
+            if started >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    name = names.setdefault(ident, f"thread-{ident}")
+                if thread_filter and thread_filter not in name:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(name)
+                stacks[";".join(reversed(stack))] += 1
+            rounds += 1
+            time.sleep(max(interval - (time.perf_counter() - started), 0))
+        return stacks, rounds
+
+
+def collapsed(stacks: Counter) -> str:
+    """Brendan Gregg's folded format, heaviest stacks first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class MemoryProfiler:
+    """Starts and stops tracemalloc and diffs each snapshot against the one before"""
+
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._started_at: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: int) -> Dict[str, Any]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._previous = None
+                self._started_at = time.time()
+                self._timer = threading.Timer(self.max_seconds, self.stop)
+                self._timer.daemon = True
+                self._timer.start()
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            tracemalloc.stop()
+            self._previous = None
+            self._started_at = None
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "pid": os.getpid(),
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else None,
+            "startedAt": self._started_at,
+            "stopsAt": self._started_at + self.max_seconds if self._started_at else None,
+            "tracedBytes": current,
+            "peakBytes": peak,
+            "overheadBytes": tracemalloc.get_tracemalloc_memory() if tracing else 0,
+        }
+
+    def snapshot(self, group_by: str, limit: int) -> Dict[str, Any]:
+        """Top allocation sites now, with their growth since the previous snapshot when there is one"""
+        if not tracemalloc.is_tracing():
+            raise NotTracing()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+        with self._lock:
+            previous, self._previous = self._previous, snapshot
+
+        if previous is None:
+            top = [self._entry(stat, group_by) for stat in snapshot.statistics(group_by)[:limit]]
+        else:
+            top = [
+                {**self._entry(stat, group_by), "sizeDiffBytes": stat.size_diff, "countDiff": stat.count_diff}
+                for stat in snapshot.compare_to(previous, group_by)[:limit]
+            ]
+        return {**self.status(), "groupBy": group_by, "comparedToPrevious": previous is not None, "top": top}
+
+    @staticmethod
+    def _entry(stat, group_by: str) -> Dict[str, Any]:
+        frames = [f"{_short_path(frame.filename)}:{frame.lineno}" for frame in stat.traceback]
+        entry: Dict[str, Any] = {"location": frames[0] if frames else "?", "sizeBytes": stat.size, "count": stat.count}
+        if group_by == "filename":
+            entry["location"] = entry["location"].rsplit(":", 1)[0]
+        elif group_by == "traceback":
+            entry["traceback"] = frames
+        return entry
+
+
+def cache_sizes() -> Dict[str, Any]:
+    """Entries held by the process-wide queues and caches"""
+    return {
+        "replicaPins": replica_router.size(),
+        "escalationDeadlines": escalation_scheduler.pending(),
+        "agentPoolSlots": agent_pool.size(),
+        "notificationBuffers": notification_coalescer.size(),
+        "groupCommitQueue": message_writer.snapshot()["pending"],
+        "spanExportBuffer": span_exporter.size(),
+        "trafficRecordBuffer": traffic_recorder.size(),
+        "pollRateBuckets": poll_advisor.size(),
+        "changeFeedWaiters": change_notifier.size(),
+        "sqlCompiledCache": compiled_cache_size(),
+        "dbPool": engine.pool.status(),
+    }
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def object_counts(top: int) -> Dict[str, Any]:
+    """Live ORM instances and sessions, the most common types overall, caches and process memory"""
+    counts: Counter = Counter(type(obj) for obj in gc.get_objects())
+    mapped = sorted((mapper.class_ for mapper in Base.registry.mappers), key=lambda cls: cls.__name__)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "pid": os.getpid(),
+        "rssBytes": _rss_bytes(),
+        "maxRssBytes": max_rss,
+        "threads": threading.active_count(),
+        "gc": {
+            "counts": gc.get_count(),
+            "tracked": sum(counts.values()),
+            # Objects moved to the permanent generation by app.serve before forking
+            "frozen": gc.get_freeze_count(),
+            "garbage": len(gc.garbage),
+        },
+        "orm": {cls.__name__: counts[cls] for cls in mapped},
+        "sessions": sum(count for cls, count in counts.items() if issubclass(cls, Session)),
+        "caches": cache_sizes(),
+        "topTypes": [
+            {"type": f"{cls.__module__}.{cls.__qualname__}", "count": count} for cls, count in counts.most_common(top)
+        ],
+    }
+
+
+# Singleton instances
+cpu_profiler = SamplingProfiler()
+memory_profiler = MemoryProfiler(PROFILE_TRACEMALLOC_MAX_SECONDS)
@@ -0,0 +1,278 @@
+"""Opt-in traffic recorder feeding the replay harness (``python -m benchmarks.replay``).
+
+With ``TRAFFIC_RECORD_FILE`` set, each request to ``/api/session*`` and
+``/api/telegram/webhook*`` is logged as one compact JSON line: arrival time,
+route template, status, server-side latency and the request's shape. Shapes
+keep what drives load (message lengths, categories, poll window sizes,
+callback actions, ticket ids) and nothing that identifies a person: session
+ids, client IPs and Telegram user ids become salted pseudonyms, and message
+text is reduced to its length. Lines are buffered and appended by a
+background thread; a path ending in ``.gz`` is written gzip-compressed.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .admission import _SESSION_PATH_RE, AdmissionControlMiddleware
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_RECORD_FILE = os.getenv("TRAFFIC_RECORD_FILE", "")
+# Give every worker appending to one log the same salt so their pseudonyms agree; random per process otherwise
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT", "")
+# Fraction of visitor sessions recorded; a session is kept or dropped whole
+TRAFFIC_RECORD_SAMPLE = float(os.getenv("TRAFFIC_RECORD_SAMPLE", "1"))
+TRAFFIC_RECORD_INTERVAL_SECONDS = 1.0
+TRAFFIC_RECORD_MAX_QUEUE = 50_000
+
+RECORDED_PREFIXES = ("/api/session", "/api/telegram/webhook")
+_MAX_REQUEST_CAPTURE = 64 * 1024
+_MAX_RESPONSE_CAPTURE = 4 * 1024
+# Responses that name the session or ticket a request created
+_RESPONSE_IDS = {
+    ("POST", "/api/session"): "session_id",
+    ("POST", "/api/session/{session_id}/messages"): "ticket_id",
+    ("POST", "/api/session/{session_id}/new-ticket"): "ticket_id",
+}
+
+
+def _ticket_number(value: str) -> Optional[int]:
+    return int(value) if value.isdigit() else None
+
+
+def message_shape(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """A visitor message without its text or contact details"""
+    shape: Dict[str, Any] = {"len": len(payload.get("body") or "")}
+    for key in ("category", "priority"):
+        if payload.get(key) is not None:
+            shape[key] = payload[key]
+    if payload.get("contact_name") or payload.get("contact_email"):
+        shape["contact"] = 1
+    return shape
+
+
+def update_shape(update: Dict[str, Any], pseudonym) -> Dict[str, Any]:
+    """A Telegram update reduced to its kind, action, ticket and agent pseudonym"""
+    callback = update.get("callback_query")
+    if callback:
+        action, _, ticket = (callback.get("data") or "").partition("#")
+        return {
+            "kind": "callback",
+            "action": action,
+            "ticket": _ticket_number(ticket),
+            "agent": pseudonym(str((callback.get("from") or {}).get("id"))),
+        }
+    message = update.get("message")
+    if message:
+        text = message.get("text") or ""
+        shape: Dict[str, Any] = {
+            "kind": "message",
+            "agent": pseudonym(str((message.get("from") or {}).get("id"))),
+            "len": len(text),
+        }
+        if text.startswith("/"):
+            words = text.split()
+            command, _, argument = words[0].partition("_")
+            if not argument and len(words) > 1:
+                argument = words[1]
+            shape["command"] = command
+            shape["ticket"] = _ticket_number(argument)
+        if message.get("reply_to_message"):
+            shape["reply"] = 1
+        return shape
+    return {"kind": "other"}
+
+
+class TrafficRecorder:
+    """Turns finished requests into log lines and appends them from a background thread"""
+
+    def __init__(self, path: str, salt: str, sample: float, interval: float, max_queue: int):
+        self.path = path
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.sample = sample
+        self.interval = interval
+        self.max_queue = max_queue
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def pseudonym(self, value: str) -> str:
+        return hashlib.blake2b(value.encode(), key=self.salt, digest_size=6).hexdigest()
+
+    def _sampled(self, session: str) -> bool:
+        return self.sample >= 1 or int(session[:8], 16) / 0xFFFFFFFF < self.sample
+
+    def record(
+        self,
+        scope: Scope,
+        arrived: float,
+        latency_ms: float,
+        status: int,
+        request_body: bytes,
+        response_body: bytes,
+        content_length: Optional[int],
+    ) -> None:
+        route = scope.get("route")
+        params = dict(scope.get("path_params") or {})
+        if route is not None and hasattr(route, "path"):
+            template = route.path
+        else:
+            # Rejected before routing, or no such route: still keep the session id out of the log
+            template = scope["path"]
+            match = _SESSION_PATH_RE.match(template)
+            if match:
+                params["session_id"] = match.group(1)
+                template = template.replace(match.group(1), "{session_id}", 1)
+        method = scope["method"]
+        event: Dict[str, Any] = {
+            "t": round(arrived, 3),
+            "c": self.pseudonym(AdmissionControlMiddleware._client_ip(scope)),
+            "m": method,
+            "p": template,
+            "st": status,
+            "ms": round(latency_ms, 2),
+        }
+        session_id = params.pop("session_id", None)
+        if params:
+            event["pp"] = params
+
+        shape: Optional[Dict[str, Any]] = None
+        try:
+            if template.startswith("/api/telegram/webhook"):
+                shape = update_shape(json.loads(request_body or b"{}"), self.pseudonym)
+            elif template.endswith("/attachments") and method == "POST":
+                shape = {"size": content_length}
+            elif template.endswith("/messages") and method == "POST":
+                shape = message_shape(json.loads(request_body or b"{}"))
+            elif method == "GET" and scope.get("query_string"):
+                query = parse_qs(scope["query_string"].decode("latin-1"))
+                shape = {"limit": int(query["limit"][0])} if "limit" in query else {}
+                if "before_id" in query:
+                    shape["before"] = 1
+        except (ValueError, TypeError, AttributeError, KeyError):
+            shape = {"malformed": 1}
+        if shape:
+            event["b"] = shape
+
+        created = _RESPONSE_IDS.get((method, template))
+        if created and status < 400:
+            try:
+                value = json.loads(response_body).get(created)
+            except (ValueError, AttributeError):
+                value = None
+            if created == "session_id" and value:
+                session_id = value
+            elif value is not None:
+                event["tk"] = value
+
+        if session_id is not None:
+            event["s"] = self.pseudonym(session_id)
+            if not self._sampled(event["s"]):
+                return
+        self._enqueue(json.dumps(event, separators=(",", ":")))
+
+    def _enqueue(self, line: str) -> None:
+        with self._lock:
+            if len(self._buffer) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._buffer.append(line)
+            self.recorded += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        opener = gzip.open if self.path.endswith(".gz") else open
+        try:
+            with opener(self.path, "at", encoding="utf-8") as handle:
+                handle.write("\n".join(lines) + "\n")
+        except OSError:
+            logger.exception("Failed to write %d recorded requests to %s", len(lines), self.path)
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.recorder = traffic_recorder
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.recorder.enabled or not scope["path"].startswith(RECORDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        started = time.perf_counter()
+        content_length = AdmissionControlMiddleware._content_length(scope)
+        # Uploads are only recorded by size
+        capture_request = not scope["path"].endswith("/attachments")
+        request_body = bytearray()
+        response_body = bytearray()
+        status = 500
+
+        async def recording_receive() -> Message:
+            message = await receive()
+            if capture_request and message["type"] == "http.request" and len(request_body) < _MAX_REQUEST_CAPTURE:
+                request_body.extend(message.get("body", b"")[:_MAX_REQUEST_CAPTURE - len(request_body)])
+            return message
+
+        async def recording_send(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and scope["method"] == "POST" and len(response_body) < _MAX_RESPONSE_CAPTURE:
+                response_body.extend(message.get("body", b"")[:_MAX_RESPONSE_CAPTURE - len(response_body)])
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            try:
+                self.recorder.record(
+                    scope, arrived, latency_ms, status, bytes(request_body), bytes(response_body), content_length
+                )
+            except Exception:
+                logger.exception("Failed to record %s %s", scope["method"], scope["path"])
+
+
+# Singleton instance
+traffic_recorder = TrafficRecorder(
+    TRAFFIC_RECORD_FILE,
+    TRAFFIC_RECORD_SALT,
+    TRAFFIC_RECORD_SAMPLE,
+    TRAFFIC_RECORD_INTERVAL_SECONDS,
+    TRAFFIC_RECORD_MAX_QUEUE,
+)
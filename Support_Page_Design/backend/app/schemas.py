@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -24,6 +24,13 @@ class MessageCreateRequest(BaseModel):
     contact_email: Optional[str] = None
 
 
+class AttachmentSchema(BaseModel):
+    name: str
+    contentType: str
+    size: int
+    url: str
+
+
 class SupportMessageSchema(BaseModel):
     id: int
     ticketId: int
@@ -31,6 +38,7 @@ class SupportMessageSchema(BaseModel):
     sender: str
     body: Optional[str]
     createdAt: datetime
+    attachment: Optional[AttachmentSchema] = None
 
     model_config = {"from_attributes": True}
 
@@ -54,6 +62,10 @@ class SupportTicketSchema(BaseModel):
 class ConversationResponse(BaseModel):
     ticket: Optional[SupportTicketSchema] = None
     messages: List[SupportMessageSchema] = []
+    # Older messages exist before the first one returned
+    hasMore: bool = False
+    # How long the widget should wait before polling again
+    nextPollMs: Optional[int] = None
 
 
 class MessageResponse(BaseModel):
@@ -61,3 +73,100 @@ class MessageResponse(BaseModel):
     ticket_id: int
     message_id: int
 
+
+
+class SearchHitSchema(BaseModel):
+    id: int
+    ticketId: int
+    sessionId: str
+    sender: str
+    snippet: str
+    createdAt: datetime
+    rank: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchHitSchema] = []
+    limit: int
+    offset: int
+    hasMore: bool = False
+
+
+class ChangeEventSchema(BaseModel):
+    id: int
+    at: datetime
+    # ticket or message
+    entity: str
+    # insert or update
+    op: str
+    entityId: int
+    ticketId: int
+    sessionId: Optional[str] = None
+    data: Dict[str, Any]
+
+
+class ChangesResponse(BaseModel):
+    events: List[ChangeEventSchema] = []
+    # Pass back as ?cursor= to continue after the last event returned
+    cursor: str
+    # More events are ready now; fetch again without waiting
+    hasMore: bool = False
+
+
+class StatsCountersSchema(BaseModel):
+    created: int
+    claimed: int
+    closed: int
+    reopened: int
+    avgTimeToClaimSeconds: Optional[float]
+    avgTimeToCloseSeconds: Optional[float]
+
+
+class CategoryStatsSchema(StatsCountersSchema):
+    category: str
+    priority: int
+
+
+class AgentLoadSchema(BaseModel):
+    agentId: int
+    name: str
+    openTickets: int
+    claimedTotal: int
+    closedTotal: int
+    lastClaimedAt: Optional[datetime]
+
+
+class StatsResponse(BaseModel):
+    windowHours: int
+    since: datetime
+    totals: StatsCountersSchema
+    byCategory: List[CategoryStatsSchema] = []
+    agents: List[AgentLoadSchema] = []
+
+
+class BulkCloseRequest(BaseModel):
+    status: Optional[str] = None
+    category: Optional[str] = None
+    agentId: Optional[int] = None
+    createdBefore: Optional[datetime] = None
+    idleHours: Optional[float] = Field(default=None, gt=0)
+    ticketIds: Optional[List[int]] = None
+    reason: str = "bulk close"
+
+
+class BulkReassignRequest(BaseModel):
+    fromAgentId: int
+    # None sends the tickets back to the queue
+    toAgentId: Optional[int] = None
+    reason: str = "reassigned by ops"
+
+
+class PollSettingsRequest(BaseModel):
+    floorMs: int = Field(ge=0, le=600_000)
+
+
+class BulkResultResponse(BaseModel):
+    action: str
+    count: int
+    ticketIds: List[int] = []
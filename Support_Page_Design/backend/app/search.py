@@ -0,0 +1,191 @@
+"""Full-text search over message history (SQLite FTS5 / Postgres tsvector)"""
+
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .models import SupportMessage
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_START = "«"
+SNIPPET_STOP = "»"
+MAX_PAGE_SIZE = 50
+
+# Set by ensure_search_index(); "fts5", "tsvector" or "like" when no index is available
+_backend = "like"
+
+_SQLITE_SETUP = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(body, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')
+    """,
+    # Triggers keep the external-content index in sync with every insert/update/delete on messages
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF body ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO messages_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+]
+
+_POSTGRES_SETUP = [
+    # A stored generated column is maintained by Postgres on every insert/update
+    """
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS body_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(body, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_messages_body_tsv ON messages USING GIN (body_tsv)",
+]
+
+
+@dataclass
+class SearchHit:
+    id: int
+    ticket_id: int
+    session_id: str
+    sender: str
+    snippet: str
+    created_at: datetime
+    rank: float
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """Create the search index and its sync machinery if missing, backfilling existing rows once"""
+    global _backend
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for statement in _POSTGRES_SETUP:
+                conn.execute(text(statement))
+        _backend = "tsvector"
+        return
+
+    if engine.dialect.name != "sqlite":
+        logger.warning("Full-text search not supported on %s; falling back to LIKE", engine.dialect.name)
+        return
+
+    try:
+        with engine.begin() as conn:
+            created = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            ).first() is None
+            for statement in _SQLITE_SETUP:
+                conn.execute(text(statement))
+            if created:
+                conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    except Exception as e:
+        logger.warning("SQLite FTS5 unavailable (%s); falling back to LIKE", e)
+        return
+    _backend = "fts5"
+
+
+def _fts5_query(terms: str) -> str:
+    # Quote every token so user input can't produce FTS5 syntax errors; tokens are ANDed
+    tokens = re.findall(r"\w+", terms)
+    return " ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+
+def search_messages(db: Session, terms: str, limit: int = 20, offset: int = 0) -> Tuple[List[SearchHit], bool]:
+    """Return one page of ranked hits and whether more results exist"""
+    terms = terms.strip()
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    if not terms:
+        return [], False
+
+    # Fetch one extra row to know whether there is another page without a COUNT(*)
+    params = {"limit": limit + 1, "offset": offset}
+
+    if _backend == "fts5":
+        params["query"] = _fts5_query(terms)
+        if not params["query"]:
+            return [], False
+        statement = text(
+            """
+            SELECT m.id, m.ticket_id, m.session_id, m.sender,
+                   snippet(messages_fts, 0, :start, :stop, '…', 16) AS snippet,
+                   m.created_at, bm25(messages_fts) AS rank
+            FROM messages_fts
+            JOIN messages AS m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH :query
+            ORDER BY rank, m.id DESC
+            LIMIT :limit OFFSET :offset
+            """
+        )
+        params.update(start=SNIPPET_START, stop=SNIPPET_STOP)
+    elif _backend == "tsvector":
+        statement = text(
+            """
+            SELECT hits.id, hits.ticket_id, hits.session_id, hits.sender,
+                   ts_headline('simple', coalesce(hits.body, ''), hits.query, :headline) AS snippet,
+                   hits.created_at, hits.rank
+            FROM (
+                SELECT m.id, m.ticket_id, m.session_id, m.sender, m.body, m.created_at, q.query,
+                       -ts_rank_cd(m.body_tsv, q.query) AS rank
+                FROM messages AS m, websearch_to_tsquery('simple', :query) AS q(query)
+                WHERE m.body_tsv @@ q.query
+                ORDER BY rank, m.id DESC
+                LIMIT :limit OFFSET :offset
+            ) AS hits
+            ORDER BY hits.rank, hits.id DESC
+            """
+        )
+        params.update(
+            query=terms,
+            headline=f"StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxWords=24, MinWords=8",
+        )
+    else:
+        statement = text(
+            """
+            SELECT m.id, m.ticket_id, m.session_id, m.sender, m.body AS snippet, m.created_at, 0.0 AS rank
+            FROM messages AS m
+            WHERE m.body LIKE :pattern
+            ORDER BY m.id DESC
+            LIMIT :limit OFFSET :offset
+            """
+        )
+        params["pattern"] = f"%{terms}%"
+
+    # Decode the compact session_id/sender encodings like the ORM would
+    columns = SupportMessage.__table__.c
+    statement = statement.columns(session_id=columns.session_id.type, sender=columns.sender.type)
+    rows = db.execute(statement, params).all()
+    hits = [
+        SearchHit(
+            id=row.id,
+            ticket_id=row.ticket_id,
+            session_id=row.session_id,
+            sender=row.sender,
+            snippet=row.snippet or "",
+            created_at=_as_datetime(row.created_at),
+            rank=float(row.rank),
+        )
+        for row in rows[:limit]
+    ]
+    return hits, len(rows) > limit
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    # Raw SQL on SQLite returns DateTime columns as strings
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
@@ -0,0 +1,242 @@
+"""Production entry point: ``python -m app.serve``.
+
+The supervisor imports the app once, binds the listening socket and forks
+``WEB_CONCURRENCY`` workers (default 1; 0 means one per CPU available to the
+process, respecting cgroup quotas), so the workers share the preloaded code and
+startup work copy-on-write. Each worker runs uvicorn on the shared socket with
+uvloop and httptools when they are installed. Workers that die are restarted.
+
+Some state lives in each worker's memory: the poll floor set through
+``PUT /api/polling``, the replica read-your-writes pins, the auto-assignment
+agent pool and the escalation deadlines. With several workers a request can
+land on a worker that has not seen a change, so auto-assignment is switched off
+when more than one worker runs.
+
+On SIGTERM or SIGINT the supervisor forwards the signal to the workers. Each
+one stops accepting connections and gives in-flight requests (including their
+background notification sends) ``GRACEFUL_TIMEOUT_SECONDS`` to finish. Then the
+shutdown hooks drain the group-commit writer and the notification coalescer
+within ``SHUTDOWN_DRAIN_SECONDS``. Workers still running after both deadlines
+and a few seconds of margin are killed. A second signal kills them at once.
+"""
+
+from __future__ import annotations
+
+import gc
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# 0 sizes the pool from the CPUs available to this process. One by default: the poll floor and replica pins
+# are per process (see the module docstring)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# How long in-flight requests may run after SIGTERM
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+# Must match the deadline main.py gives its shutdown hooks
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "10"))
+KEEPALIVE_SECONDS = int(os.getenv("KEEPALIVE_SECONDS", "5"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+# Comma-separated proxy addresses trusted for X-Forwarded-For (cloudflared and local proxies by default)
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+KILL_MARGIN_SECONDS = 5
+# A worker exiting sooner than this after its start is restarted with a delay, not in a tight loop
+MIN_WORKER_LIFETIME_SECONDS = 5
+RESTART_DELAY_SECONDS = 1
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    return max(1, min(cpus, int(quota + 0.5))) if quota else cpus
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """CPUs granted by a cgroup v2 ``cpu.max`` limit (containers), if any"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as handle:
+            quota, period = handle.read().split()
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def worker_count() -> int:
+    return WEB_CONCURRENCY if WEB_CONCURRENCY > 0 else available_cpus()
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    return "uvloop" if sys.platform != "win32" and _installed("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if _installed("httptools") else "h11"
+
+
+def build_config(app) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=HOST,
+        port=PORT,
+        loop=event_loop(),
+        http=http_protocol(),
+        lifespan="on",
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+
+
+def _after_fork(recover_escalations: bool) -> None:
+    """Drop pooled database connections inherited from the supervisor without closing them under it"""
+    from .database import engine, replica_router
+    from .escalation import escalation_scheduler
+
+    engine.dispose(close=False)
+    for replica in replica_router.replicas:
+        replica.engine.dispose(close=False)
+    escalation_scheduler.recover_on_start = recover_escalations
+
+
+class Supervisor:
+    """Forks workers onto one listening socket, restarts the ones that die and drains them on shutdown"""
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.kill_after = GRACEFUL_TIMEOUT_SECONDS + SHUTDOWN_DRAIN_SECONDS + KILL_MARGIN_SECONDS
+        self.children: Dict[int, float] = {}
+        # The worker that recovered the escalation deadlines at boot; only its replacement recovers them again
+        self.recoverer: Optional[int] = None
+        self.stopping = False
+        self._socket: Optional[socket.socket] = None
+
+    def run(self) -> None:
+        self._socket = self.config.bind_socket()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._handle_stop)
+        signal.signal(signal.SIGALRM, self._handle_deadline)
+        # Keep the preloaded objects out of the collector so it doesn't dirty the shared pages
+        gc.freeze()
+        logger.info(
+            "Starting %d workers on %s:%d (loop=%s, http=%s)",
+            self.workers, self.config.host, self.config.port, self.config.loop, self.config.http,
+        )
+        # Only the first worker recovers escalation deadlines at boot, so each one is armed in a single worker
+        for slot in range(self.workers):
+            self._spawn(recover_escalations=slot == 0)
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.error("Worker %d exited with status %d, restarting", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME_SECONDS:
+                time.sleep(RESTART_DELAY_SECONDS)
+            if not self.stopping:
+                # Other survivors still hold their own deadlines; re-arming them would send every reminder twice
+                self._spawn(recover_escalations=pid == self.recoverer)
+
+        signal.alarm(0)
+        self._socket.close()
+        logger.info("All workers stopped")
+
+    def _spawn(self, recover_escalations: bool) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            if recover_escalations:
+                self.recoverer = pid
+            return
+        # Worker: uvicorn installs its own handlers while serving
+        code = 0
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                signal.signal(sig, signal.SIG_DFL)
+            _after_fork(recover_escalations)
+            uvicorn.Server(self.config).run(sockets=[self._socket])
+        except BaseException:
+            logger.exception("Worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _handle_stop(self, sig: int, frame) -> None:
+        if self.stopping:
+            logger.warning("Second %s, killing workers", signal.Signals(sig).name)
+            self._kill_all()
+            return
+        self.stopping = True
+        logger.info(
+            "%s received, draining %d workers (killed after %ds)",
+            signal.Signals(sig).name, len(self.children), self.kill_after,
+        )
+        for pid in self.children:
+            self._signal(pid, signal.SIGTERM)
+        signal.alarm(int(self.kill_after))
+
+    def _handle_deadline(self, sig: int, frame) -> None:
+        if self.children:
+            logger.error("Shutdown deadline passed, killing %d workers", len(self.children))
+            self._kill_all()
+
+    def _kill_all(self) -> None:
+        for pid in self.children:
+            self._signal(pid, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(pid: int, sig: int) -> None:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(name)s %(levelname)s %(message)s")
+    # Preload: migrations, index setup and rollup backfills run once, before the workers fork
+    from . import assignment
+    from .database import replica_router
+    from .main import app
+
+    workers = worker_count()
+    if workers > 1 and assignment.AUTO_ASSIGN_ENABLED:
+        # Each worker's agent pool only sees the claims it committed itself, so max_open caps would not hold
+        logger.warning("Auto-assignment needs a single worker; disabled for %d workers", workers)
+        assignment.AUTO_ASSIGN_ENABLED = False
+    if workers > 1 and replica_router.replicas:
+        logger.warning(
+            "%d workers with read replicas: a visitor's next read may reach a worker without their write pin "
+            "and read a lagging replica for up to REPLICA_MAX_LAG_SECONDS",
+            workers,
+        )
+    Supervisor(build_config(app), workers).run()
+
+
+if __name__ == "__main__":
+    main()
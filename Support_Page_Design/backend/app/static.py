@@ -0,0 +1,219 @@
+"""Static frontend serving with precompressed assets and cache headers"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+try:  # Brotli is optional; gzip siblings are always supported
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Files at or above this size are handed to the server as an open file when it supports zero-copy sends
+SENDFILE_THRESHOLD = int(os.getenv("STATIC_SENDFILE_THRESHOLD", str(256 * 1024)))
+
+# Vite writes its build output to assets/ with an 8-character content hash, e.g. assets/index-BdQq_4o_.js
+HASHED_ASSET_DIR = "assets"
+HASHED_ASSET_RE = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_SUFFIXES = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".map", ".xml", ".wasm"}
+
+# Encodings in order of preference, mapped to the sibling file suffix
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _accepted_encodings(scope: Scope) -> set:
+    header = Headers(scope=scope).get("accept-encoding", "")
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token)
+    return accepted
+
+
+def is_hashed_asset(path: str) -> bool:
+    """Only Vite's hashed build output may be cached forever; everything else revalidates.
+
+    >>> is_hashed_asset("build/assets/index-BdQq_4o_.js")
+    True
+    >>> is_hashed_asset("build/assets/logo-a1B2c3D4.svg")
+    True
+    >>> is_hashed_asset("build/apple-touch-icon.png")
+    False
+    >>> is_hashed_asset("build/site-manifest.json")
+    False
+    >>> is_hashed_asset("build/og-image-large.png")
+    False
+    >>> is_hashed_asset("build/assets/og-image-large.png")
+    False
+    """
+    parent, name = os.path.split(path)
+    return os.path.basename(parent) == HASHED_ASSET_DIR and HASHED_ASSET_RE.search(name) is not None
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """FileResponse that uses the ASGI zero-copy extension (sendfile) when the server offers it.
+
+    uvicorn does not offer the extension, so under app.serve this always falls
+    back to FileResponse's chunked reads.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" not in extensions or scope["method"].upper() == "HEAD":
+            await super().__call__(scope, receive, send)
+            return
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        # The extension takes the open file object itself; open and close it off the event loop
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.zerocopysend", "file": file})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+        if self.background is not None:
+            await self.background()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings and long-lived cache headers for hashed names"""
+
+    def file_response(
+        self,
+        full_path: os.PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        full_path = str(full_path)
+        encoding, served_path, served_stat = self._select_variant(full_path, scope)
+
+        response_class = ZeroCopyFileResponse if served_stat.st_size >= SENDFILE_THRESHOLD else FileResponse
+        # media_type comes from the original name, not the .br/.gz sibling
+        response = response_class(
+            served_path,
+            status_code=status_code,
+            stat_result=served_stat,
+            media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+        )
+        if encoding:
+            response.headers["content-encoding"] = encoding
+        if Path(full_path).suffix in COMPRESSIBLE_SUFFIXES:
+            response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = (
+            IMMUTABLE_CACHE_CONTROL if is_hashed_asset(full_path) else REVALIDATE_CACHE_CONTROL
+        )
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def _select_variant(full_path: str, scope: Scope) -> Tuple[Optional[str], str, os.stat_result]:
+        if Path(full_path).suffix in COMPRESSIBLE_SUFFIXES:
+            accepted = _accepted_encodings(scope)
+            for encoding, suffix in ENCODINGS:
+                if encoding not in accepted and "*" not in accepted:
+                    continue
+                try:
+                    sibling_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                if stat.S_ISREG(sibling_stat.st_mode):
+                    return encoding, full_path + suffix, sibling_stat
+        return None, full_path, os.stat(full_path)
+
+
+class IndexDocument:
+    """index.html kept in memory (plain and compressed) with ETag revalidation.
+
+    The file is re-read only when its mtime or size changes, so a redeployed
+    build is picked up without a restart.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._signature: Optional[Tuple[float, int]] = None
+        self._bodies: Dict[Optional[str], bytes] = {}
+        self._etag = ""
+
+    def _refresh(self) -> None:
+        stat_result = self.path.stat()
+        signature = (stat_result.st_mtime, stat_result.st_size)
+        if signature == self._signature:
+            return
+
+        body = self.path.read_bytes()
+        bodies: Dict[Optional[str], bytes] = {None: body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body)
+        self._bodies = bodies
+        self._etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._signature = signature
+
+    def response(self, scope: Scope) -> Response:
+        self._refresh()
+        headers = {
+            "etag": self._etag,
+            "cache-control": REVALIDATE_CACHE_CONTROL,
+            "vary": "Accept-Encoding",
+        }
+
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        if self._etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        accepted = _accepted_encodings(scope)
+        for encoding, _ in ENCODINGS:
+            if encoding in self._bodies and (encoding in accepted or "*" in accepted):
+                headers["content-encoding"] = encoding
+                return Response(self._bodies[encoding], media_type="text/html", headers=headers)
+        return Response(self._bodies[None], media_type="text/html", headers=headers)
+
+
+def precompress(directory: Path, min_size: int = 1024) -> int:
+    """Write .gz (and .br when brotli is installed) siblings for compressible files in a build directory"""
+    written = 0
+    for path in directory.rglob("*"):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        data = path.read_bytes()
+        if len(data) < min_size:
+            continue
+
+        variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(data)))
+        for suffix, compressed in variants:
+            # Only keep a sibling if it actually saves bytes
+            if len(compressed) < len(data):
+                Path(str(path) + suffix).write_bytes(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    build_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.parent.parent / "build"
+    print(f"Wrote {precompress(build_dir)} precompressed files in {build_dir}")
@@ -1,30 +1,71 @@
-"""Telegram Bot Integration for Support System"""
+"""Telegram Bot Integration for Support System
 
+Traffic can be spread over several bots, each with its own support group, to
+get past a single bot's rate limits. ``TELEGRAM_BOTS`` lists the shards; each
+ticket is pinned to one when it is created (by category, visitor locale or a
+consistent hash of the ticket id) and all of its cards, buttons and agent
+messages go through that shard's bot.
+"""
+
+import hashlib
+import json
 import os
 import httpx
 import logging
-from typing import Optional, Dict, Any, List
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, IO
 from datetime import datetime
 
+from .tracing import KIND_CLIENT, start_span
+
 logger = logging.getLogger(__name__)
 
 # Environment variables
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Bot API endpoint; pointed at a local stub by the replay harness
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
 SUPPORT_GROUP_CHAT_ID = os.getenv("SUPPORT_GROUP_CHAT_ID", "")
+# JSON list of shards: [{"name": "eu", "token": "...", "group": "-100...", "categories": [...], "locales": [...]}]
+# When unset a single "default" shard is built from the two variables above
+TELEGRAM_BOTS = os.getenv("TELEGRAM_BOTS", "")
+DEFAULT_BOT_NAME = "default"
+
+# Telegram only renders these inline as photos, and only up to 10 MB; everything else goes as a document
+PHOTO_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp"}
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+UPLOAD_TIMEOUT_SECONDS = 120.0
 
 class TelegramService:
-    def __init__(self):
-        self.bot_token = TELEGRAM_BOT_TOKEN
-        self.support_group_id = SUPPORT_GROUP_CHAT_ID
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+    """One bot and the support group it posts ticket cards to"""
+
+    def __init__(
+        self,
+        bot_token: str = TELEGRAM_BOT_TOKEN,
+        support_group_id: str = SUPPORT_GROUP_CHAT_ID,
+        name: str = DEFAULT_BOT_NAME,
+        categories: Tuple[str, ...] = (),
+        locales: Tuple[str, ...] = (),
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.name = name
+        self.bot_token = bot_token
+        self.support_group_id = support_group_id
+        self.base_url = f"{TELEGRAM_API_BASE}/bot{self.bot_token}"
+        # Replaces the network for every Bot API call (benchmarks use httpx.MockTransport)
+        self.transport = transport
+        # Tickets with these categories / visitor locales are routed to this bot
+        self.categories = tuple(category.lower() for category in categories)
+        self.locales = tuple(locale.lower() for locale in locales)
         
         if not self.bot_token:
-            logger.warning("TELEGRAM_BOT_TOKEN not configured")
+            logger.warning("TELEGRAM_BOT_TOKEN not configured for bot %r", name)
         if not self.support_group_id:
-            logger.warning("SUPPORT_GROUP_CHAT_ID not configured")
+            logger.warning("SUPPORT_GROUP_CHAT_ID not configured for bot %r", name)
     
-    async def _make_request(self, method: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Make HTTP request to Telegram API"""
+    async def _make_request(
+        self, method: str, data: Dict[str, Any], files: Optional[Dict[str, Tuple[str, IO[bytes], str]]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Make HTTP request to Telegram API; with ``files`` the body is a streamed multipart upload"""
         if not self.bot_token:
             print(f"ERROR: Telegram bot token not configured")
             return None
@@ -33,22 +74,32 @@ class TelegramService:
         print(f"Making Telegram API request to: {url}")
         print(f"Request data: {data}")
         
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=data)
+        attributes = {"telegram.method": method, "telegram.chat_id": data.get("chat_id"), "telegram.bot": self.name}
+        with start_span(f"telegram.{method}", KIND_CLIENT, attributes) as span:
+            try:
+                if files:
+                    # httpx reads file objects chunk by chunk, so uploads never sit in memory whole
+                    async with httpx.AsyncClient(timeout=UPLOAD_TIMEOUT_SECONDS, transport=self.transport) as client:
+                        response = await client.post(url, data=data, files=files)
+                else:
+                    async with httpx.AsyncClient(transport=self.transport) as client:
+                        response = await client.post(url, json=data)
+                span.set_attribute("http.status_code", response.status_code)
                 print(f"Response status: {response.status_code}")
                 print(f"Response text: {response.text}")
                 response.raise_for_status()
                 result = response.json()
                 print(f"Parsed response: {result}")
                 return result
-        except httpx.HTTPError as e:
-            print(f"ERROR: Telegram API HTTP error: {e}")
-            print(f"Response content: {e.response.text if hasattr(e, 'response') else 'No response'}")
-            return None
-        except Exception as e:
-            print(f"ERROR: Unexpected error calling Telegram API: {e}")
-            return None
+            except httpx.HTTPError as e:
+                span.set_error(f"{type(e).__name__}: {e}")
+                print(f"ERROR: Telegram API HTTP error: {e}")
+                print(f"Response content: {e.response.text if hasattr(e, 'response') else 'No response'}")
+                return None
+            except Exception as e:
+                span.set_error(f"{type(e).__name__}: {e}")
+                print(f"ERROR: Unexpected error calling Telegram API: {e}")
+                return None
     
     async def send_message(self, chat_id: str, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Send a message to a Telegram chat"""
@@ -63,6 +114,19 @@ class TelegramService:
             
         return await self._make_request("sendMessage", data)
 
+    async def send_file(
+        self, chat_id: str, path: Path, filename: str, content_type: str, caption: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Upload a stored file as a photo (small images) or a document"""
+        as_photo = content_type in PHOTO_CONTENT_TYPES and path.stat().st_size <= PHOTO_MAX_BYTES
+        method, field = ("sendPhoto", "photo") if as_photo else ("sendDocument", "document")
+        data: Dict[str, Any] = {"chat_id": chat_id, "parse_mode": "HTML"}
+        if caption:
+            data["caption"] = caption[:1024]
+
+        with open(path, "rb") as handle:
+            return await self._make_request(method, data, files={field: (filename, handle, content_type)})
+
     async def answer_callback(self, callback_id: str, text: Optional[str] = None, show_alert: bool = False) -> None:
         if not self.bot_token:
             return
@@ -73,6 +137,20 @@ class TelegramService:
 
         await self._make_request("answerCallbackQuery", payload)
 
+    async def edit_message_text(self, chat_id: str, message_id: int, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Replace the text (and keyboard) of an existing message; omitting reply_markup removes the buttons"""
+        data = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text,
+            "parse_mode": "HTML"
+        }
+
+        if reply_markup:
+            data["reply_markup"] = reply_markup
+
+        return await self._make_request("editMessageText", data)
+
     async def edit_message_reply_markup(self, chat_id: str, message_id: int, reply_markup: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Edit reply markup of an existing message"""
         data = {
@@ -83,26 +161,52 @@ class TelegramService:
         
         return await self._make_request("editMessageReplyMarkup", data)
     
-    async def notify_new_ticket(self, ticket_id: int, category: str, message_body: str) -> Optional[int]:
-        """Send notification to support group about new ticket with claim/pass buttons"""
-        if not self.support_group_id:
-            logger.error("Support group chat ID not configured")
-            return None
-        
-        # Truncate message body to reasonable length
-        truncated_body = message_body[:200] + "..." if len(message_body) > 200 else message_body
-        
-        text = f"🆕 <b>New Ticket #{ticket_id}</b>\n" \
-               f"📋 Category: {category or 'General'}\n" \
-               f"💬 Message: \"{truncated_body}\"\n" \
-               f"⏰ Time: {datetime.utcnow().strftime('%H:%M UTC')}"
-        
+    def render_ticket_card(
+        self,
+        ticket_id: int,
+        category: Optional[str],
+        status: str,
+        message_body: Optional[str] = None,
+        agent_name: Optional[str] = None,
+        reopened: bool = False,
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Build the text and keyboard of a ticket's card in the support group for a given status"""
+        category = category or "General"
+
+        if status == "claimed":
+            return f"🙋 <b>Ticket #{ticket_id}</b> • {category}\nClaimed by {agent_name or 'an agent'}", None
+        if status == "closed":
+            closed_by = f" by {agent_name}" if agent_name else ""
+            return f"✅ <b>Ticket #{ticket_id} closed</b>{closed_by} • {category}", None
+
+        if reopened:
+            text = f"🔄 <b>Ticket #{ticket_id} reopened</b> • {category}\n" \
+                   f"Available for claiming again."
+        else:
+            # Truncate message body to reasonable length
+            message_body = message_body or ""
+            truncated_body = message_body[:200] + "..." if len(message_body) > 200 else message_body
+
+            text = f"🆕 <b>New Ticket #{ticket_id}</b>\n" \
+                   f"📋 Category: {category}\n" \
+                   f"💬 Message: \"{truncated_body}\"\n" \
+                   f"⏰ Time: {datetime.utcnow().strftime('%H:%M UTC')}"
+
         reply_markup = {
             "inline_keyboard": [[
                 {"text": "✅ Claim", "callback_data": f"CLAIM#{ticket_id}"},
                 {"text": "↩️ Pass", "callback_data": f"PASS#{ticket_id}"}
             ]]
         }
+        return text, reply_markup
+
+    async def notify_new_ticket(self, ticket_id: int, category: str, message_body: str) -> Optional[int]:
+        """Send notification to support group about new ticket with claim/pass buttons"""
+        if not self.support_group_id:
+            logger.error("Support group chat ID not configured")
+            return None
+        
+        text, reply_markup = self.render_ticket_card(ticket_id, category, "open", message_body=message_body)
         
         result = await self.send_message(self.support_group_id, text, reply_markup)
         
@@ -110,6 +214,34 @@ class TelegramService:
             return result["result"]["message_id"]
         
         return None
+
+    async def update_ticket_card(
+        self,
+        message_id: Optional[int],
+        ticket_id: int,
+        category: Optional[str],
+        status: str,
+        message_body: Optional[str] = None,
+        agent_name: Optional[str] = None,
+        reopened: bool = False,
+    ) -> Optional[int]:
+        """Edit a ticket's group card in place; tickets without a known card get a new message.
+
+        Returns the message_id of the card (the new one if a message had to be posted).
+        """
+        if not self.support_group_id:
+            return None
+
+        text, reply_markup = self.render_ticket_card(ticket_id, category, status, message_body, agent_name, reopened)
+
+        if message_id is not None:
+            await self.edit_message_text(self.support_group_id, message_id, text, reply_markup)
+            return message_id
+
+        result = await self.send_message(self.support_group_id, text, reply_markup)
+        if result and result.get("ok"):
+            return result["result"]["message_id"]
+        return None
     
     async def notify_agent_assigned(self, agent_chat_id: str, ticket_id: int) -> None:
         """Notify agent that they've been assigned to a ticket"""
@@ -148,5 +280,69 @@ class TelegramService:
         result = await self._make_request("setWebhook", data)
         return result is not None and result.get("ok", False)
 
-# Singleton instance
-telegram_service = TelegramService()
+
+
+def _locale_matches(locale: str, prefixes: Tuple[str, ...]) -> bool:
+    locale = locale.lower().replace("_", "-")
+    return any(locale == prefix or locale.startswith(prefix + "-") for prefix in prefixes)
+
+
+class TelegramPool:
+    """The configured bots, and the routing of tickets to them"""
+
+    def __init__(self, services: List[TelegramService]):
+        self.services: Dict[str, TelegramService] = {service.name: service for service in services}
+        self.default = services[0]
+        # Bots without explicit categories/locales share the hashed traffic
+        self._hashed = [service for service in services if not service.categories and not service.locales] or services
+
+    @classmethod
+    def from_env(cls) -> "TelegramPool":
+        if not TELEGRAM_BOTS:
+            return cls([TelegramService()])
+        services = [
+            TelegramService(
+                bot_token=entry["token"],
+                support_group_id=str(entry.get("group", "")),
+                name=entry["name"],
+                categories=tuple(entry.get("categories", ())),
+                locales=tuple(entry.get("locales", ())),
+            )
+            for entry in json.loads(TELEGRAM_BOTS)
+        ]
+        if not services:
+            raise ValueError("TELEGRAM_BOTS must list at least one bot")
+        return cls(services)
+
+    def __iter__(self):
+        return iter(self.services.values())
+
+    def __len__(self) -> int:
+        return len(self.services)
+
+    def get(self, name: Optional[str]) -> TelegramService:
+        """The bot owning a ticket; tickets created before sharding (NULL) or on a removed bot fall back to the default"""
+        return self.services.get(name or DEFAULT_BOT_NAME, self.default)
+
+    def route(self, ticket_id: int, category: Optional[str] = None, locale: Optional[str] = None) -> str:
+        """Pick the bot for a new ticket: a category match, then a locale match, then rendezvous hashing"""
+        if category:
+            for service in self.services.values():
+                if category.lower() in service.categories:
+                    return service.name
+        if locale:
+            for service in self.services.values():
+                if _locale_matches(locale, service.locales):
+                    return service.name
+        if len(self._hashed) == 1:
+            return self._hashed[0].name
+        # Highest-random-weight hashing: adding or removing a bot only moves the tickets that hash to it
+        return max(
+            self._hashed,
+            key=lambda service: hashlib.blake2b(f"{service.name}:{ticket_id}".encode(), digest_size=8).digest(),
+        ).name
+
+
+# Singleton instances
+telegram_pool = TelegramPool.from_env()
+telegram_service = telegram_pool.default
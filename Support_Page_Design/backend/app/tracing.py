@@ -0,0 +1,304 @@
+"""Lightweight distributed tracing with OTLP/JSON export.
+
+Spans are recorded for HTTP requests (``TracingMiddleware``), database
+transactions and statements, Telegram API calls and background jobs. The
+active span lives in a ContextVar so it follows ``await`` chains, threadpool
+calls and tasks created from a request. Incoming W3C ``traceparent`` headers
+are continued, and deferred work (debounced notifications, escalations)
+starts its spans from a context captured when the work was queued.
+
+Finished spans are batched by a daemon thread and sent as OTLP/HTTP JSON to
+``TRACE_EXPORT_URL`` (e.g. a local collector on :4318) and/or appended as
+one OTLP document per line to ``TRACE_EXPORT_FILE``. Sampling is decided at
+the root of each trace (``TRACE_SAMPLE_RATIO``) and inherited by its children.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "support-backend")
+# OTLP/HTTP JSON endpoint, e.g. http://localhost:4318/v1/traces
+TRACE_EXPORT_URL = os.getenv("TRACE_EXPORT_URL", "")
+# File receiving one OTLP/JSON document per line
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_EXPORT_INTERVAL_SECONDS = float(os.getenv("TRACE_EXPORT_INTERVAL_SECONDS", "5"))
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "10000"))
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_STATUS_ERROR = 2
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, header: str) -> Optional["SpanContext"]:
+        match = _TRACEPARENT_RE.match(header.strip().lower())
+        if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+            return None
+        return cls(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context", default=None)
+
+
+def current_context() -> Optional[SpanContext]:
+    """The active span's context; capture it to continue the trace from deferred work"""
+    return _current.get()
+
+
+@dataclass
+class Span:
+    name: str
+    context: SpanContext
+    parent_span_id: Optional[str]
+    kind: int = KIND_INTERNAL
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    links: List[SpanContext] = field(default_factory=list)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            span_exporter.enqueue(self)
+
+
+# Returned when tracing is disabled so callers never have to check
+_NOOP_CONTEXT = SpanContext("0" * 32, "0" * 16, False)
+
+
+class _NoopSpan(Span):
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan("noop", _NOOP_CONTEXT, None)
+_DEFAULT = object()
+
+
+def begin_span(
+    name: str,
+    kind: int = KIND_INTERNAL,
+    attributes: Optional[Dict[str, Any]] = None,
+    parent: Any = _DEFAULT,
+    links: Optional[List[Optional[SpanContext]]] = None,
+    require_parent: bool = False,
+) -> Span:
+    """Create a span without activating it; the caller must call ``end()``.
+
+    ``parent`` defaults to the active span; pass a captured ``SpanContext`` to
+    continue a trace, or None to start a new one. With ``require_parent`` the
+    span is only recorded inside an existing trace (used for DB statements so
+    untraced code paths don't produce orphan traces).
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    parent_context = _current.get() if parent is _DEFAULT else parent
+    if parent_context is None:
+        if require_parent:
+            return _NOOP_SPAN
+        context = SpanContext(f"{random.getrandbits(128):032x}", f"{random.getrandbits(64):016x}", random.random() < TRACE_SAMPLE_RATIO)
+        parent_span_id = None
+    else:
+        context = SpanContext(parent_context.trace_id, f"{random.getrandbits(64):016x}", parent_context.sampled)
+        parent_span_id = parent_context.span_id
+    span = Span(name, context, parent_span_id, kind, links=[link for link in links or [] if link is not None])
+    for key, value in (attributes or {}).items():
+        span.set_attribute(key, value)
+    return span
+
+
+@contextmanager
+def start_span(name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None, **options) -> Iterator[Span]:
+    """Create a span, make it the active one for the block and end it afterwards"""
+    span = begin_span(name, kind, attributes, **options)
+    if span is _NOOP_SPAN:
+        yield span
+        return
+    token = _current.set(span.context)
+    try:
+        yield span
+    except BaseException as exc:
+        span.set_error(f"{type(exc).__name__}: {exc}")
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _encode_span(span: Span) -> Dict[str, Any]:
+    encoded: Dict[str, Any] = {
+        "traceId": span.context.trace_id,
+        "spanId": span.context.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in span.attributes.items()],
+    }
+    if span.parent_span_id:
+        encoded["parentSpanId"] = span.parent_span_id
+    if span.links:
+        encoded["links"] = [{"traceId": link.trace_id, "spanId": link.span_id} for link in span.links]
+    if span.error:
+        encoded["status"] = {"code": _STATUS_ERROR, "message": span.error}
+    return encoded
+
+
+class SpanExporter:
+    """Buffers finished spans and ships them from a background thread, dropping spans when the buffer is full"""
+
+    def __init__(self, url: str, path: str, interval: float, max_queue: int):
+        self.url = url
+        self.path = path
+        self.interval = interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._buffer: List[Span] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, span: Span) -> None:
+        with self._lock:
+            if len(self._buffer) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._buffer.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+            full = len(self._buffer) >= self.max_queue // 2
+        if full:
+            self._wakeup.set()
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if not spans:
+            return
+        document = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [_encode_span(span) for span in spans]}],
+            }]
+        }
+        if self.path:
+            try:
+                with open(self.path, "a", encoding="utf-8") as handle:
+                    handle.write(json.dumps(document) + "\n")
+            except OSError:
+                logger.exception("Failed to write %d spans to %s", len(spans), self.path)
+        if self.url:
+            try:
+                httpx.post(self.url, json=document, timeout=5.0).raise_for_status()
+            except httpx.HTTPError as exc:
+                logger.warning("Failed to export %d spans to %s: %s", len(spans), self.url, exc)
+
+
+def shutdown() -> None:
+    """Export whatever is still buffered; called on application shutdown"""
+    span_exporter.flush()
+
+
+class TracingMiddleware:
+    """Opens a server span per HTTP request, continuing the caller's ``traceparent`` when present"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        remote = SpanContext.from_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        attributes = {"http.method": scope["method"], "http.target": scope["path"]}
+        with start_span(f"{scope['method']} {scope['path']}", KIND_SERVER, attributes, parent=remote) as span:
+            async def send_with_trace(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_error(f"HTTP {message['status']}")
+                    message = {**message, "headers": [*message.get("headers", []), (b"traceresponse", span.context.traceparent.encode())]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                # The route template is only known once the router has matched
+                route = scope.get("route")
+                if route is not None and hasattr(route, "path"):
+                    span.name = f"{scope['method']} {route.path}"
+                    span.set_attribute("http.route", route.path)
+
+
+# Singleton instance
+span_exporter = SpanExporter(TRACE_EXPORT_URL, TRACE_EXPORT_FILE, TRACE_EXPORT_INTERVAL_SECONDS, TRACE_MAX_QUEUE)
@@ -0,0 +1,159 @@
+"""Benchmark: table/index size and lookup latency before and after column compaction.
+
+Builds the legacy layout (36-char string session ids, string status/sender)
+with synthetic data, measures it, runs ``compact_columns`` and measures again.
+Uses a temporary SQLite database unless ``--url`` points at a scratch
+database (its tables are dropped and recreated).
+
+    python -m benchmarks.bench_compact [--sessions 20000] [--url postgresql://...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from sqlalchemy import MetaData, String, create_engine, text
+from sqlalchemy.engine import Engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import Base  # noqa: E402
+from app.migrations import compact_columns  # noqa: E402
+from app.models import CodedString, CompactUUID, SupportSession  # noqa: E402
+
+TABLES = ("support_sessions", "tickets", "messages")
+
+
+def _create_legacy_schema(engine: Engine) -> None:
+    legacy = MetaData()
+    for table in Base.metadata.sorted_tables:
+        copy = table.to_metadata(legacy)
+        for column in copy.columns:
+            if isinstance(column.type, (CompactUUID, CodedString)):
+                column.type = String()
+    legacy.drop_all(engine)
+    Base.metadata.drop_all(engine)
+    legacy.create_all(engine)
+
+
+def _populate(engine: Engine, sessions: int, messages_per_ticket: int) -> List[str]:
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    session_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(sessions)]
+    statuses = ["open", "claimed", "closed", "closed", "closed"]
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO support_sessions (id, created_at, last_seen_at) VALUES (:id, :now, :now)"),
+            [{"id": sid, "now": now} for sid in session_ids],
+        )
+        conn.execute(
+            text("INSERT INTO tickets (id, session_id, status, priority, created_at) VALUES (:id, :sid, :status, 0, :now)"),
+            [{"id": index + 1, "sid": sid, "status": rng.choice(statuses), "now": now} for index, sid in enumerate(session_ids)],
+        )
+        conn.execute(
+            text("INSERT INTO messages (ticket_id, session_id, sender, body, created_at) VALUES (:tid, :sid, :sender, 'hello', :now)"),
+            [
+                {"tid": index + 1, "sid": sid, "sender": "visitor" if n % 2 == 0 else "agent", "now": now}
+                for index, sid in enumerate(session_ids)
+                for n in range(messages_per_ticket)
+            ],
+        )
+    return session_ids
+
+
+def _sizes(engine: Engine) -> Dict[str, int]:
+    """Bytes used by the benchmark tables and their indexes"""
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            rows = conn.execute(text(
+                "SELECT c.relname, pg_relation_size(c.oid) FROM pg_class c "
+                "LEFT JOIN pg_index i ON i.indexrelid = c.oid LEFT JOIN pg_class t ON t.oid = i.indrelid "
+                "WHERE c.relname = ANY(:tables) OR t.relname = ANY(:tables)"
+            ), {"tables": list(TABLES)})
+        else:
+            rows = conn.execute(text(
+                "SELECT s.name, SUM(s.pgsize) FROM dbstat AS s JOIN sqlite_master AS m ON m.name = s.name "
+                "WHERE m.tbl_name IN ('support_sessions', 'tickets', 'messages') GROUP BY s.name"
+            ))
+        return {name: int(size) for name, size in rows}
+
+
+def _lookup_latency(engine: Engine, session_ids: List[str], lookups: int, compact: bool) -> Dict[str, float]:
+    """Median microseconds per lookup for the hot query shapes, with ids bound in the stored representation"""
+    rng = random.Random(11)
+    sample = [rng.choice(session_ids) for _ in range(lookups)]
+    session_type = SupportSession.__table__.c.id.type
+    active = "0, 1" if compact else "'open', 'claimed'"
+    queries = {
+        "session by id": "SELECT id FROM support_sessions WHERE id = :sid",
+        "open ticket by session": f"SELECT id FROM tickets WHERE session_id = :sid AND status IN ({active})",
+        "messages by session": "SELECT id, sender FROM messages WHERE session_id = :sid",
+    }
+    results = {}
+    with engine.connect() as conn:
+        bind = session_type.bind_processor(conn.dialect) if compact else None
+        for label, sql in queries.items():
+            statement = text(sql)
+            timings = []
+            for sid in sample:
+                value = bind(session_type.process_bind_param(sid, conn.dialect)) if bind else sid
+                started = time.perf_counter()
+                conn.execute(statement, {"sid": value}).all()
+                timings.append((time.perf_counter() - started) * 1e6)
+            results[label] = statistics.median(timings)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=6, help="messages per ticket")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--url", help="scratch database URL (default: temporary SQLite file)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.url or f"sqlite:///{tmp}/bench.db")
+        _create_legacy_schema(engine)
+        session_ids = _populate(engine, args.sessions, args.messages)
+        if engine.dialect.name == "sqlite":
+            with engine.connect() as conn:
+                conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+        before_sizes = _sizes(engine)
+        before_latency = _lookup_latency(engine, session_ids, args.lookups, compact=False)
+
+        started = time.perf_counter()
+        compact_columns(engine)
+        migration_seconds = time.perf_counter() - started
+
+        after_sizes = _sizes(engine)
+        after_latency = _lookup_latency(engine, session_ids, args.lookups, compact=True)
+        engine.dispose()
+
+    print(f"{args.sessions} sessions, {args.sessions * args.messages} messages on {engine.dialect.name}; "
+          f"migration took {migration_seconds:.2f}s\n")
+    print(f"{'relation':34} {'before':>12} {'after':>12} {'change':>8}")
+    for name in sorted(set(before_sizes) | set(after_sizes)):
+        before, after = before_sizes.get(name, 0), after_sizes.get(name, 0)
+        change = f"{(after - before) / before * 100:+.0f}%" if before else "-"
+        print(f"{name:34} {before:>12,} {after:>12,} {change:>8}")
+    total_before, total_after = sum(before_sizes.values()), sum(after_sizes.values())
+    print(f"{'total':34} {total_before:>12,} {total_after:>12,} {(total_after - total_before) / total_before * 100:+.0f}%\n")
+
+    print(f"{'lookup (median µs)':34} {'before':>12} {'after':>12}")
+    for label in before_latency:
+        print(f"{label:34} {before_latency[label]:>12.1f} {after_latency[label]:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
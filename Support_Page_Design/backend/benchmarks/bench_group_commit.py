@@ -0,0 +1,113 @@
+"""Benchmark: message inserts per second, one commit per request vs group commit.
+
+Simulates ``--clients`` concurrent visitors each posting ``--messages``
+follow-up messages. The per-request path commits every message in its own
+transaction (as ``create_message`` does by default); the group-commit path
+hands them to a ``GroupCommitWriter``. Uses a temporary SQLite database
+unless ``--url`` points at a scratch database.
+
+    python -m benchmarks.bench_group_commit [--clients 50] [--messages 20] [--window-ms 5] [--url postgresql://...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20, help="messages per client")
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-rows", type=int, default=200)
+    parser.add_argument("--url", help="scratch database URL (default: temporary SQLite file)")
+    return parser.parse_args()
+
+
+async def _run(
+    insert: Callable[[Dict], Awaitable[int]], tickets: List[Dict], messages: int
+) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    async def client(ticket: Dict) -> None:
+        for n in range(messages):
+            started = time.perf_counter()
+            await insert({**ticket, "sender": "visitor", "body": f"message {n}", "created_at": datetime.utcnow()})
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(ticket) for ticket in tickets))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rate": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main() -> None:
+    args = _parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app's engine is configured at import time
+        os.environ["DATABASE_URL"] = args.url or f"sqlite:///{tmp}/bench.db"
+
+        from starlette.concurrency import run_in_threadpool
+
+        from app.database import Base, engine, session_scope
+        from app.group_commit import GroupCommitWriter, write_messages
+        from app.models import SupportSession, SupportTicket
+
+        # Lock waits on the per-request path would otherwise flood the output with slow-query warnings
+        logging.getLogger("app.database").setLevel(logging.ERROR)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        tickets = []
+        with session_scope() as db:
+            for _ in range(args.clients):
+                session = SupportSession(id=str(uuid.uuid4()))
+                ticket = SupportTicket(session_id=session.id, status="claimed", priority=0)
+                db.add_all([session, ticket])
+                db.flush()
+                tickets.append({"ticket_id": ticket.id, "session_id": session.id})
+
+        async def per_request(values: Dict) -> int:
+            (message_id,) = await run_in_threadpool(write_messages, [values])
+            return message_id
+
+        writer = GroupCommitWriter(args.window_ms, args.max_rows)
+
+        async def grouped(values: Dict) -> int:
+            return await writer.submit(**values)
+
+        results = {
+            "per-request commit": asyncio.run(_run(per_request, tickets, args.messages)),
+            "group commit": asyncio.run(_run(grouped, tickets, args.messages)),
+        }
+        dialect = engine.dialect.name
+        engine.dispose()
+
+    total = args.clients * args.messages
+    print(f"{total} messages from {args.clients} concurrent clients on {dialect}; "
+          f"window {args.window_ms:g} ms, max {args.max_rows} rows; "
+          f"{writer.stats.batches} batches, largest {writer.stats.largest_batch}\n")
+    print(f"{'path':22} {'msgs/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for label, result in results.items():
+        print(f"{label:22} {result['rate']:>10.0f} {result['p50']:>10.1f} {result['p99']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
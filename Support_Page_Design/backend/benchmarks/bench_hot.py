@@ -0,0 +1,300 @@
+"""Microbenchmarks for the code that runs on every request, with stored baselines.
+
+Cases: ticket/message serialisation across conversation sizes, encoding a
+``ConversationResponse`` (pydantic and the FastAPI response path),
+``session_scope`` overhead, the open-ticket lookup and rendering plus sending
+``notify_new_ticket`` through a stubbed Bot API transport. Everything runs
+offline on a temporary SQLite database; ``--url`` runs the database cases
+against a scratch Postgres instead (its tables are dropped and recreated).
+Database cases are named after the dialect, so one baseline file holds both.
+
+Each case is timed like ``timeit``: the loop count is calibrated to about
+``--min-time`` seconds, repeated ``--repeat`` times, and the fastest repeat is
+compared with the baseline. A case regresses when it is slower than its
+baseline by more than its threshold (``--threshold`` overrides them all);
+the run then exits 1. ``--out`` writes the timings, per-case change and
+regressions as JSON for CI.
+
+    python -m benchmarks.bench_hot [--filter serialize] [--out report.json]
+    python -m benchmarks.bench_hot --update-baseline      # after an intended change, on the reference machine
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "hot.json"
+CONVERSATION_SIZES = (10, 100, 1000)
+SEEDED_SESSIONS = 2000
+
+
+@dataclass
+class Case:
+    name: str
+    # Runs the measured operation ``loops`` times
+    run: Callable[[int], None]
+    # Allowed slowdown against the baseline, in percent
+    threshold: float = 25.0
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--url", help="scratch database for the database cases (default: temporary SQLite file)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update-baseline", action="store_true", help="store this run's results as the baseline")
+    parser.add_argument("--threshold", type=float, help="override every case's regression threshold (percent)")
+    return parser.parse_args()
+
+
+def _text(rng: random.Random, low: int, high: int) -> str:
+    return "".join(rng.choices(string.ascii_letters + "     ", k=rng.randint(low, high)))
+
+
+def _conversation(size: int, rng: random.Random):
+    from app.models import SupportMessage, SupportTicket
+
+    session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    started = datetime(2026, 1, 1, 9, 0)
+    ticket = SupportTicket(
+        id=1, session_id=session_id, status="claimed", category="Billing", priority=1, assigned_agent_id=3,
+        contact_name="Ada Visitor", contact_email="ada@example.com", created_at=started,
+        claimed_at=started + timedelta(minutes=2), closed_at=None,
+    )
+    messages = [
+        SupportMessage(
+            id=n + 1, ticket_id=1, session_id=session_id, sender="visitor" if n % 3 else "agent",
+            body=_text(rng, 20, 300), created_at=started + timedelta(seconds=30 * n),
+        )
+        for n in range(size)
+    ]
+    return ticket, messages
+
+
+def _serialization_cases(rng: random.Random) -> List[Case]:
+    from fastapi.responses import JSONResponse
+
+    from app.main import _serialize_messages, _serialize_ticket
+    from app.schemas import ConversationResponse
+
+    cases = []
+    ticket, _ = _conversation(0, rng)
+    cases.append(Case("serialize_ticket", lambda loops: [_serialize_ticket(ticket) for _ in range(loops)]))
+    for size in CONVERSATION_SIZES:
+        ticket, messages = _conversation(size, rng)
+        response = ConversationResponse(
+            ticket=_serialize_ticket(ticket), messages=_serialize_messages(messages), hasMore=False, nextPollMs=2500
+        )
+
+        def serialize(loops: int, messages=messages) -> None:
+            for _ in range(loops):
+                _serialize_messages(messages)
+
+        def dump_json(loops: int, response=response) -> None:
+            for _ in range(loops):
+                response.model_dump_json()
+
+        def fastapi_render(loops: int, response=response) -> None:
+            # What FastAPI does with a response_model return value
+            for _ in range(loops):
+                JSONResponse(response.model_dump(mode="json")).body
+
+        cases += [
+            Case(f"serialize_messages[{size}]", serialize),
+            Case(f"conversation_response.model_dump_json[{size}]", dump_json),
+            Case(f"conversation_response.fastapi_render[{size}]", fastapi_render),
+        ]
+    return cases
+
+
+def _seed(rng: random.Random) -> List[str]:
+    from app.database import session_scope
+    from app.models import SupportSession, SupportTicket
+
+    session_ids = []
+    with session_scope() as db:
+        for _ in range(SEEDED_SESSIONS):
+            session = SupportSession(id=str(uuid.uuid4()))
+            db.add(session)
+            for n in range(rng.randint(1, 3)):
+                db.add(SupportTicket(session_id=session.id, status="closed" if n else "claimed", priority=0))
+            session_ids.append(session.id)
+    return session_ids
+
+
+def _database_cases(rng: random.Random, dialect: str) -> List[Case]:
+    from sqlalchemy import text
+
+    from app.active_ticket import load_session
+    from app.database import session_scope
+
+    session_ids = _seed(rng)
+
+    def empty(loops: int) -> None:
+        for _ in range(loops):
+            with session_scope():
+                pass
+
+    def select_one(loops: int) -> None:
+        for _ in range(loops):
+            with session_scope() as db:
+                db.execute(text("SELECT 1"))
+
+    def open_ticket_lookup(loops: int) -> None:
+        with session_scope() as db:
+            for n in range(loops):
+                load_session(db, session_ids[n % len(session_ids)], active_only=True)
+                db.expunge_all()
+
+    # Database timings are noisier than pure-Python ones
+    return [
+        Case(f"session_scope.empty[{dialect}]", empty, threshold=50.0),
+        Case(f"session_scope.select_one[{dialect}]", select_one, threshold=50.0),
+        Case(f"open_ticket_lookup[{dialect}]", open_ticket_lookup, threshold=50.0),
+    ]
+
+
+def _telegram_cases(rng: random.Random) -> List[Case]:
+    import httpx
+
+    from app.telegram import TelegramService
+
+    def answer(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 1}})
+
+    service = TelegramService("bench-token", "-100", name="bench", transport=httpx.MockTransport(answer))
+    body = _text(rng, 200, 400)
+
+    def notify(loops: int) -> None:
+        async def send() -> None:
+            for n in range(loops):
+                await service.notify_new_ticket(n, "Billing", body)
+
+        # The Bot API client prints every request and response
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            asyncio.run(send())
+
+    return [Case("telegram.notify_new_ticket", notify)]
+
+
+def _autorange(case: Case, min_time: float) -> int:
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        case.run(loops)
+        if time.perf_counter() - started >= min_time / 5 or loops >= 1_000_000:
+            break
+        loops *= 2
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    return max(1, int(loops * min_time / elapsed))
+
+
+def measure(case: Case, repeat: int, min_time: float) -> Dict[str, Any]:
+    loops = _autorange(case, min_time)
+    per_op = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        case.run(loops)
+        per_op.append((time.perf_counter() - started) / loops * 1e6)
+    return {
+        "loops": loops,
+        "min_us": round(min(per_op), 3),
+        "median_us": round(statistics.median(per_op), 3),
+        "threshold_pct": case.threshold,
+    }
+
+
+def compare(cases: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: Optional[float]) -> List[str]:
+    """Print each case against its baseline; returns the names of the cases that regressed"""
+    regressions = []
+    print(f"\n{'case':52} {'baseline us':>12} {'now us':>10} {'change':>8}")
+    for name, result in cases.items():
+        before = baseline.get("cases", {}).get(name)
+        if before is None:
+            print(f"{name:52} {'-':>12} {result['min_us']:>10} {'new':>8}")
+            continue
+        change = (result["min_us"] / before["min_us"] - 1) * 100
+        limit = threshold if threshold is not None else result["threshold_pct"]
+        regressed = change > limit
+        result["change_pct"] = round(change, 1)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:52} {before['min_us']:>12} {result['min_us']:>10} {change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main() -> None:
+    args = _parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app's engine is configured at import time
+        os.environ["DATABASE_URL"] = args.url or f"sqlite:///{tmp}/bench.db"
+        os.environ["ATTACHMENT_DIR"] = f"{tmp}/attachments"
+
+        from app.database import Base, engine
+
+        logging.getLogger("app.database").setLevel(logging.ERROR)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        dialect = engine.dialect.name
+
+        rng = random.Random(42)
+        cases = _serialization_cases(rng) + _database_cases(rng, dialect) + _telegram_cases(rng)
+        if args.filter:
+            cases = [case for case in cases if args.filter in case.name]
+
+        results: Dict[str, Dict[str, Any]] = {}
+        print(f"{'case':52} {'loops':>8} {'min us':>10} {'median us':>10}")
+        for case in cases:
+            results[case.name] = measure(case, args.repeat, args.min_time)
+            result = results[case.name]
+            print(f"{case.name:52} {result['loops']:>8} {result['min_us']:>10} {result['median_us']:>10}")
+        engine.dispose()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor() or ''}".strip(),
+        "cases": results,
+    }
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if args.update_baseline:
+        # Keep cases this run skipped (other dialects, filtered out)
+        merged = {**report, "cases": {**baseline.get("cases", {}), **results}}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(merged, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline written to {baseline_path}")
+    elif baseline:
+        report["baseline_created_at"] = baseline.get("created_at")
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2) + "\n")
+    if report.get("regressions"):
+        print(f"\nSlower than the baseline allows: {', '.join(report['regressions'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark: bytes on the wire and requests/second for the widget bundle.
+
+Compares plain StaticFiles against PrecompressedStaticFiles for a first visit
+(full download) and a repeat visit (conditional request). Uses a temporary copy
+of the real ``build/`` directory when present, so its .br/.gz siblings are
+never written into the build, otherwise a synthetic bundle.
+
+    python -m benchmarks.bench_static [--requests 2000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.static import PrecompressedStaticFiles, precompress  # noqa: E402
+
+BUILD_DIR = Path(__file__).resolve().parent.parent.parent / "build"
+
+
+def _synthetic_build(root: Path) -> str:
+    assets = root / "assets"
+    assets.mkdir(parents=True)
+    rng = random.Random(42)
+    words = ["".join(rng.choices(string.ascii_letters, k=rng.randint(3, 12))) for _ in range(2000)]
+    body = ";\n".join(f"function {rng.choice(words)}(a,b){{return a.{rng.choice(words)}(b)}}" for _ in range(12000))
+    name = "index-Ab12Cd34.js"
+    (assets / name).write_text(body)
+    (root / "index.html").write_text(f'<!doctype html><script type="module" src="/assets/{name}"></script>')
+    return name
+
+
+def _bundle_name(root: Path) -> str:
+    scripts = sorted((root / "assets").glob("*.js"), key=lambda p: p.stat().st_size, reverse=True)
+    return scripts[0].name
+
+
+async def _measure(app, path: str, headers: dict, requests: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        first = await client.get(path, headers=headers)
+        wire_bytes = first.num_bytes_downloaded + sum(len(k) + len(v) + 4 for k, v in first.headers.raw)
+
+        repeat_headers = dict(headers)
+        if "etag" in first.headers:
+            repeat_headers["if-none-match"] = first.headers["etag"]
+        repeat = await client.get(path, headers=repeat_headers)
+        repeat_bytes = repeat.num_bytes_downloaded + sum(len(k) + len(v) + 4 for k, v in repeat.headers.raw)
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            # Read raw bytes so client-side decompression doesn't skew the server numbers
+            async with client.stream("GET", path, headers=headers) as response:
+                async for _ in response.aiter_raw():
+                    pass
+        elapsed = time.perf_counter() - started
+
+    return {
+        "status": first.status_code,
+        "encoding": first.headers.get("content-encoding", "identity"),
+        "cache_control": first.headers.get("cache-control", "-"),
+        "first_visit_bytes": wire_bytes,
+        "repeat_visit_bytes": repeat_bytes,
+        "repeat_status": repeat.status_code,
+        "rps": requests / elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if BUILD_DIR.exists() and any((BUILD_DIR / "assets").glob("*.js")):
+            root = Path(tmp) / "build"
+            shutil.copytree(BUILD_DIR, root)
+            bundle = _bundle_name(root)
+        else:
+            root = Path(tmp)
+            bundle = _synthetic_build(root)
+        precompress(root)
+
+        baseline = Starlette(routes=[Mount("/assets", StaticFiles(directory=root / "assets"))])
+        optimized = Starlette(routes=[Mount("/assets", PrecompressedStaticFiles(directory=root / "assets"))])
+        headers = {"accept-encoding": "br, gzip"}
+        path = f"/assets/{bundle}"
+
+        print(f"Bundle: {path} ({os.path.getsize(root / 'assets' / bundle)} bytes on disk)")
+        for label, app in (("StaticFiles", baseline), ("PrecompressedStaticFiles", optimized)):
+            result = asyncio.run(_measure(app, path, headers, args.requests))
+            print(
+                f"{label:26} encoding={result['encoding']:8} first={result['first_visit_bytes']:>9}B "
+                f"repeat={result['repeat_visit_bytes']:>9}B ({result['repeat_status']}) "
+                f"{result['rps']:>8.0f} req/s  cache-control={result['cache_control']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""Replay recorded production traffic against a fresh instance and report latency distributions.
+
+Reads a log written by ``app.recording`` (``TRAFFIC_RECORD_FILE``) and re-drives
+it at ``--speed`` times the recorded pace. Sessions, tickets and agents are
+mapped from their pseudonyms to ids created during the replay, so polls,
+messages and Telegram callbacks hit the same conversations in the same order.
+Message text is synthesised from the recorded lengths. Every Bot API call goes
+to a local stub answering after ``--telegram-latency-ms``.
+
+Without ``--url`` a fresh in-process instance on a temporary SQLite database is
+started (``--set KEY=VALUE`` adds settings, e.g. ``GROUP_COMMIT_ENABLED=true``).
+With ``--url``, start the instance with ``TELEGRAM_API_BASE=http://127.0.0.1:<--stub-port>``
+on an empty database, with the replayer's address in ``FORWARDED_ALLOW_IPS`` (127.0.0.1 by default) so
+each recorded client keeps its own IP bucket.
+
+    python -m benchmarks.replay traffic.ndjson.gz [--speed 10] [--out run.json] [--baseline previous.json]
+    python -m benchmarks.replay traffic.ndjson.gz --url http://127.0.0.1:8000 --stub-port 8081
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Multipart framing around a replayed upload, subtracted from the recorded Content-Length
+_UPLOAD_FRAMING_BYTES = 200
+_AGENT_ID_BASE = 7_000_000_000
+_PERCENTILES = (50, 90, 99)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="recorded traffic (.ndjson or .ndjson.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay pace relative to the recording (1-100)")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--url", help="base URL of a running instance (default: fresh in-process instance)")
+    parser.add_argument("--stub-port", type=int, default=0, help="port of the Telegram stub (default: any free port)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30.0)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="setting for the in-process instance")
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--baseline", help="report of a previous run to diff against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="p99 increase (%%) that fails the run")
+    args = parser.parse_args()
+    if not 0 < args.speed <= 100:
+        parser.error("--speed must be in (0, 100]")
+    return args
+
+
+def load_events(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as handle:
+        events = [json.loads(line) for line in handle if line.strip()]
+    events.sort(key=lambda event: event["t"])
+    return events[:limit] if limit else events
+
+
+class TelegramStub:
+    """Answers every Bot API method with a successful result after a fixed delay"""
+
+    def __init__(self, port: int, latency_ms: float):
+        self.calls: Counter = Counter()
+        message_ids = itertools.count(1)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("content-length") or 0))
+                stub.calls[self.path.rsplit("/", 1)[-1]] += 1
+                time.sleep(latency_ms / 1000)
+                body = json.dumps({"ok": True, "result": {"message_id": next(message_ids), "date": int(time.time())}}).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="telegram-stub", daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, speed: float):
+        self.client = client
+        self.speed = speed
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.skipped: Counter = Counter()
+        # How late each request left compared to its scheduled time
+        self.dispatch_lag: List[float] = []
+        self._sessions: Dict[str, asyncio.Future] = {}
+        self._tickets: Dict[int, asyncio.Future] = {}
+        self._oldest_message: Dict[str, int] = {}
+        self._update_ids = itertools.count(1)
+
+    async def run(self, events: List[Dict[str, Any]]) -> float:
+        loop = asyncio.get_running_loop()
+        tasks = []
+        origin = events[0]["t"]
+        started = time.perf_counter()
+        for event in events:
+            due = (event["t"] - origin) / self.speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Register what this request will create before later requests can ask for it
+            if event["m"] == "POST" and event["p"] == "/api/session" and "s" in event:
+                self._sessions.setdefault(event["s"], loop.create_future())
+            if "tk" in event:
+                self._tickets.setdefault(event["tk"], loop.create_future())
+            tasks.append(loop.create_task(self._dispatch(event, started + due)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+    async def _dispatch(self, event: Dict[str, Any], due: float) -> None:
+        route = f"{event['m']} {event['p']}"
+        try:
+            request = await self._build(event)
+        except LookupError:
+            self.skipped[route] += 1
+            self._resolve(event, None)
+            return
+
+        self.dispatch_lag.append(max(time.perf_counter() - due, 0.0) * 1000)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(event["m"], **request)
+        except httpx.HTTPError:
+            self.statuses[route]["error"] += 1
+            self._resolve(event, None)
+            return
+        self.latencies[route].append((time.perf_counter() - started) * 1000)
+        self.statuses[route][str(response.status_code)] += 1
+        self._resolve(event, response)
+
+    def _resolve(self, event: Dict[str, Any], response: Optional[httpx.Response]) -> None:
+        ok = response is not None and response.status_code < 400
+        payload = response.json() if ok and response.headers.get("content-type", "").startswith("application/json") else {}
+        session = self._sessions.get(event.get("s"))
+        if event["p"] == "/api/session" and session is not None and not session.done():
+            if payload.get("session_id"):
+                session.set_result(payload["session_id"])
+            else:
+                # Rejected during the recording or the replay: later requests still need a session
+                asyncio.get_running_loop().create_task(self._create_session(session))
+        ticket = self._tickets.get(event.get("tk"))
+        if ticket is not None:
+            if ok and payload.get("ticket_id") is not None:
+                if ticket.done():
+                    # An earlier request for this ticket failed; a follow-up created it after all
+                    ticket = self._tickets[event["tk"]] = asyncio.get_running_loop().create_future()
+                ticket.set_result(payload["ticket_id"])
+            elif not ticket.done():
+                ticket.set_result(None)
+        if event["m"] == "GET" and payload.get("messages") and "s" in event:
+            oldest = min(message["id"] for message in payload["messages"])
+            self._oldest_message[event["s"]] = min(oldest, self._oldest_message.get(event["s"], oldest))
+
+    async def _create_session(self, future: asyncio.Future) -> None:
+        try:
+            response = await self.client.post("/api/session", json={"locale": "en-US", "user_agent": "replay"})
+            future.set_result(response.json()["session_id"])
+        except (httpx.HTTPError, KeyError, ValueError) as exc:
+            future.set_exception(LookupError(f"session could not be created: {exc}"))
+
+    async def _session(self, pseudonym: Optional[str]) -> str:
+        if pseudonym is None:
+            raise LookupError("request without a session")
+        if pseudonym not in self._sessions:
+            # Session created before the recording started
+            self._sessions[pseudonym] = asyncio.get_running_loop().create_future()
+            await self._create_session(self._sessions[pseudonym])
+        return await self._sessions[pseudonym]
+
+    async def _ticket(self, recorded: Optional[int]) -> int:
+        future = self._tickets.get(recorded)
+        if future is None:
+            # Ticket opened before the recording started
+            raise LookupError(f"unknown ticket {recorded}")
+        ticket_id = await future
+        if ticket_id is None:
+            raise LookupError(f"ticket {recorded} was not created")
+        return ticket_id
+
+    @staticmethod
+    def _client_ip(pseudonym: str) -> str:
+        raw = bytes.fromhex(pseudonym)
+        return f"10.{raw[0]}.{raw[1]}.{raw[2]}"
+
+    async def _build(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        template, shape = event["p"], event.get("b") or {}
+        path = template
+        for key, value in (event.get("pp") or {}).items():
+            path = path.replace(f"{{{key}}}", str(value))
+        request: Dict[str, Any] = {"headers": {"x-forwarded-for": self._client_ip(event["c"])}}
+
+        if "{session_id}" in path:
+            session_id = await self._session(event.get("s"))
+            path = path.replace("{session_id}", session_id)
+
+        if event["m"] == "POST" and template == "/api/session":
+            request["json"] = {"locale": "en-US", "user_agent": "replay"}
+        elif event["m"] == "POST" and template.endswith("/messages"):
+            body = {"body": "x" * max(shape.get("len", 1), 1)}
+            for key in ("category", "priority"):
+                if key in shape:
+                    body[key] = shape[key]
+            if shape.get("contact"):
+                body.update(contact_name="Replay Visitor", contact_email="replay@example.com")
+            request["json"] = body
+        elif event["m"] == "POST" and template.endswith("/attachments"):
+            size = max((shape.get("size") or 0) - _UPLOAD_FRAMING_BYTES, 1)
+            request["files"] = {"file": ("replay.bin", b"\0" * size, "application/octet-stream")}
+        elif event["m"] == "GET" and template == "/api/session/{session_id}":
+            params = {"limit": shape["limit"]} if "limit" in shape else {}
+            if shape.get("before") and event["s"] in self._oldest_message:
+                params["before_id"] = self._oldest_message[event["s"]]
+            request["params"] = params
+        elif template.startswith("/api/telegram/webhook"):
+            request["json"] = await self._update(shape)
+        request["url"] = path
+        return request
+
+    async def _update(self, shape: Dict[str, Any]) -> Dict[str, Any]:
+        update_id = next(self._update_ids)
+        agent = {"id": _AGENT_ID_BASE + int(shape.get("agent", "0")[:8] or "0", 16), "first_name": "Replay Agent"}
+        if shape.get("kind") == "callback":
+            ticket_id = await self._ticket(shape.get("ticket"))
+            return {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": agent,
+                    "data": f"{shape.get('action')}#{ticket_id}",
+                    "message": {"message_id": update_id, "chat": {"id": -100}},
+                },
+            }
+        if shape.get("kind") == "message":
+            if "command" in shape:
+                text = shape["command"]
+                if shape.get("ticket") is not None:
+                    text += f"_{await self._ticket(shape['ticket'])}"
+            else:
+                text = "x" * max(shape.get("len", 1), 1)
+            message = {"message_id": update_id, "from": agent, "chat": {"id": agent["id"], "type": "private"}, "text": text}
+            if shape.get("reply"):
+                message["reply_to_message"] = {"message_id": update_id - 1}
+            return {"update_id": update_id, "message": message}
+        return {"update_id": update_id}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "max": round(max(values), 2)}
+    for percentile in _PERCENTILES:
+        summary[f"p{percentile}"] = round(_percentile(values, percentile), 2)
+    return summary
+
+
+def build_report(events: List[Dict[str, Any]], replayer: Replayer, elapsed: float, stub: TelegramStub, speed: float) -> Dict[str, Any]:
+    recorded: Dict[str, List[float]] = defaultdict(list)
+    for event in events:
+        recorded[f"{event['m']} {event['p']}"].append(event["ms"])
+    routes = {}
+    for route in sorted(set(recorded) | set(replayer.latencies)):
+        statuses = replayer.statuses[route]
+        routes[route] = {
+            **_distribution(replayer.latencies[route]),
+            "errors": sum(count for status, count in statuses.items() if status == "error" or status.startswith("5")),
+            "statuses": dict(statuses),
+            "skipped": replayer.skipped[route],
+            # Server-side latency observed while recording, for reference
+            "recorded": _distribution(recorded[route]),
+        }
+    return {
+        "requests": len(events),
+        "speed": speed,
+        "wallSeconds": round(elapsed, 2),
+        "achievedRps": round(sum(len(values) for values in replayer.latencies.values()) / elapsed, 1) if elapsed else None,
+        "dispatchLagMs": _distribution(replayer.dispatch_lag),
+        "overall": _distribution([value for values in replayer.latencies.values() for value in values]),
+        "telegramCalls": dict(stub.calls),
+        "routes": routes,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['requests']} requests at {report['speed']:g}x in {report['wallSeconds']} s "
+          f"({report['achievedRps']} req/s); dispatch lag p99 {report['dispatchLagMs'].get('p99', 0)} ms\n")
+    print(f"{'route':48} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'err':>5} {'skip':>5} {'rec p99':>8}")
+    for route, stats in [("overall", report["overall"]), *report["routes"].items()]:
+        if not stats.get("count") and not stats.get("skipped"):
+            continue
+        print(f"{route:48} {stats.get('count', 0):>6} {stats.get('p50', 0):>8} {stats.get('p90', 0):>8} "
+              f"{stats.get('p99', 0):>8} {stats.get('max', 0):>8} {stats.get('errors', ''):>5} {stats.get('skipped', ''):>5} "
+              f"{stats.get('recorded', {}).get('p99', ''):>8}")
+    if report["telegramCalls"]:
+        print(f"\nTelegram calls: {report['telegramCalls']}")
+
+
+def diff_reports(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Print p50/p99 changes per route; returns the routes whose p99 regressed beyond ``max_regression`` percent"""
+    regressions = []
+    print(f"\n{'route':48} {'p50 before':>10} {'after':>8} {'p99 before':>10} {'after':>8} {'change':>8}")
+    pairs = [("overall", report["overall"], baseline["overall"])]
+    pairs += [(route, stats, baseline["routes"][route]) for route, stats in report["routes"].items() if route in baseline["routes"]]
+    for route, after, before in pairs:
+        if not after.get("count") or not before.get("count"):
+            continue
+        change = (after["p99"] - before["p99"]) / before["p99"] * 100 if before["p99"] else 0.0
+        # Sub-millisecond moves are noise, whatever their percentage
+        regressed = change > max_regression and after["p99"] - before["p99"] > 1.0
+        if regressed:
+            regressions.append(route)
+        print(f"{route:48} {before['p50']:>10} {after['p50']:>8} {before['p99']:>10} {after['p99']:>8} "
+              f"{change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+async def _replay_in_process(events: List[Dict[str, Any]], speed: float) -> Tuple[Replayer, float]:
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+    from app.main import app
+
+    # Startup hooks create the schema-dependent singletons, background sweepers and writers
+    await app.router.startup()
+    try:
+        # Resolve X-Forwarded-For like uvicorn does in production; ASGITransport connects from 127.0.0.1
+        transport = httpx.ASGITransport(app=ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1"))
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=60) as client:
+            replayer = Replayer(client, speed)
+            elapsed = await replayer.run(events)
+    finally:
+        await app.router.shutdown()
+    return replayer, elapsed
+
+
+async def _replay_remote(events: List[Dict[str, Any]], speed: float, url: str) -> Tuple[Replayer, float]:
+    limits = httpx.Limits(max_connections=500, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        replayer = Replayer(client, speed)
+        elapsed = await replayer.run(events)
+    return replayer, elapsed
+
+
+def main() -> None:
+    args = _parse_args()
+    events = load_events(args.log, args.limit)
+    if not events:
+        sys.exit(f"{args.log} holds no recorded requests")
+    stub = TelegramStub(args.stub_port, args.telegram_latency_ms)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            print(f"Telegram stub on {stub.url}; the instance must use TELEGRAM_API_BASE={stub.url}")
+            replayer, elapsed = asyncio.run(_replay_remote(events, args.speed, args.url.rstrip("/")))
+        else:
+            bots = sorted({event["pp"]["bot_name"] for event in events if "bot_name" in event.get("pp", {})})
+            # The app reads its settings at import time
+            os.environ.update({
+                "DATABASE_URL": f"sqlite:///{tmp}/replay.db",
+                "ATTACHMENT_DIR": f"{tmp}/attachments",
+                "TELEGRAM_API_BASE": stub.url,
+                "TELEGRAM_BOT_TOKEN": "replay",
+                "SUPPORT_GROUP_CHAT_ID": "-100",
+                "TRAFFIC_RECORD_FILE": "",
+            })
+            if bots:
+                shards = [{"name": "default", "token": "replay", "group": "-100"}]
+                shards += [{"name": name, "token": f"replay-{name}", "group": "-100"} for name in bots if name != "default"]
+                os.environ["TELEGRAM_BOTS"] = json.dumps(shards)
+            for setting in args.set:
+                key, _, value = setting.partition("=")
+                os.environ[key] = value
+            logging.getLogger("app.database").setLevel(logging.ERROR)
+            # The app prints a debug line per request and Telegram call
+            with open(os.devnull, "w") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    replayer, elapsed = asyncio.run(_replay_in_process(events, args.speed))
+                finally:
+                    sys.stdout = stdout
+    stub.stop()
+
+    report = build_report(events, replayer, elapsed, stub, args.speed)
+    print_report(report)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = diff_reports(report, json.loads(Path(args.baseline).read_text()), args.max_regression)
+        if regressions:
+            print(f"\np99 regressed by more than {args.max_regression:g}% on: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
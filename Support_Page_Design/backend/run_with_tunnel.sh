@@ -20,18 +20,28 @@ if [ -z "${TELEGRAM_BOT_TOKEN:-}" ] || [ -z "${SUPPORT_GROUP_CHAT_ID:-}" ]; then
   exit 1
 fi
 
+BACKEND_PID=""
+
 cleanup() {
   trap - INT TERM EXIT
   echo "Shutting down..."
   pkill -f "cloudflared tunnel --url" || true
-  pkill -f "uvicorn app.main:app" || true
+  # SIGTERM lets the launcher finish in-flight requests and flush queued notifications; wait for it
+  if [ -n "$BACKEND_PID" ] && kill -0 "$BACKEND_PID" 2>/dev/null; then
+    kill -TERM "$BACKEND_PID" || true
+    wait "$BACKEND_PID" || true
+  fi
 }
 trap cleanup INT TERM EXIT
 
 start_backend() {
-  # Start backend if not already listening
+  # Start backend if not already listening; the launcher restarts its own workers, so leave a live one alone
+  if [ -n "$BACKEND_PID" ] && kill -0 "$BACKEND_PID" 2>/dev/null; then
+    return
+  fi
   if ! curl -fsS "$HEALTH_URL" >/dev/null 2>&1; then
-    python3 -m uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload &
+    PORT=8000 python3 -m app.serve &
+    BACKEND_PID=$!
     sleep 1
   fi
 }
@@ -0,0 +1,11 @@
+"""The app reads its settings at import time, so point it at scratch databases before any test imports it."""
+
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="support-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/primary.db"
+# A replica that never replicates: it has the schema but only the rows a test puts there itself
+os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{_tmp}/replica.db"
+os.environ["ATTACHMENT_DIR"] = f"{_tmp}/attachments"
+os.environ["TRAFFIC_RECORD_FILE"] = ""
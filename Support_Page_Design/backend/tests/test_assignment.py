@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from app.assignment import AgentPool
+
+
+def test_away_agent_keeps_its_load_and_cap():
+    pool = AgentPool(default_max_open=2)
+    pool.upsert_agent(1, True, None)
+    pool.adjust(1, 1, datetime.utcnow())
+    pool.adjust(1, 1, datetime.utcnow())
+    assert pool.pick() is None
+
+    # /away, then a ticket is closed and another claimed manually while away
+    pool.upsert_agent(1, False, None)
+    pool.adjust(1, -1)
+    pool.adjust(1, 1, datetime.utcnow())
+    assert pool.pick() is None
+
+    # /available: still at the cap, so nothing is auto-assigned until a ticket closes
+    pool.upsert_agent(1, True, None)
+    assert pool.pick() is None
+    pool.adjust(1, -1)
+    assert pool.pick() == 1
+
+
+def test_least_loaded_active_agent_is_picked():
+    pool = AgentPool(default_max_open=5)
+    for agent_id in (1, 2, 3):
+        pool.upsert_agent(agent_id, True, None)
+    pool.adjust(1, 2, datetime.utcnow())
+    pool.adjust(2, 1, datetime.utcnow())
+    pool.upsert_agent(3, False, None)
+
+    assert pool.pick() == 2
@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import Base, replica_router
+from app.main import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        for replica in replica_router.replicas:
+            Base.metadata.create_all(replica.engine)
+        replica_router.decisions.clear()
+        yield client
+
+
+def test_new_session_is_read_from_the_primary(client):
+    """A replica that has not caught up must not answer the first poll of a session it has never seen"""
+    session_id = client.post("/api/session", json={}).json()["session_id"]
+
+    response = client.get(f"/api/session/{session_id}")
+
+    assert response.status_code == 200
+    assert replica_router.decisions["primary_pinned"] == 1
+    assert replica_router.decisions["replica"] == 0
+
+
+def test_unpinned_reads_go_to_the_replica(client):
+    response = client.get("/api/session/00000000-0000-4000-8000-000000000000")
+
+    assert response.status_code == 404
+    assert replica_router.decisions["replica"] == 1
@@ -56,7 +56,10 @@ export default function App() {
     isConnected,
     error,
     ticket,
+    hasOlderMessages,
+    isLoadingOlder,
     refreshAll,
+    loadOlderMessages,
     sendChatMessage,
     submitTicket,
     startNewConversation,
@@ -73,7 +76,10 @@ export default function App() {
     error,
     ticketStatus: ticket?.status,
     ticketId: ticket?.id,
+    hasOlderMessages,
+    isLoadingOlder,
     refresh: refreshAll,
+    loadOlderMessages,
     sendMessage: sendChatMessage,
     submitTicket,
     startNewConversation,
@@ -87,7 +93,10 @@ export default function App() {
     isConnected,
     error,
     ticket,
+    hasOlderMessages,
+    isLoadingOlder,
     refreshAll,
+    loadOlderMessages,
     sendChatMessage,
     submitTicket,
     startNewConversation,
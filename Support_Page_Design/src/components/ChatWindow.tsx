@@ -19,6 +19,10 @@ export function ChatWindow({ onClose, support, onOpenTicket }: ChatWindowProps)
   const y = useMotionValue(0);
   const backdropOpacity = useTransform(y, [0, 300], [1, 0]);
   const scrollRef = useRef<HTMLDivElement>(null);
+  const newestIdRef = useRef<string>();
+  const oldestIdRef = useRef<string>();
+  // Distance from the bottom when older history was requested, restored once it is prepended
+  const distanceFromBottomRef = useRef<number>();
   const [inputValue, setInputValue] = useState("");
   const [localError, setLocalError] = useState<string | undefined>();
   const [isClosingTicket, setIsClosingTicket] = useState(false);
@@ -30,9 +34,26 @@ export function ChatWindow({ onClose, support, onOpenTicket }: ChatWindowProps)
   useEffect(() => {
     const container = scrollRef.current;
     if (!container) return;
-    container.scrollTop = container.scrollHeight;
+    const newestId = sortedMessages[sortedMessages.length - 1]?.id;
+    const oldestId = sortedMessages[0]?.id;
+    if (newestId !== newestIdRef.current) {
+      container.scrollTop = container.scrollHeight;
+    } else if (oldestId !== oldestIdRef.current && distanceFromBottomRef.current !== undefined) {
+      container.scrollTop = container.scrollHeight - distanceFromBottomRef.current;
+      distanceFromBottomRef.current = undefined;
+    }
+    newestIdRef.current = newestId;
+    oldestIdRef.current = oldestId;
   }, [sortedMessages]);
 
+  const handleScroll = () => {
+    const container = scrollRef.current;
+    if (!container || container.scrollTop > 48 || !support.hasOlderMessages || support.isLoadingOlder) return;
+    if (!support.loadOlderMessages) return;
+    distanceFromBottomRef.current = container.scrollHeight - container.scrollTop;
+    void support.loadOlderMessages();
+  };
+
   const handleDragEnd = (_event: any, info: PanInfo) => {
     if (info.offset.y > 100 || info.velocity.y > 500) {
       onClose();
@@ -178,7 +199,7 @@ export function ChatWindow({ onClose, support, onOpenTicket }: ChatWindowProps)
           </div>
         </div>
 
-        <div ref={scrollRef} className="flex-1 overflow-y-auto px-6 py-4 space-y-4">
+        <div ref={scrollRef} onScroll={handleScroll} className="flex-1 overflow-y-auto px-6 py-4 space-y-4">
           {!showConversation ? (
             <div className="flex flex-col items-center gap-3 text-center" style={{ color: "#55595F", fontSize: "14px" }}>
               {hasTicket
@@ -187,6 +208,11 @@ export function ChatWindow({ onClose, support, onOpenTicket }: ChatWindowProps)
             </div>
           ) : (
             <>
+              {support.isLoadingOlder && (
+                <div className="text-center" style={{ color: "#55595F", fontSize: "13px" }}>
+                  Loading earlier messages...
+                </div>
+              )}
               {sortedMessages.map((message) => (
                 <div
                   key={`${message.id}-${message.createdAt}`}
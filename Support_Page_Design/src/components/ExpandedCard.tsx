@@ -16,7 +16,10 @@ export interface SupportBindings {
   error?: string;
   ticketStatus?: "open" | "claimed" | "closed";
   ticketId?: number;
+  hasOlderMessages?: boolean;
+  isLoadingOlder?: boolean;
   refresh: () => Promise<void>;
+  loadOlderMessages?: () => Promise<void>;
   sendMessage: (text: string) => Promise<void>;
   submitTicket: (data: TicketData) => Promise<void>;
   startNewConversation?: () => Promise<void>;
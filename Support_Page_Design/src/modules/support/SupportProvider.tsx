@@ -8,36 +8,70 @@ interface SupportContextValue extends SupportState {
   sendChatMessage: (text: string) => Promise<void>;
   submitTicket: (input: TicketFormInput) => Promise<void>;
   refreshAll: () => Promise<void>;
+  loadOlderMessages: () => Promise<void>;
   startNewConversation: () => Promise<void>;
   closeTicket: () => Promise<void>;
 }
 
 const SupportContext = createContext<SupportContextValue | undefined>(undefined);
 
-function mapSnapshot(snapshot: ConversationSnapshot): { ticket?: SupportTicket; messages: SupportMessage[] } {
+// Used until the server has sent a poll hint
+const DEFAULT_POLL_MS = 1500;
+// Background tabs never poll more often than this
+const HIDDEN_TAB_POLL_MS = 30000;
+
+function mapSnapshot(snapshot: ConversationSnapshot): { ticket?: SupportTicket; messages: SupportMessage[]; hasMore: boolean } {
   const messages = (snapshot.messages ?? []).map((message) => ({
     ...message,
     id: String(message.id)
   }));
   return {
     ticket: snapshot.ticket,
-    messages: messages.sort((a, b) => a.createdAt.localeCompare(b.createdAt))
+    messages: messages.sort((a, b) => a.createdAt.localeCompare(b.createdAt)),
+    hasMore: snapshot.hasMore ?? false
   };
 }
 
+/**
+ * Polls return only the latest window of messages: keep the older pages already loaded
+ * as long as the window still overlaps them, otherwise start over from the window.
+ */
+function mergeLatest(
+  previous: SupportMessage[],
+  previousHasOlder: boolean,
+  latest: SupportMessage[],
+  latestHasMore: boolean
+): { messages: SupportMessage[]; hasOlderMessages: boolean } {
+  if (!latestHasMore || latest.length === 0) {
+    return { messages: latest, hasOlderMessages: latestHasMore };
+  }
+  const windowStart = Math.min(...latest.map((message) => Number(message.id)));
+  const older = previous.filter((message) => Number(message.id) < windowStart);
+  const overlaps = previous.some((message) => Number(message.id) >= windowStart);
+  if (older.length === 0 || !overlaps) {
+    return { messages: latest, hasOlderMessages: true };
+  }
+  return { messages: [...older, ...latest], hasOlderMessages: previousHasOlder };
+}
+
 const initialState: SupportState = {
   messages: [],
   isInitializing: true,
   isSending: false,
   isSubmittingTicket: false,
   isTyping: false,
-  isConnected: false
+  isConnected: false,
+  hasOlderMessages: false,
+  isLoadingOlder: false
 };
 
 export function SupportProvider({ children }: { children: ReactNode }) {
   const { session, isLoading: isSessionLoading, error: sessionError, refresh, reset } = useSupportSession();
   const [state, setState] = useState<SupportState>(() => ({ ...initialState }));
   const stateRef = useRef(state);
+  const nextPollRef = useRef(DEFAULT_POLL_MS);
+  const pollTimerRef = useRef<ReturnType<typeof setTimeout>>();
+  const pollTickRef = useRef<() => void>(() => {});
 
   useEffect(() => {
     stateRef.current = state;
@@ -47,6 +81,13 @@ export function SupportProvider({ children }: { children: ReactNode }) {
     setState((prev) => ({ ...prev, error: message }));
   }, []);
 
+  const schedulePoll = useCallback((delay?: number) => {
+    clearTimeout(pollTimerRef.current);
+    const hinted = nextPollRef.current;
+    const wait = delay ?? (typeof document !== "undefined" && document.hidden ? Math.max(hinted, HIDDEN_TAB_POLL_MS) : hinted);
+    pollTimerRef.current = setTimeout(() => pollTickRef.current(), wait);
+  }, []);
+
   const ensureSession = useCallback(async () => {
     if (session) {
       return session;
@@ -73,10 +114,13 @@ export function SupportProvider({ children }: { children: ReactNode }) {
     try {
       const snapshot = await fetchConversation(session.sessionId);
       const mapped = mapSnapshot(snapshot);
+      // Follow the server's hint: it tightens after agent replies and backs off on idle or closed tickets
+      nextPollRef.current = snapshot.nextPollMs ?? DEFAULT_POLL_MS;
+      schedulePoll();
       setState((prev) => ({
         ...prev,
         ticket: mapped.ticket,
-        messages: mapped.messages,
+        ...mergeLatest(prev.messages, prev.hasOlderMessages, mapped.messages, mapped.hasMore),
         isInitializing: false,
         isConnected: true,
         error: undefined
@@ -92,12 +136,13 @@ export function SupportProvider({ children }: { children: ReactNode }) {
         ...prev,
         ticket: undefined,
         messages: [],
+        hasOlderMessages: false,
         isInitializing: false,
         isConnected: false,
         error: message
       }));
     }
-  }, [session, reset, refresh]);
+  }, [session, reset, refresh, schedulePoll]);
 
   useEffect(() => {
     void loadConversation();
@@ -108,7 +153,7 @@ export function SupportProvider({ children }: { children: ReactNode }) {
       return;
     }
 
-    const interval = setInterval(async () => {
+    pollTickRef.current = async () => {
       if (!stateRef.current.isSending && !stateRef.current.isSubmittingTicket) {
         const previousMessages = stateRef.current.messages;
         const previousAgentMessageCount = previousMessages.filter(m => m.sender === "agent").length;
@@ -124,17 +169,55 @@ export function SupportProvider({ children }: { children: ReactNode }) {
           setState((prev) => ({ ...prev, isTyping: false }));
         }
       }
-    }, 1500);
+      // Also rearms the timer when the fetch failed or was skipped
+      schedulePoll();
+    };
+    schedulePoll();
+
+    // Catch up as soon as the tab is visible again; stretch the wait when it is hidden
+    const onVisibilityChange = () => schedulePoll(document.hidden ? undefined : 0);
+    document.addEventListener("visibilitychange", onVisibilityChange);
 
     return () => {
-      clearInterval(interval);
+      clearTimeout(pollTimerRef.current);
+      pollTickRef.current = () => {};
+      document.removeEventListener("visibilitychange", onVisibilityChange);
     };
-  }, [session, loadConversation]);
+  }, [session, loadConversation, schedulePoll]);
 
   const refreshAll = useCallback(async () => {
     await loadConversation();
   }, [loadConversation]);
 
+  const loadOlderMessages = useCallback(async () => {
+    const current = stateRef.current;
+    if (!session || !current.hasOlderMessages || current.isLoadingOlder || current.messages.length === 0) {
+      return;
+    }
+    const oldestId = current.messages.reduce(
+      (oldest, message) => (Number(message.id) < Number(oldest) ? message.id : oldest),
+      current.messages[0].id
+    );
+    stateRef.current = { ...current, isLoadingOlder: true };
+    setState((prev) => ({ ...prev, isLoadingOlder: true }));
+
+    try {
+      const page = mapSnapshot(await fetchConversation(session.sessionId, oldestId));
+      setState((prev) => {
+        const held = new Set(prev.messages.map((message) => message.id));
+        return {
+          ...prev,
+          messages: [...page.messages.filter((message) => !held.has(message.id)), ...prev.messages],
+          hasOlderMessages: page.hasMore,
+          isLoadingOlder: false
+        };
+      });
+    } catch (error) {
+      const message = error instanceof Error ? error.message : "Failed to load older messages";
+      setState((prev) => ({ ...prev, isLoadingOlder: false, error: message }));
+    }
+  }, [session]);
+
   const sendChatMessage = useCallback(
     async (text: string) => {
       const trimmed = text.trim();
@@ -245,11 +328,14 @@ export function SupportProvider({ children }: { children: ReactNode }) {
     isSubmittingTicket: state.isSubmittingTicket,
     isTyping: state.isTyping,
     isConnected: state.isConnected,
+    hasOlderMessages: state.hasOlderMessages,
+    isLoadingOlder: state.isLoadingOlder,
     error: state.error ?? sessionError,
     isSessionLoading,
     sendChatMessage,
     submitTicket,
     refreshAll,
+    loadOlderMessages,
     startNewConversation,
     closeTicket
   };
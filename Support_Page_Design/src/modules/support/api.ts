@@ -67,8 +67,10 @@ export async function createSupportSession(): Promise<SupportSession> {
   };
 }
 
-export async function fetchConversation(sessionId: string): Promise<ConversationSnapshot> {
-  return request<ConversationSnapshot>(`/session/${sessionId}`);
+/** Latest messages of the conversation, or the page before `beforeId` when scrolling back */
+export async function fetchConversation(sessionId: string, beforeId?: string): Promise<ConversationSnapshot> {
+  const query = beforeId ? `?before_id=${encodeURIComponent(beforeId)}` : "";
+  return request<ConversationSnapshot>(`/session/${sessionId}${query}`);
 }
 
 export async function sendVisitorMessage(sessionId: string, payload: MessagePayload) {
@@ -44,10 +44,17 @@ export interface SupportState {
   isSubmittingTicket: boolean;
   isTyping: boolean;
   isConnected: boolean;
+  /** Messages older than the first one held exist on the server */
+  hasOlderMessages: boolean;
+  isLoadingOlder: boolean;
   error?: string;
 }
 
 export interface ConversationSnapshot {
   ticket?: SupportTicket;
   messages: SupportMessage[];
+  /** Older messages exist before the first one returned */
+  hasMore?: boolean;
+  /** Server hint: how long to wait before polling again */
+  nextPollMs?: number;
 }